@@ -1,22 +1,52 @@
-from flask import Flask, render_template, request, jsonify, redirect, Response
+from flask import Flask, render_template, request, jsonify, redirect, Response, g, send_file
 from flask_socketio import SocketIO, emit, join_room, leave_room
 import json
 import os
+import hmac
+import inspect
+from functools import wraps
 from datetime import datetime
 import openai
 import threading
 import time
 import uuid
+import re
+import itertools
+import atexit
 # 导入川小农助手类
 from scau_assistant import SCAUAssistant
 # 导入腾讯视频爬虫模块
 from tencent_video_crawler import TencentVideoCrawler
 # 导入数据库管理器
-from database import db_manager
+from database import db_manager, DatabaseManager, DEFAULT_ROOM, EXPORT_FORMATS
 # 导入音乐天气API
 from music_weather_api import MusicWeatherAPI
 # 导入新闻API
 import news_api
+# 导入@命令路由
+from command_router import CommandRouter, CommandContext
+# 导入登录认证服务
+from auth_service import AuthService, AuthBusyError
+# 导入会话活跃时间记录
+from session_activity import SessionActivityTracker
+# 导入后台维护任务调度
+from maintenance import MaintenanceScheduler, parse_window
+# 导入音频资源库
+from audio_assets import AudioLibrary
+# 导入音频波形峰值索引
+from audio_peaks import AudioPeaksIndex, DEFAULT_POINTS
+# 导入本地音乐索引
+from music_index import MusicIndex
+# 导入知识库关键词匹配
+from knowledge_matcher import KnowledgeMatcher, load_entries, entries_from_assistant
+# 导入知识库BM25检索
+from knowledge_retrieval import KnowledgeRetriever
+# 导入AI回答语义缓存
+from semantic_cache import SemanticCache
+# 导入配置服务
+from config_service import ConfigService
+# 导入运行指标
+import metrics
 
 # 初始化视频爬虫
 video_crawler = TencentVideoCrawler(
@@ -25,44 +55,811 @@ video_crawler = TencentVideoCrawler(
     max_workers=5
 )
 
+# 配置文件（DAIP_CONFIG_FILE，默认为项目目录下的 config.json）只解析一次，
+# 后台线程监视文件变化并自动重新加载，订阅了配置段的模块随之更新
+CONFIG_FILE = os.environ.get(
+    'DAIP_CONFIG_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json'))
+config_service = ConfigService(CONFIG_FILE)
+config_service.start()
+atexit.register(config_service.stop)
+
 # 创建川小农助手实例
 assistant = SCAUAssistant()
 
+# 知识库关键词自动机，启动时构建一次：助手自带的知识库加上本地知识库文件（DAIP_KNOWLEDGE_FILE），
+# 助手的条目排在前面，得分和命中词数都相同时优先用助手的回答
+KNOWLEDGE_FILE = os.environ.get(
+    'DAIP_KNOWLEDGE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scau_knowledge.json'))
+knowledge_entries = entries_from_assistant(assistant) + load_entries(KNOWLEDGE_FILE)
+knowledge_matcher = KnowledgeMatcher(knowledge_entries)
+# 知识库BM25检索：置信度达到 knowledge.threshold 的问题直接本地回答，
+# 其余问题带上检索到的资料再请求大模型，回答长度上限降为 ai.grounded_max_tokens
+knowledge_retriever = KnowledgeRetriever(
+    knowledge_entries, threshold=config_service.get('knowledge')['threshold'])
+# 大模型回答的语义缓存：问题与已回答问题的余弦相似度达到 semantic_cache.threshold 时
+# 直接返回缓存的回答，内存上限 semantic_cache.max_mb，回答缓存 semantic_cache.ttl 秒
+SEMANTIC_CACHE_CONFIG = config_service.get('semantic_cache')
+semantic_cache = SemanticCache(
+    threshold=SEMANTIC_CACHE_CONFIG['threshold'],
+    max_bytes=int(SEMANTIC_CACHE_CONFIG['max_mb'] * 1024 * 1024),
+    ttl=SEMANTIC_CACHE_CONFIG['ttl'])
+
+def apply_knowledge_config(section):
+    """配置文件中的知识库检索设置变化时更新直接回答的阈值"""
+    knowledge_retriever.threshold = section['threshold']
+
+def apply_semantic_cache_config(section):
+    """配置文件中的语义缓存设置变化时更新阈值、内存上限和有效期"""
+    semantic_cache.configure(
+        threshold=section['threshold'],
+        max_bytes=int(section['max_mb'] * 1024 * 1024),
+        ttl=section['ttl'])
+
+config_service.subscribe(apply_knowledge_config, 'knowledge')
+config_service.subscribe(apply_semantic_cache_config, 'semantic_cache')
+
 # 创建音乐天气API实例
 music_weather_api = MusicWeatherAPI()
 
-# AI模型配置
-AI_CONFIG = {
-    'api_key': 'sk-jnmakzcrkwfvgbymzrcwurcltdcyxojmsgqrgnvnkqjrdhwh',
-    'model_name': 'Qwen/Qwen2.5-7B-Instruct',
-    'api_url': 'https://api.siliconflow.cn/v1/',
-    'base_url': 'https://api.siliconflow.cn/v1/'
-}
+# AI模型配置（config.json 的 ai 段）
+AI_CONFIG = config_service.get('ai')
+if not AI_CONFIG['api_key']:
+    print("未设置AI接口密钥，请通过环境变量 DAIP_AI_API_KEY 或 config.json 的 ai.api_key 提供")
 
 # 初始化OpenAI客户端
 openai_client = openai.OpenAI(
     api_key=AI_CONFIG['api_key'],
-    base_url=AI_CONFIG['base_url']
+    base_url=AI_CONFIG['base_url'],
+    timeout=AI_CONFIG['timeout'],
+    max_retries=AI_CONFIG['max_retries']
 )
 
+def apply_ai_config(section):
+    """配置文件中的AI设置变化时更新模型参数，接口地址、密钥或超时设置变化时重新创建客户端"""
+    global AI_CONFIG, openai_client
+    client_keys = ('api_key', 'base_url', 'timeout', 'max_retries')
+    if any(section[key] != AI_CONFIG[key] for key in client_keys):
+        openai_client = openai.OpenAI(api_key=section['api_key'], base_url=section['base_url'],
+                                      timeout=section['timeout'], max_retries=section['max_retries'])
+    AI_CONFIG = section
+    print(f"AI配置已更新: 模型 {section['model_name']}")
+
+config_service.subscribe(apply_ai_config, 'ai')
+
+# 运行指标定义
+HTTP_REQUEST_SECONDS = metrics.registry.histogram(
+    'daip_http_request_duration_seconds', 'Flask路由处理耗时', ('route', 'method', 'status'))
+SOCKETIO_EVENT_SECONDS = metrics.registry.histogram(
+    'daip_socketio_event_duration_seconds', 'Socket.IO事件处理耗时', ('event',))
+SOCKETIO_EMIT_TOTAL = metrics.registry.counter(
+    'daip_socketio_emit_total', 'Socket.IO发送事件次数', ('event',))
+SOCKETIO_EMIT_BYTES = metrics.registry.histogram(
+    'daip_socketio_emit_payload_bytes', 'Socket.IO发送负载大小（抽样）', ('event',),
+    buckets=metrics.DEFAULT_SIZE_BUCKETS)
+DB_CALL_SECONDS = metrics.registry.histogram(
+    'daip_db_call_duration_seconds', 'DatabaseManager方法调用耗时', ('method',))
+LLM_REQUEST_SECONDS = metrics.registry.histogram(
+    'daip_llm_request_duration_seconds', 'AI大模型请求总耗时', ('mode', 'outcome'))
+LLM_TTFT_SECONDS = metrics.registry.histogram(
+    'daip_llm_time_to_first_token_seconds', 'AI大模型流式回复首个token耗时')
+AI_ANSWER_SECONDS = metrics.registry.histogram(
+    'daip_ai_answer_duration_seconds', '@川小农回答耗时（local=本地知识库直接回答）', ('source',))
+UPSTREAM_SECONDS = metrics.registry.histogram(
+    'daip_upstream_call_duration_seconds', '上游服务（天气、音乐、新闻、视频）调用耗时', ('service', 'method'))
+metrics.registry.gauge(
+    'daip_online_users', '在线用户数', function=lambda: len(online_users))
+metrics.registry.gauge(
+    'daip_room_online_users', '各聊天室在线用户数', ('room',),
+    function=lambda: {room: len(members) for room, members in list(room_members.items())})
+metrics.registry.gauge(
+    'daip_command_queue_depth', '各@命令执行中和排队中的调用数', ('command',),
+    function=lambda: {stats['name']: stats['pending'] for stats in command_router.get_stats()})
+metrics.registry.gauge(
+    'daip_semantic_cache_hit_ratio', 'AI回答语义缓存命中率', function=lambda: semantic_cache.hit_rate)
+metrics.registry.gauge(
+    'daip_auth_pending', '执行中和排队中的密码哈希任务数', function=lambda: auth_service.pending)
+metrics.registry.gauge(
+    'daip_auth_rejected', '因认证繁忙被拒绝的登录和注册请求数', function=lambda: auth_service.stats['rejected'])
+
+# 每N次emit抽样序列化一次负载来统计大小，避免每次发送都多做一次JSON编码
+EMIT_SIZE_SAMPLE_RATE = 16
+_emit_sequence = itertools.count()
+
+class InstrumentedSocketIO(SocketIO):
+    """为事件处理耗时和emit次数、负载大小埋点的SocketIO"""
+    
+    def on(self, message, namespace=None):
+        register = super().on(message, namespace)
+        child = SOCKETIO_EVENT_SECONDS.labels(message)
+        
+        def decorator(handler):
+            register(metrics.timed(handler, child))
+            return handler
+        return decorator
+    
+    def emit(self, event, *args, **kwargs):
+        SOCKETIO_EMIT_TOTAL.labels(event).inc()
+        if args and next(_emit_sequence) % EMIT_SIZE_SAMPLE_RATE == 0:
+            payload = json.dumps(args[0], ensure_ascii=False, default=str)
+            SOCKETIO_EMIT_BYTES.labels(event).observe(len(payload.encode('utf-8')))
+        return super().emit(event, *args, **kwargs)
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'daipp_secret_key'
-socketio = SocketIO(app, cors_allowed_origins="*")
+# 前面有nginx/Apache时设置 DAIP_X_SENDFILE=1，由前端服务器零拷贝发送音频文件并处理Range
+app.config['USE_X_SENDFILE'] = os.environ.get('DAIP_X_SENDFILE') == '1'
+socketio = InstrumentedSocketIO(app, cors_allowed_origins="*")
+
+# 设置环境变量 DAIP_QUERY_PROFILING=1 开启SQL慢查询分析
+if os.environ.get('DAIP_QUERY_PROFILING') == '1':
+    db_manager.enable_query_profiling(
+        slow_threshold_ms=float(os.environ.get('DAIP_SLOW_QUERY_MS', '100')))
+
+# 设置环境变量 DAIP_PARTITION_DIR 开启按月分区存储，已结束的月份每隔
+# DAIP_PARTITION_INTERVAL 秒移动到该目录下的只读分区文件
+PARTITION_DIR = os.environ.get('DAIP_PARTITION_DIR')
+PARTITION_INTERVAL = float(os.environ.get('DAIP_PARTITION_INTERVAL', '21600'))
+if PARTITION_DIR:
+    db_manager.enable_partitioning(PARTITION_DIR)
+
+# 设置环境变量 DAIP_COMPACT_PAYLOADS=1 开启大字段压缩存储，
+# 超过 DAIP_PAYLOAD_THRESHOLD 字节的长文本移出主表
+if os.environ.get('DAIP_COMPACT_PAYLOADS') == '1':
+    db_manager.enable_compact_payloads(int(os.environ.get('DAIP_PAYLOAD_THRESHOLD', '1024')))
+
+# 设置环境变量 DAIP_STAT_COUNTERS=1 开启增量维护的统计计数器表（首次开启时回填一次）
+if os.environ.get('DAIP_STAT_COUNTERS') == '1' and not db_manager.stat_counters_enabled:
+    db_manager.enable_stat_counters()
+
+# 为数据库调用埋点，要在把 db_manager 的方法登记为维护任务之前替换，否则任务拿到的是未埋点的方法。
+# 生成器方法（iter_export 等）只会计到创建生成器的耗时，不埋点
+metrics.instrument_methods(
+    db_manager, DB_CALL_SECONDS,
+    [name for name in dir(DatabaseManager)
+     if not name.startswith('_') and name not in ('get_connection', 'init_database')
+     and callable(getattr(DatabaseManager, name))
+     and not inspect.isgeneratorfunction(getattr(DatabaseManager, name))])
+
+# 后台维护任务由一个调度线程依次执行：重任务只在低峰时段 DAIP_MAINTENANCE_WINDOW
+# （本地时间，例如 2-6，留空表示不限）执行，数据库繁忙时推迟
+maintenance = MaintenanceScheduler(
+    db_manager,
+    window=parse_window(os.environ.get('DAIP_MAINTENANCE_WINDOW', '2-6')),
+    max_active_connections=int(os.environ.get('DAIP_MAINTENANCE_MAX_CONNECTIONS', '4')))
+
+# 消息汇总表的后台整理间隔（秒），设置 DAIP_ROLLUP_INTERVAL=0 关闭
+ROLLUP_INTERVAL = float(os.environ.get('DAIP_ROLLUP_INTERVAL', '10'))
+ROLLUP_BATCH_SIZE = 50000
+
+def compact_rollups():
+    """把新消息累加到按分钟、小时、天汇总的统计表"""
+    total = 0
+    # 积压较多时分批追平，每批单独提交以缩短写锁时间
+    while True:
+        added = db_manager.compact_rollups(ROLLUP_BATCH_SIZE)
+        total += added
+        if added < ROLLUP_BATCH_SIZE:
+            return {'messages': total}
+
+if ROLLUP_INTERVAL > 0:
+    maintenance.add_job('rollups', compact_rollups, ROLLUP_INTERVAL,
+                        description='累加消息汇总统计')
+
+# 消息保留期清理：DAIP_RETENTION_DAYS 为保留天数（0 关闭），
+# DAIP_RETENTION_ARCHIVE 为删除前的归档位置（.db 归档到SQLite，否则为 .jsonl.gz）
+RETENTION_DAYS = int(os.environ.get('DAIP_RETENTION_DAYS', '0'))
+RETENTION_INTERVAL = float(os.environ.get('DAIP_RETENTION_INTERVAL', '3600'))
+RETENTION_ARCHIVE = os.environ.get('DAIP_RETENTION_ARCHIVE') or None
+
+def run_retention_cleanup():
+    """分批清理超过保留期的消息"""
+    if db_manager.retention_status.get('running'):
+        return {'skipped': '保留期清理正在进行'}
+    if not db_manager.cleanup_old_messages(RETENTION_DAYS, archive=RETENTION_ARCHIVE):
+        raise RuntimeError(db_manager.retention_status.get('error') or '保留期清理失败')
+    return {'deleted': db_manager.retention_status.get('deleted')}
+
+if RETENTION_DAYS > 0:
+    maintenance.add_job('retention', run_retention_cleanup, RETENTION_INTERVAL,
+                        low_traffic_only=True, description='清理超过保留期的消息')
+
+if PARTITION_DIR:
+    maintenance.add_job('partitions', db_manager.seal_partitions, PARTITION_INTERVAL,
+                        low_traffic_only=True, description='把已结束月份的消息移动到分区')
+
+# 定期在线备份：DAIP_BACKUP_INTERVAL 为备份间隔秒数（0 关闭），保留最近 DAIP_BACKUP_KEEP 个
+BACKUP_DIR = os.environ.get('DAIP_BACKUP_DIR', 'backups')
+BACKUP_INTERVAL = float(os.environ.get('DAIP_BACKUP_INTERVAL', '0'))
+BACKUP_KEEP = int(os.environ.get('DAIP_BACKUP_KEEP', '7'))
+
+def run_backup():
+    """分页备份数据库"""
+    if db_manager.backup_status.get('running'):
+        return {'skipped': '数据库备份正在进行'}
+    if not db_manager.backup_database(BACKUP_DIR, keep=BACKUP_KEEP):
+        raise RuntimeError(db_manager.backup_status.get('error') or '数据库备份失败')
+    return {'path': db_manager.backup_status.get('path')}
+
+if BACKUP_INTERVAL > 0:
+    maintenance.add_job('backup', run_backup, BACKUP_INTERVAL, description='在线备份数据库')
+
+# SQLite日常维护：统计信息、空闲页回收、WAL检查点和完整性检查（间隔为0表示关闭）
+OPTIMIZE_INTERVAL = float(os.environ.get('DAIP_OPTIMIZE_INTERVAL', '3600'))
+VACUUM_INTERVAL = float(os.environ.get('DAIP_VACUUM_INTERVAL', '3600'))
+VACUUM_PAGES = int(os.environ.get('DAIP_VACUUM_PAGES', '2000'))
+CHECKPOINT_INTERVAL = float(os.environ.get('DAIP_CHECKPOINT_INTERVAL', '300'))
+INTEGRITY_INTERVAL = float(os.environ.get('DAIP_INTEGRITY_INTERVAL', '600'))
+
+if OPTIMIZE_INTERVAL > 0:
+    maintenance.add_job('optimize', db_manager.optimize_statistics, OPTIMIZE_INTERVAL,
+                        low_traffic_only=True, description='PRAGMA optimize 更新过时的统计信息')
+if VACUUM_INTERVAL > 0:
+    maintenance.add_job('incremental_vacuum', lambda: db_manager.incremental_vacuum(VACUUM_PAGES),
+                        VACUUM_INTERVAL, low_traffic_only=True, description='分批回收空闲页')
+if CHECKPOINT_INTERVAL > 0:
+    maintenance.add_job('wal_checkpoint', db_manager.checkpoint_wal, CHECKPOINT_INTERVAL,
+                        description='PASSIVE模式WAL检查点')
+if INTEGRITY_INTERVAL > 0:
+    # 增量检查只看新增的消息和会话，开销很小，不必等低峰时段
+    maintenance.add_job('integrity', db_manager.check_data_integrity, INTEGRITY_INTERVAL,
+                        description='增量数据完整性检查')
+
+maintenance.start()
+
+# 旧消息还没有毫秒时间戳时在后台分批回填
+if not db_manager.epoch_ms_ready:
+    threading.Thread(target=db_manager.backfill_created_ms, name='created-ms-backfill', daemon=True).start()
+
+# 登录认证服务：密码哈希在 DAIP_AUTH_WORKERS 个线程中执行，排队超过
+# DAIP_AUTH_MAX_PENDING 个时直接返回503，用户记录缓存 DAIP_AUTH_CACHE_TTL 秒
+auth_service = AuthService(
+    db_manager,
+    max_workers=int(os.environ.get('DAIP_AUTH_WORKERS', '0')) or None,
+    max_pending=int(os.environ.get('DAIP_AUTH_MAX_PENDING', '32')),
+    cache_ttl=float(os.environ.get('DAIP_AUTH_CACHE_TTL', '30')))
+# 认证繁忙时建议客户端等待的秒数
+AUTH_RETRY_AFTER = 2
+
+# 会话活动时间先记在内存中，每 DAIP_SESSION_FLUSH_INTERVAL 秒批量写入一次，进程退出时写入最后一批
+SESSION_FLUSH_INTERVAL = float(os.environ.get('DAIP_SESSION_FLUSH_INTERVAL', '5'))
+session_activity = SessionActivityTracker(db_manager, SESSION_FLUSH_INTERVAL)
+session_activity.start()
+atexit.register(session_activity.stop)
+
+# 静态音频及其压缩变体，启动时在后台生成缺失的变体
+AUDIO_DIR = os.path.join(app.root_path, 'static', 'audio')
+audio_library = AudioLibrary(AUDIO_DIR, peaks_prefix='/api/audio')
+# 音频时长和波形，按文件内容哈希缓存
+audio_peaks = AudioPeaksIndex(AUDIO_DIR)
+# 本地曲库索引，@音乐 搜索先查本地，命中时不请求上游接口
+music_index = MusicIndex(os.path.join(AUDIO_DIR, 'catalog.json'))
+# 本地曲库条目中返回给前端的字段
+MUSIC_CARD_FIELDS = ('name', 'singer', 'album', 'url')
+threading.Thread(target=audio_library.build, name='audio-variants', daemon=True).start()
+# 带内容哈希的音频地址内容永不改变，可以长期缓存
+AUDIO_IMMUTABLE_MAX_AGE = 365 * 86400
+AUDIO_NEGOTIATED_MAX_AGE = 3600
+
+# 为上游服务调用埋点
+metrics.instrument_methods(
+    music_weather_api, UPSTREAM_SECONDS, ['search_music', 'get_random_music'],
+    labels=lambda name: ('music', name))
+metrics.instrument_methods(
+    music_weather_api, UPSTREAM_SECONDS, ['get_weather_info', 'get_current_location_weather'],
+    labels=lambda name: ('weather', name))
+metrics.instrument_methods(
+    news_api, UPSTREAM_SECONDS,
+    ['get_recent_cctv_news', 'get_news_list', 'get_categories', 'get_trending_news', 'get_news_detail'],
+    labels=lambda name: ('news', name))
+metrics.instrument_methods(
+    video_crawler, UPSTREAM_SECONDS, ['get_random_free_video'],
+    labels=lambda name: ('movie', name))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = getattr(g, 'request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        HTTP_REQUEST_SECONDS.labels(route, request.method, str(response.status_code)).observe(
+            time.perf_counter() - start)
+    return response
 
 # 存储在线用户信息
 online_users = {}
 # 存储用户会话信息
 user_sessions = {}  # session_id -> nickname
-# 默认房间名
-DEFAULT_ROOM = 'chat_room'
+# 连接对应的会话（Socket.IO每个事件的 g 都是新的，不能用来在事件之间传递会话ID）
+sid_sessions = {}  # sid -> session_id
+# 房间在线成员
+room_members = {}  # room -> {nickname: sid}
+# 连接当前所在房间
+sid_rooms = {}  # sid -> room
+# 房间名校验规则：中英文、数字、下划线和短横线，1-32个字符
+ROOM_NAME_PATTERN = re.compile(r'^[\w\u4e00-\u9fa5\-]{1,32}$')
+
+def get_room_users(room):
+    """获取房间在线用户昵称列表"""
+    return list(room_members.get(room, {}).keys())
+
+def enter_room(nickname, sid, room):
+    """记录用户进入房间，返回之前所在的房间（没有则返回None）"""
+    previous_room = sid_rooms.get(sid)
+    if previous_room and previous_room != room:
+        exit_room(nickname, sid)
+    room_members.setdefault(room, {})[nickname] = sid
+    sid_rooms[sid] = room
+    return previous_room
+
+def exit_room(nickname, sid):
+    """记录用户离开当前房间，返回离开的房间（没有则返回None）"""
+    room = sid_rooms.pop(sid, None)
+    if room:
+        members = room_members.get(room, {})
+        if members.get(nickname) == sid:
+            del members[nickname]
+        if not members and room != DEFAULT_ROOM:
+            room_members.pop(room, None)
+    return room
+
+def current_room(sid):
+    """获取连接当前所在的房间"""
+    return sid_rooms.get(sid, DEFAULT_ROOM)
+
+# 运行指标
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus文本格式的运行指标"""
+    return Response(metrics.registry.render(),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# 统计接口缓存：(nickname, start_time, end_time) -> (过期时间, 统计结果)
+STATS_CACHE_TTL = 10
+_stats_cache = {}
+_stats_cache_lock = threading.Lock()
+
+@app.route('/api/stats', methods=['GET'])
+def get_stats():
+    """获取消息统计（结果缓存 STATS_CACHE_TTL 秒）"""
+    try:
+        key = (request.args.get('nickname'), request.args.get('start_time'), request.args.get('end_time'))
+        now = time.monotonic()
+        with _stats_cache_lock:
+            cached = _stats_cache.get(key)
+        if cached and cached[0] > now:
+            stats = cached[1]
+        else:
+            stats = db_manager.get_user_stats(*key)
+            with _stats_cache_lock:
+                # 丢弃过期条目，防止不同参数组合无限累积
+                for expired in [k for k, v in _stats_cache.items() if v[0] <= now]:
+                    del _stats_cache[expired]
+                _stats_cache[key] = (now + STATS_CACHE_TTL, stats)
+        
+        return jsonify({
+            'success': True,
+            'data': stats,
+            'counters_enabled': db_manager.stat_counters_enabled
+        })
+    except Exception as e:
+        print(f"获取统计信息失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+INTERVAL_PATTERN = re.compile(r'^(\d+)([smhd]?)$')
+INTERVAL_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+def parse_interval(value):
+    """解析统计间隔，例如 300、5m、1h、1d"""
+    match = INTERVAL_PATTERN.match(value.strip())
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"无效的统计间隔: {value}")
+    seconds = int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+    if seconds % 60:
+        raise ValueError("统计间隔必须是整分钟")
+    return seconds
+
+def parse_utc_time(value):
+    """解析UTC时间，支持秒级时间戳或 YYYY-MM-DD[ HH:MM[:SS]]"""
+    if value.isdigit():
+        return int(value)
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return int((datetime.strptime(value, fmt) - datetime(1970, 1, 1)).total_seconds())
+        except ValueError:
+            continue
+    raise ValueError(f"无效的时间: {value}")
+
+@app.route('/api/stats/timeseries', methods=['GET'])
+def get_stats_timeseries():
+    """
+    从汇总表获取消息数时间序列
+    参数: start、end（UTC，默认最近24小时）、interval（如5m、1h、1d）、
+    room、message_type、group_by（message_type、room、is_ai）
+    """
+    try:
+        end = request.args.get('end')
+        end = parse_utc_time(end) if end else (int(time.time()) // 60 + 1) * 60
+        start = request.args.get('start')
+        start = parse_utc_time(start) if start else end - 86400
+        interval = request.args.get('interval')
+        
+        data = db_manager.get_timeseries(
+            start, end,
+            interval=parse_interval(interval) if interval else None,
+            room=request.args.get('room'),
+            message_type=request.args.get('message_type'),
+            group_by=request.args.get('group_by')
+        )
+        return jsonify({
+            'success': True,
+            'data': data
+        })
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        print(f"获取消息时间序列失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# 管理接口鉴权
+def require_admin(view):
+    """
+    管理接口装饰器：请求头 X-Admin-Token（或 Authorization: Bearer <令牌>）必须与配置的管理令牌一致
+    令牌由环境变量 DAIP_ADMIN_TOKEN 或 config.json 的 admin.token 提供，未设置时拒绝所有管理请求
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        expected = config_service.get('admin')['token']
+        if not expected:
+            return jsonify({
+                'success': False,
+                'error': '未配置管理令牌（DAIP_ADMIN_TOKEN），管理接口已禁用'
+            }), 403
+        provided = request.headers.get('X-Admin-Token', '')
+        authorization = request.headers.get('Authorization', '')
+        if not provided and authorization.startswith('Bearer '):
+            provided = authorization[len('Bearer '):].strip()
+        if not hmac.compare_digest(provided.encode('utf-8'), expected.encode('utf-8')):
+            return jsonify({
+                'success': False,
+                'error': '管理令牌无效'
+            }), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+# 备份和恢复
+@app.route('/api/admin/backups', methods=['GET'])
+@require_admin
+def get_backups():
+    """获取备份列表和最近一次备份的进度"""
+    return jsonify({
+        'success': True,
+        'status': db_manager.backup_status,
+        'data': db_manager.list_backups(BACKUP_DIR)
+    })
+
+@app.route('/api/admin/backups', methods=['POST'])
+@require_admin
+def create_backup():
+    """在后台立即执行一次备份"""
+    if db_manager.backup_status.get('running'):
+        return jsonify({
+            'success': False,
+            'error': '数据库备份正在进行'
+        }), 409
+    threading.Thread(target=db_manager.backup_database,
+                     kwargs={'backup_dir': BACKUP_DIR, 'keep': BACKUP_KEEP},
+                     name='backup-manual', daemon=True).start()
+    return jsonify({
+        'success': True,
+        'message': '已开始备份'
+    }), 202
+
+@app.route('/api/admin/restore', methods=['POST'])
+@require_admin
+def restore_backup():
+    """从备份目录中的指定备份恢复数据库"""
+    data = request.get_json(silent=True) or {}
+    name = os.path.basename(str(data.get('name', '')))
+    backup = next((item for item in db_manager.list_backups(BACKUP_DIR) if item['name'] == name), None)
+    if not backup:
+        return jsonify({
+            'success': False,
+            'error': f'备份不存在: {name}'
+        }), 404
+    if not db_manager.restore_database(backup['path']):
+        return jsonify({
+            'success': False,
+            'error': '数据库恢复失败'
+        }), 500
+    return jsonify({
+        'success': True,
+        'message': f'已从 {name} 恢复数据库'
+    })
+
+# 大字段压缩存储
+@app.route('/api/admin/payloads', methods=['GET'])
+@require_admin
+def get_payload_stats():
+    """获取大字段压缩存储节省的空间"""
+    return jsonify({
+        'success': True,
+        'data': db_manager.get_payload_stats()
+    })
+
+@app.route('/api/admin/payloads', methods=['POST'])
+@require_admin
+def compact_payloads():
+    """在后台把已有消息中的大字段移出主表"""
+    threading.Thread(target=db_manager.compact_message_payloads,
+                     name='payload-compaction', daemon=True).start()
+    return jsonify({
+        'success': True,
+        'message': '已开始整理已有消息的大字段'
+    }), 202
+
+# 分区存储
+@app.route('/api/admin/partitions', methods=['GET'])
+@require_admin
+def get_partitions():
+    """获取已有的月分区"""
+    if not db_manager.partitions:
+        return jsonify({
+            'success': True,
+            'enabled': False,
+            'data': []
+        })
+    return jsonify({
+        'success': True,
+        'enabled': True,
+        'data': [{'month': month, 'file': db_manager.partitions.path_for(month)}
+                 for month in db_manager.partitions.list_months()]
+    })
+
+@app.route('/api/admin/partitions', methods=['POST'])
+@require_admin
+def seal_partitions():
+    """立即把已结束月份的消息移动到分区"""
+    if not db_manager.partitions:
+        return jsonify({
+            'success': False,
+            'error': '未开启分区存储'
+        }), 400
+    data = request.get_json(silent=True) or {}
+    sealed = db_manager.seal_partitions(keep_months=int(data.get('keep_months', 1)))
+    return jsonify({
+        'success': True,
+        'data': sealed
+    })
 
-# 读取配置文件
+# 保留期清理
+@app.route('/api/admin/retention', methods=['GET'])
+@require_admin
+def get_retention_status():
+    """获取最近一次保留期清理的进度和吞吐量"""
+    return jsonify({
+        'success': True,
+        'data': db_manager.retention_status
+    })
+
+@app.route('/api/admin/retention', methods=['POST'])
+@require_admin
+def run_retention():
+    """
+    在后台立即执行一次保留期清理
+    归档位置只能由 DAIP_RETENTION_ARCHIVE 配置，不接受请求参数，避免调用方指定任意服务器路径
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        days = int(data.get('days', RETENTION_DAYS or 30))
+        if days <= 0:
+            raise ValueError("保留天数必须大于0")
+        if db_manager.retention_status.get('running'):
+            return jsonify({
+                'success': False,
+                'error': '保留期清理正在进行'
+            }), 409
+        threading.Thread(target=db_manager.cleanup_old_messages,
+                         kwargs={'days': days, 'archive': RETENTION_ARCHIVE},
+                         name='retention-manual', daemon=True).start()
+        return jsonify({
+            'success': True,
+            'message': f'已开始清理 {days} 天前的消息'
+        }), 202
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+# 历史查询执行计划检查
+@app.route('/api/admin/query-plans', methods=['GET'])
+@require_admin
+def get_query_plans():
+    """检查历史查询的各种形状是否都走索引且不需要临时排序"""
+    result = db_manager.verify_query_plans()
+    return jsonify({
+        'success': result.get('ok', False),
+        'data': result
+    })
+
+# 慢查询分析
+@app.route('/api/admin/slow-queries', methods=['GET'])
+@require_admin
+def get_slow_queries():
+    """获取最慢的SQL查询形状及其执行计划"""
+    try:
+        top_n = int(request.args.get('top', 10))
+        order_by = request.args.get('order_by', 'total_ms')
+        return jsonify({
+            'success': True,
+            'data': db_manager.get_slow_queries(top_n, order_by)
+        })
+    except Exception as e:
+        print(f"获取慢查询失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# 后台维护任务
+@app.route('/api/admin/maintenance', methods=['GET'])
+@require_admin
+def get_maintenance_status():
+    """获取维护任务状态和执行历史"""
+    try:
+        limit = int(request.args.get('limit', 50))
+    except ValueError:
+        limit = 50
+    return jsonify({
+        'success': True,
+        'data': {
+            'low_traffic_now': maintenance.in_low_traffic_window(),
+            'load': db_manager.get_load(),
+            'jobs': maintenance.get_jobs(),
+            'history': maintenance.get_history(request.args.get('job'), limit)
+        }
+    })
+
+@app.route('/api/admin/maintenance', methods=['POST'])
+@require_admin
+def run_maintenance_job():
+    """让指定的维护任务立即执行一次"""
+    data = request.get_json(silent=True) or {}
+    name = data.get('job')
+    if not maintenance.run_now(name):
+        return jsonify({
+            'success': False,
+            'error': f'维护任务不存在: {name}'
+        }), 404
+    return jsonify({
+        'success': True,
+        'message': f'已安排执行维护任务 {name}'
+    }), 202
+
+# 数据完整性
+@app.route('/api/admin/integrity', methods=['GET'])
+@require_admin
+def get_integrity_status():
+    """获取缓存的完整性检查结果（增量检查由维护任务定期执行）"""
+    return jsonify({
+        'success': True,
+        'data': db_manager.get_integrity_status()
+    })
+
+@app.route('/api/admin/integrity', methods=['POST'])
+@require_admin
+def run_integrity_check():
+    """立即执行一次完整性检查，full=true 时全量检查"""
+    data = request.get_json(silent=True) or {}
+    result = db_manager.check_data_integrity(full=bool(data.get('full')))
+    return jsonify({
+        'success': result['status'] != 'error',
+        'data': result
+    })
+
+@app.route('/api/music/search', methods=['GET'])
+def search_local_music():
+    """在本地曲库中搜索音乐（支持拼音和模糊匹配）"""
+    keyword = (request.args.get('q') or '').strip()
+    try:
+        limit = max(1, min(int(request.args.get('limit', 5)), 50))
+    except ValueError:
+        limit = 5
+    return jsonify({
+        'success': True,
+        'data': [audio_library.resolve_music(item, request.headers.get('Accept'))
+                 for item in music_index.search(keyword, limit)],
+        'stats': music_index.get_stats()
+    })
+
+@app.route('/api/admin/sessions', methods=['GET'])
+@require_admin
+def get_session_activity_stats():
+    """获取会话活动合并写入的统计"""
+    return jsonify({
+        'success': True,
+        'data': session_activity.get_stats()
+    })
+
+@app.route('/api/admin/knowledge', methods=['GET'])
+@require_admin
+def get_knowledge_stats():
+    """获取知识库本地回答占比、检索耗时和关键词匹配统计"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'retrieval': knowledge_retriever.get_stats(),
+            'matcher': knowledge_matcher.get_stats()
+        }
+    })
+
+@app.route('/api/admin/semantic-cache', methods=['GET'])
+@require_admin
+def get_semantic_cache_stats():
+    """获取AI回答语义缓存的命中率、条目数和内存占用"""
+    return jsonify({
+        'success': True,
+        'data': semantic_cache.get_stats()
+    })
+
+@app.route('/api/admin/semantic-cache', methods=['POST'])
+@require_admin
+def clear_semantic_cache():
+    """清空AI回答语义缓存（知识库或提示词更新后使用）"""
+    semantic_cache.clear()
+    return jsonify({
+        'success': True,
+        'data': semantic_cache.get_stats()
+    })
+
+@app.route('/api/admin/config', methods=['GET'])
+@require_admin
+def get_config_status():
+    """获取当前配置（密钥已隐藏）和加载状态"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'config': config_service.snapshot(),
+            'status': config_service.get_stats()
+        }
+    })
+
+@app.route('/api/admin/config', methods=['POST'])
+@require_admin
+def reload_config():
+    """立即重新加载配置文件"""
+    loaded = config_service.reload(force=True)
+    status = config_service.get_stats()
+    return jsonify({
+        'success': loaded,
+        'data': status,
+        'error': None if loaded else status['last_error']
+    }), 200 if loaded else 400
+
+@app.route('/api/admin/auth', methods=['GET'])
+@require_admin
+def get_auth_stats():
+    """获取登录认证服务的排队、拒绝和缓存命中统计"""
+    return jsonify({
+        'success': True,
+        'data': auth_service.get_stats()
+    })
+
+# 读取配置文件（由配置服务缓存，文件变化时自动重新加载）
 def load_config():
-    config_path = 'config.json'
-    if os.path.exists(config_path):
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {'servers': []}
+    return config_service.get()
 
 # 主页路由（登录页）
 @app.route('/')
@@ -87,7 +884,11 @@ def register():
             return jsonify({'success': False, 'message': '用户名至少3个字符，密码至少6个字符'})
         
         # 创建用户
-        if db_manager.create_user(username, password):
+        try:
+            created = auth_service.register(username, password)
+        except AuthBusyError:
+            return auth_busy_response()
+        if created:
             return jsonify({'success': True, 'message': '注册成功，请登录'})
         else:
             return jsonify({'success': False, 'message': '用户名已存在'})
@@ -101,7 +902,8 @@ def chat():
     nickname = request.args.get('nickname')
     if not nickname:
         return redirect('/')
-    return render_template('chat.html', nickname=nickname)
+    room = request.args.get('room', DEFAULT_ROOM)
+    return render_template('chat.html', nickname=nickname, room=room)
 
 # 检查昵称是否可用
 @app.route('/check_nickname', methods=['POST'])
@@ -109,6 +911,13 @@ def check_nickname():
     nickname = request.json.get('nickname')
     return jsonify({'available': nickname not in online_users})
 
+def auth_busy_response():
+    """认证繁忙时的503响应"""
+    response = jsonify({'success': False, 'message': '登录人数较多，请稍后重试'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(AUTH_RETRY_AFTER)
+    return response
+
 # 登录验证路由
 @app.route('/login_validate', methods=['POST'])
 def login_validate():
@@ -117,7 +926,10 @@ def login_validate():
     server = request.form.get('server')
     
     # 验证用户名和密码
-    user_id = db_manager.verify_user_password(username, password)
+    try:
+        user_id = auth_service.verify(username, password)
+    except AuthBusyError:
+        return auth_busy_response()
     if user_id:
         # 用户名和密码验证成功
         return jsonify({'success': True, 'message': '登录成功'})
@@ -166,12 +978,17 @@ def update_user_status():
                         del online_users[sid]
                         print(f"清理虚拟用户 {nickname}，session_id: {sid}")
         
-        # 广播用户状态变化
+        # 广播用户状态变化（只通知用户所在房间）
+        user_room = DEFAULT_ROOM
+        for room_name, members in room_members.items():
+            if nickname in members:
+                user_room = room_name
+                break
         socketio.emit('user_status_change', {
             'nickname': nickname,
             'status': status,
             'online_users': list(online_users.values())
-        }, room=DEFAULT_ROOM, broadcast=True)
+        }, room=user_room)
         
         print(f"广播用户状态变化: {nickname} -> {status}, 当前在线用户: {list(online_users.values())}")
         
@@ -192,6 +1009,9 @@ def get_history():
         page = int(request.args.get('page', 1))
         page_size = int(request.args.get('page_size', 20))
         session_id = request.args.get('session_id')
+        room = request.args.get('room', DEFAULT_ROOM)
+        # preview=1 时长文本只返回预览
+        preview = request.args.get('preview') in ('1', 'true')
         
         # 计算偏移量
         offset = (page - 1) * page_size
@@ -200,7 +1020,9 @@ def get_history():
         messages = db_manager.get_message_history(
             nickname=nickname,
             limit=page_size,
-            offset=offset
+            offset=offset,
+            room=room,
+            preview=preview
         )
         
         return jsonify({
@@ -216,6 +1038,75 @@ def get_history():
             'error': str(e)
         }), 500
 
+@app.route('/api/search', methods=['GET'])
+def search_history():
+    """按关键词搜索聊天记录，参数: q、room、nickname、start_time、end_time、page、page_size"""
+    try:
+        keyword = request.args.get('q', '').strip()
+        if not keyword:
+            return jsonify({
+                'success': False,
+                'error': '搜索关键词不能为空'
+            }), 400
+        page = int(request.args.get('page', 1))
+        page_size = int(request.args.get('page_size', 20))
+        
+        messages = db_manager.search_messages(
+            keyword,
+            room=request.args.get('room'),
+            nickname=request.args.get('nickname'),
+            start_time=request.args.get('start_time'),
+            end_time=request.args.get('end_time'),
+            limit=page_size,
+            offset=(page - 1) * page_size
+        )
+        return jsonify({
+            'success': True,
+            'data': messages,
+            'page': page,
+            'page_size': page_size
+        })
+    except Exception as e:
+        print(f"搜索聊天记录失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+EXPORT_MIMETYPES = {
+    'json': 'application/json',
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+@app.route('/api/export', methods=['GET'])
+def export_history():
+    """
+    流式下载聊天记录，不限制条数
+    参数: format（json、jsonl、csv）、gzip=1、start_time、end_time、room（为空时导出全部聊天室）
+    """
+    format = request.args.get('format', 'jsonl').lower()
+    if format not in EXPORT_FORMATS:
+        return jsonify({
+            'success': False,
+            'error': f"不支持的导出格式: {format}"
+        }), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+    
+    filename = f"chat_messages_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
+    if compress:
+        filename += '.gz'
+    chunks = db_manager.iter_export(
+        format, compress,
+        start_time=request.args.get('start_time'),
+        end_time=request.args.get('end_time'),
+        room=request.args.get('room')
+    )
+    # 生成器逐块输出，响应以分块传输编码发送
+    return Response(chunks,
+                    mimetype='application/gzip' if compress else EXPORT_MIMETYPES[format],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
 @app.route('/api/history/sessions', methods=['GET'])
 def get_user_sessions():
     """获取用户会话列表"""
@@ -240,6 +1131,110 @@ def get_user_sessions():
             'error': str(e)
         }), 500
 
+# 聊天室相关路由
+@app.route('/api/rooms', methods=['GET'])
+def list_rooms():
+    """获取聊天室列表及在线人数"""
+    try:
+        rooms = db_manager.get_rooms()
+        for room in rooms:
+            room['online_count'] = len(room_members.get(room['name'], {}))
+        
+        return jsonify({
+            'success': True,
+            'data': rooms
+        })
+    except Exception as e:
+        print(f"获取聊天室列表失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/rooms', methods=['POST'])
+def create_room():
+    """创建聊天室"""
+    try:
+        data = request.get_json() or {}
+        name = (data.get('name') or '').strip()
+        if not ROOM_NAME_PATTERN.match(name):
+            return jsonify({
+                'success': False,
+                'error': '房间名只能包含中英文、数字、下划线和短横线，长度1-32个字符'
+            }), 400
+        
+        if not db_manager.create_room(name, data.get('nickname'), data.get('description')):
+            return jsonify({
+                'success': False,
+                'error': '房间已存在'
+            }), 409
+        
+        # 通知所有在线用户有新房间
+        socketio.emit('room_created', {'room': name, 'created_by': data.get('nickname')})
+        
+        return jsonify({
+            'success': True,
+            'data': db_manager.get_room(name)
+        })
+    except Exception as e:
+        print(f"创建聊天室失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/rooms/<room>/users', methods=['GET'])
+def get_room_online_users(room):
+    """获取聊天室在线用户"""
+    return jsonify({
+        'success': True,
+        'data': get_room_users(room)
+    })
+
+@app.route('/api/rooms/<room>/history', methods=['GET'])
+def get_room_history(room):
+    """获取指定聊天室的历史记录"""
+    try:
+        if not db_manager.get_room(room):
+            return jsonify({
+                'success': False,
+                'error': '房间不存在'
+            }), 404
+        
+        nickname = request.args.get('nickname')
+        page = int(request.args.get('page', 1))
+        page_size = int(request.args.get('page_size', 20))
+        offset = (page - 1) * page_size
+        
+        messages = db_manager.get_message_history(
+            nickname=nickname,
+            limit=page_size,
+            offset=offset,
+            room=room
+        )
+        
+        return jsonify({
+            'success': True,
+            'data': messages,
+            'room': room,
+            'page': page,
+            'page_size': page_size
+        })
+    except Exception as e:
+        print(f"获取房间历史记录失败: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/commands/stats', methods=['GET'])
+def get_command_stats():
+    """获取@命令执行统计（耗时分位数、错误、超时、拒绝次数）"""
+    return jsonify({
+        'success': True,
+        'data': command_router.get_stats()
+    })
+
 @app.route('/api/music/random', methods=['GET'])
 def get_random_music():
     """获取随机音乐API"""
@@ -248,7 +1243,7 @@ def get_random_music():
         if music_data:
             return jsonify({
                 'success': True,
-                'data': music_data
+                'data': audio_library.resolve_music(music_data, request.headers.get('Accept'))
             })
         else:
             return jsonify({
@@ -263,6 +1258,74 @@ def get_random_music():
         }), 500
 
 
+@app.route('/audio/<filename>', methods=['GET'])
+def serve_audio(filename):
+    """
+    发送音频，支持Range请求（206）和条件请求
+    <名称>.<哈希>.wav 为固定内容，长期缓存；<名称>.wav 按 Accept 选择客户端支持的最小变体，
+    可用 ?variant=original 指定变体；启动时变体尚未生成完则直接发送原始音频
+    """
+    resolved = audio_library.resolve_file(filename)
+    if not resolved:
+        return jsonify({
+            'success': False,
+            'error': f'音频不存在: {filename}'
+        }), 404
+    if resolved['hashed']:
+        name, variant = resolved['name'], resolved['variant']
+        max_age = AUDIO_IMMUTABLE_MAX_AGE
+    elif resolved.get('pending'):
+        # 变体还在后台生成，直接发送原始音频且不缓存，之后的请求再按 Accept 协商
+        name, variant = resolved['name'], resolved['variant']
+        max_age = 0
+    else:
+        name, variant = audio_library.negotiate(
+            resolved['stem'], request.headers.get('Accept'), request.args.get('variant'))
+        max_age = AUDIO_NEGOTIATED_MAX_AGE
+    response = send_file(audio_library.path_for(name, variant),
+                         mimetype=f"{variant['mime']}; codecs={variant['codecs']}",
+                         conditional=True, etag=variant['hash'], max_age=max_age)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if resolved['hashed']:
+        response.cache_control.immutable = True
+    else:
+        response.vary.add('Accept')
+    return response
+
+@app.route('/api/audio', methods=['GET'])
+def list_audio():
+    """获取所有本地音频的时长、采样率等信息"""
+    return jsonify({
+        'success': True,
+        'data': audio_peaks.list_audio()
+    })
+
+@app.route('/api/audio/<name>/peaks', methods=['GET'])
+def get_audio_peaks(name):
+    """获取音频的元数据和降采样波形，points 为波形点数（向上取到 POINT_SIZES 中的一档）"""
+    try:
+        points = int(request.args.get('points', DEFAULT_POINTS))
+        result = audio_peaks.get(name, points)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    if result is None:
+        return jsonify({
+            'success': False,
+            'error': f'音频不存在: {name}'
+        }), 404
+    response = jsonify({
+        'success': True,
+        'data': result
+    })
+    # 波形只取决于文件内容，以内容哈希作为ETag
+    response.set_etag(f"{result['hash']}-{result['points']}")
+    response.cache_control.public = True
+    response.cache_control.max_age = AUDIO_NEGOTIATED_MAX_AGE
+    return response.make_conditional(request)
+
 @app.route('/api/news/latest', methods=['GET'])
 def get_latest_news():
     """获取最新新闻API"""
@@ -442,515 +1505,533 @@ def handle_disconnect():
             disconnected_user = nickname
             break
     
+    # 关闭用户会话（与活动时间一起批量写入）
+    session_id = sid_sessions.pop(request.sid, None)
+    if session_id:
+        session_activity.close(session_id)
+        user_sessions.pop(session_id, None)
+    
     if disconnected_user:
         del online_users[disconnected_user]
-        # 关闭用户会话
-        for session_id, user_nickname in user_sessions.items():
-            if user_nickname == disconnected_user:
-                db_manager.close_session(session_id)
-                del user_sessions[session_id]
-                break
         
         # 通知房间内其他用户
+        room = exit_room(disconnected_user, request.sid) or DEFAULT_ROOM
         emit('user_left', {
             'nickname': disconnected_user,
-            'online_users': list(online_users.keys())
-        }, room=DEFAULT_ROOM, broadcast=True)
-        leave_room(DEFAULT_ROOM)
+            'online_users': get_room_users(room)
+        }, room=room, broadcast=True)
+        leave_room(room)
 
 @socketio.on('join_room')
 def handle_join_room(data):
     nickname = data['nickname']
+    room = (data.get('room') or DEFAULT_ROOM).strip()
+    if room != DEFAULT_ROOM and not db_manager.get_room(room):
+        emit('room_error', {'room': room, 'message': f'房间 {room} 不存在'})
+        return
     online_users[nickname] = request.sid
     
     # 获取会话ID和客户端IP
     from flask import g
-    session_id = getattr(g, 'session_id', str(uuid.uuid4()))
     client_ip = getattr(g, 'client_ip', request.remote_addr)
-    
-    # 创建用户会话
-    user_agent = request.headers.get('User-Agent', '')
-    db_manager.create_session(session_id, nickname, client_ip, user_agent)
+    session_id = sid_sessions.get(request.sid)
+    if session_id:
+        # 同一连接切换房间，沿用原会话
+        session_activity.touch(session_id)
+    else:
+        # 创建用户会话
+        session_id = getattr(g, 'session_id', None) or str(uuid.uuid4())
+        user_agent = request.headers.get('User-Agent', '')
+        db_manager.create_session(session_id, nickname, client_ip, user_agent)
+        sid_sessions[request.sid] = session_id
     user_sessions[session_id] = nickname
     
-    join_room(DEFAULT_ROOM)
+    previous_room = enter_room(nickname, request.sid, room)
+    if previous_room and previous_room != room:
+        leave_room(previous_room)
+    join_room(room)
+    
+    emit('room_joined', {'room': room, 'online_users': get_room_users(room)})
     
     # 发送欢迎消息
     emit('welcome', {
         'message': f'{nickname} 加入了聊天室！',
-        'online_users': list(online_users.keys())
-    }, room=DEFAULT_ROOM, broadcast=True)
+        'room': room,
+        'online_users': get_room_users(room)
+    }, room=room, broadcast=True)
 
-@socketio.on('send_message')
-def handle_send_message(data):
+@socketio.on('create_room')
+def handle_create_room(data):
+    """通过Socket创建聊天室"""
+    name = (data.get('room') or '').strip()
+    nickname = data.get('nickname')
+    if not ROOM_NAME_PATTERN.match(name):
+        emit('room_error', {'room': name, 'message': '房间名只能包含中英文、数字、下划线和短横线，长度1-32个字符'})
+        return
+    if not db_manager.create_room(name, nickname, data.get('description')):
+        emit('room_error', {'room': name, 'message': f'房间 {name} 已存在'})
+        return
+    socketio.emit('room_created', {'room': name, 'created_by': nickname})
+
+@socketio.on('switch_room')
+def handle_switch_room(data):
+    """切换到另一个聊天室"""
     nickname = data['nickname']
-    message = data['message']
+    room = (data.get('room') or DEFAULT_ROOM).strip()
+    if room != DEFAULT_ROOM and not db_manager.get_room(room):
+        emit('room_error', {'room': room, 'message': f'房间 {room} 不存在'})
+        return
     
-    # 获取会话ID
-    from flask import g
-    session_id = getattr(g, 'session_id', None)
-    client_ip = getattr(g, 'client_ip', request.remote_addr)
+    previous_room = enter_room(nickname, request.sid, room)
+    if previous_room == room:
+        emit('room_joined', {'room': room, 'online_users': get_room_users(room)})
+        return
     
-    # 获取消息类型和特性
-    is_at = message.startswith('@')
-    is_ai = False
-    is_movie = False
-    message_type = 'text'
-    movie_url = None
-    movie_info = None
+    if previous_room:
+        leave_room(previous_room)
+        emit('user_left', {
+            'nickname': nickname,
+            'message': f'{nickname} 离开了房间',
+            'online_users': get_room_users(previous_room)
+        }, room=previous_room, broadcast=True)
     
-    # 检查是否为@命令
-    if message.startswith('@'):
-        message_type = 'at'
-        
-        # 简单处理@命令
-        if '@川小农' in message:
-            # 提取用户问题
-            question = message.split('@川小农', 1)[1].strip() if len(message.split('@川小农', 1)) > 1 else ''
-            
-            # 保存用户消息到数据库
-            db_manager.save_message(
-                nickname=nickname,
-                message=message,
-                session_id=session_id,
-                message_type='at',
-                is_at_message=True,
-                is_ai_response=False,
-                user_ip=client_ip,
-                room=DEFAULT_ROOM
-            )
-            
-            # 先发送用户的原始消息，让提问显示出来
-            emit('new_message', {
-                'nickname': nickname,
-                'message': message,
-                'is_at': True
-            }, room=DEFAULT_ROOM, broadcast=True)
-            
-            # 开始AI流式回复
-            if question.strip():  # 如果有具体问题
-                # 直接使用AI模型生成回复（不进行流式回复，因为SocketIO在线程中有上下文问题）
-                try:
-                    ai_message = generate_ai_response(question, use_ai_model=True)
-                    
-                    # 保存AI回复到数据库
-                    db_manager.save_message(
-                        nickname='川小农',
-                        message=ai_message,
-                        session_id=session_id,
-                        message_type='ai',
-                        is_ai_response=True,
-                        is_at_message=True,
-                        user_ip=client_ip,
-                        room=DEFAULT_ROOM
-                    )
-                    
-                    emit('new_message', {
-                        'nickname': '川小农',
-                        'message': ai_message,
-                        'is_ai': True,
-                        'is_at': True
-                    }, room=DEFAULT_ROOM, broadcast=True)
-                except Exception as e:
-                    print(f"AI回复出错: {str(e)}")
-                    # 回退到川小农知识库
-                    ai_message = generate_ai_response(question, use_ai_model=False)
-                    
-                    # 保存AI回复到数据库
-                    db_manager.save_message(
-                        nickname='川小农',
-                        message=ai_message,
-                        session_id=session_id,
-                        message_type='ai',
-                        is_ai_response=True,
-                        is_at_message=True,
-                        user_ip=client_ip,
-                        room=DEFAULT_ROOM
-                    )
-                    
-                    emit('new_message', {
-                        'nickname': '川小农',
-                        'message': ai_message,
-                        'is_ai': True,
-                        'is_at': True
-                    }, room=DEFAULT_ROOM, broadcast=True)
-            else:
-                # 如果没有具体问题，直接生成一个简单的回复
-                ai_message = generate_ai_response(question, use_ai_model=False)  # 不使用AI模型
+    join_room(room)
+    emit('room_joined', {'room': room, 'online_users': get_room_users(room)})
+    emit('welcome', {
+        'message': f'{nickname} 加入了聊天室！',
+        'room': room,
+        'online_users': get_room_users(room)
+    }, room=room, broadcast=True)
+
+# 腾讯视频等链接的匹配规则（模块加载时编译一次）
+URL_PATTERN = re.compile(r'https?://[\w\-\._~:/?#[\]@!\$&\'\(\)\*\+,;=.]+')
+QQ_VIDEO_ID_PATTERN = re.compile(r'/([a-zA-Z0-9]+)\.html')
+NON_ALNUM_PATTERN = re.compile(r'[^a-zA-Z0-9]')
+
+def broadcast(event, data, room):
+    """在后台线程中向房间广播事件（不依赖Socket.IO请求上下文）"""
+    socketio.emit(event, data, room=room)
+
+def echo_command_message(ctx, message_type):
+    """
+    保存并广播发送者的@命令消息
+
+    Returns:
+        bool: 总是返回True，命令需要继续分派执行
+    """
+    ctx.save(
+        nickname=ctx.nickname,
+        message=ctx.message,
+        message_type=message_type,
+        is_at_message=True
+    )
+    
+    ctx.emit('new_message', {
+        'nickname': ctx.nickname,
+        'message': ctx.message,
+        'is_at': True
+    })
+    return True
+
+def handle_ai_command(ctx):
+    """@川小农：调用AI大模型回答问题"""
+    question = ctx.args
+    
+    # 有具体问题时使用AI模型，否则直接使用川小农知识库生成引导回复
+    try:
+        ai_message = generate_ai_response(question, use_ai_model=bool(question))
+    except Exception as e:
+        print(f"AI回复出错: {str(e)}")
+        # 回退到川小农知识库
+        ai_message = generate_ai_response(question, use_ai_model=False)
+    
+    send_ai_reply(ctx, ai_message)
+
+def send_ai_reply(ctx, ai_message):
+    """保存并广播川小农的回复"""
+    ctx.save(
+        nickname='川小农',
+        message=ai_message,
+        message_type='ai',
+        is_ai_response=True,
+        is_at_message=True
+    )
+    
+    ctx.emit('new_message', {
+        'nickname': '川小农',
+        'message': ai_message,
+        'is_ai': True,
+        'is_at': True
+    })
+
+def ai_command_fallback(ctx, reason):
+    """@川小农降级：AI模型超时或繁忙时使用川小农知识库回答"""
+    send_ai_reply(ctx, generate_ai_response(ctx.args, use_ai_model=False))
+
+def echo_movie_command(ctx):
+    """
+    @电影：保存并广播发送者的消息，分享的视频链接直接转换为播放卡片
+
+    Returns:
+        bool: 没有链接、需要在命令线程池中查找随机免费电影时返回True
+    """
+    nickname = ctx.nickname
+    message = ctx.message
+    message_content = ctx.args
+    
+    # 检查是否有URL参数
+    url_match = URL_PATTERN.search(message_content)
+    
+    if url_match:
+        url = url_match.group(0)
+        # 判断是否是腾讯视频链接
+        if 'v.qq.com' in url or 'video.qq.com' in url:
+            # 从腾讯视频URL中提取视频ID
+            video_id_match = QQ_VIDEO_ID_PATTERN.search(url)
+            if video_id_match:
+                video_id = video_id_match.group(1)
+                # 清理video_id，移除可能的特殊字符
+                clean_video_id = NON_ALNUM_PATTERN.sub('', video_id)
+                # 构建腾讯视频原始URL
+                original_url = f"https://v.qq.com/x/cover/{clean_video_id}.html"
+                # 使用指定的解析服务URL
+                movie_url = f"https://jx.m3u8.tv/jiexi/?url={original_url}"
                 
-                # 保存AI回复到数据库
-                db_manager.save_message(
-                    nickname='川小农',
-                    message=ai_message,
-                    session_id=session_id,
-                    message_type='ai',
-                    is_ai_response=True,
+                # 保存用户消息到数据库
+                ctx.save(
+                    nickname=nickname,
+                    message='分享了一个腾讯视频：',
+                    message_type='movie',
                     is_at_message=True,
-                    user_ip=client_ip,
-                    room=DEFAULT_ROOM
+                    is_movie=True,
+                    movie_url=movie_url
                 )
                 
-                emit('new_message', {
-                    'nickname': '川小农',
-                    'message': ai_message,
-                    'is_ai': True,
-                    'is_at': True
-                }, room=DEFAULT_ROOM, broadcast=True)
-        elif '@电影' in message:
-            message_type = 'movie'
-            is_movie = True
-            # 提取消息内容
-            message_content = message.split('@电影', 1)[1].strip()
-            
-            # 检查是否有URL参数
-            import re
-            url_match = re.search(r'https?://[\w\-\._~:/?#[\]@!\$&\'\(\)\*\+,;=.]+', message_content)
-            
-            if url_match:
-                url = url_match.group(0)
-                # 判断是否是腾讯视频链接
-                if 'v.qq.com' in url or 'video.qq.com' in url:
-                    # 从腾讯视频URL中提取视频ID
-                    video_id_match = re.search(r'/([a-zA-Z0-9]+)\.html', url)
-                    if video_id_match:
-                        video_id = video_id_match.group(1)
-                        # 清理video_id，移除可能的特殊字符
-                        clean_video_id = re.sub(r'[^a-zA-Z0-9]', '', video_id)
-                        # 构建腾讯视频原始URL
-                        original_url = f"https://v.qq.com/x/cover/{clean_video_id}.html"
-                        # 使用指定的解析服务URL
-                        movie_url = f"https://jx.m3u8.tv/jiexi/?url={original_url}"
-                        
-                        # 保存用户消息到数据库
-                        db_manager.save_message(
-                            nickname=nickname,
-                            message='分享了一个腾讯视频：',
-                            session_id=session_id,
-                            message_type='movie',
-                            is_at_message=True,
-                            is_movie=True,
-                            movie_url=movie_url,
-                            user_ip=client_ip,
-                            room=DEFAULT_ROOM
-                        )
-                        
-                        emit('new_message', {
-                            'nickname': nickname,
-                            'message': '分享了一个腾讯视频：',
-                            'is_movie': True,
-                            'movie_url': movie_url
-                        }, room=DEFAULT_ROOM, broadcast=True)
-                    else:
-                        # 无法提取视频ID
-                        # 保存用户消息到数据库
-                        db_manager.save_message(
-                            nickname=nickname,
-                            message=message,
-                            session_id=session_id,
-                            message_type='at',
-                            is_at_message=True,
-                            user_ip=client_ip,
-                            room=DEFAULT_ROOM
-                        )
-                        
-                        emit('new_message', {
-                            'nickname': nickname,
-                            'message': '无法从链接中提取视频ID',
-                            'is_movie': False
-                        }, room=DEFAULT_ROOM, broadcast=True)
-                else:
-                    # 非腾讯视频URL，使用解析服务URL
-                    movie_url = f"https://jx.m3u8.tv/jiexi/?url={url}"
-                    
-                    # 保存用户消息到数据库
-                    db_manager.save_message(
-                        nickname=nickname,
-                        message=f'分享了一个视频链接：{url}',
-                        session_id=session_id,
-                        message_type='movie',
-                        is_at_message=True,
-                        is_movie=True,
-                        movie_url=movie_url,
-                        user_ip=client_ip,
-                        room=DEFAULT_ROOM
-                    )
-                    
-                    emit('new_message', {
-                        'nickname': nickname,
-                        'message': f'分享了一个视频链接：{url}',
-                        'is_movie': True,
-                        'movie_url': movie_url
-                    }, room=DEFAULT_ROOM, broadcast=True)
+                ctx.emit('new_message', {
+                    'nickname': nickname,
+                    'message': '分享了一个腾讯视频：',
+                    'is_movie': True,
+                    'movie_url': movie_url
+                })
             else:
-                # 用户没有提供URL，自动获取一个随机免费电影
+                # 无法提取视频ID
                 # 保存用户消息到数据库
-                db_manager.save_message(
+                ctx.save(
                     nickname=nickname,
                     message=message,
-                    session_id=session_id,
                     message_type='at',
-                    is_at_message=True,
-                    user_ip=client_ip,
-                    room=DEFAULT_ROOM
+                    is_at_message=True
                 )
                 
-                emit('new_message', {
+                ctx.emit('new_message', {
                     'nickname': nickname,
-                    'message': '正在为您查找免费电影...',
+                    'message': '无法从链接中提取视频ID',
                     'is_movie': False
-                }, room=DEFAULT_ROOM, broadcast=True)
-                
-                # 获取随机免费电影
-                try:
-                    random_video = video_crawler.get_random_free_video()
-                    if random_video:
-                        # 获取视频ID，兼容新旧格式
-                        video_id = random_video.get('video_id', random_video.get('id', ''))
-                        movie_url = video_crawler.get_iframe_url(video_id)
-                        video_info = f"为您找到免费电影《{random_video['title']}》\n"
-                        if random_video.get('duration') and random_video['duration'] != '未知时长':
-                            video_info += f"时长：{random_video['duration']}\n"
-                        if random_video.get('description') and random_video['description'] != '暂无简介':
-                            video_info += f"简介：{random_video['description'][:200]}..."
-                        
-                        # 如果有播放链接，添加到消息中
-                        play_url = random_video.get('url', random_video.get('play_url', ''))
-                        if play_url:
-                            video_info += f"\n播放链接：{play_url}"
-                        
-                        # 保存AI回复到数据库
-                        db_manager.save_message(
-                            nickname='川小农',
-                            message=video_info,
-                            session_id=session_id,
-                            message_type='movie',
-                            is_ai_response=True,
-                            is_movie=True,
-                            movie_url=movie_url,
-                            movie_info=video_info,
-                            user_ip=client_ip,
-                            room=DEFAULT_ROOM
-                        )
-                        
-                        emit('new_message', {
-                            'nickname': '川小农',
-                            'message': video_info,
-                            'is_movie': True,
-                            'movie_url': movie_url,
-                            'is_ai': True
-                        }, room=DEFAULT_ROOM, broadcast=True)
-                    else:
-                        emit('new_message', {
-                            'nickname': '川小农',
-                            'message': '暂时无法获取免费电影资源，请稍后再试',
-                            'is_ai': True
-                        }, room=DEFAULT_ROOM, broadcast=True)
-                except Exception as e:
-                    print(f"获取随机电影失败: {str(e)}")
-                    emit('new_message', {
-                        'nickname': '川小农',
-                        'message': '获取电影信息时出错，请稍后重试',
-                        'is_ai': True
-                    }, room=DEFAULT_ROOM, broadcast=True)
-        elif '@音乐' in message:
-            message_type = 'music'
+                })
+        else:
+            # 非腾讯视频URL，使用解析服务URL
+            movie_url = f"https://jx.m3u8.tv/jiexi/?url={url}"
             
             # 保存用户消息到数据库
-            db_manager.save_message(
+            ctx.save(
                 nickname=nickname,
-                message=message,
-                session_id=session_id,
-                message_type='music',
+                message=f'分享了一个视频链接：{url}',
+                message_type='movie',
                 is_at_message=True,
-                user_ip=client_ip,
-                room=DEFAULT_ROOM
+                is_movie=True,
+                movie_url=movie_url
             )
             
-            emit('new_message', {
+            ctx.emit('new_message', {
                 'nickname': nickname,
-                'message': message,
-                'is_at': True
-            }, room=DEFAULT_ROOM, broadcast=True)
-            
-            # 提取用户输入的音乐名称
-            music_name = message.split('@音乐', 1)[1].strip() if len(message.split('@音乐', 1)) > 1 else None
-            
-            # 获取音乐并发送音乐卡片
-            if music_name:
-                emit('new_message', {
-                    'nickname': '川小农',
-                    'message': f'正在为您搜索音乐《{music_name}》...',
-                    'is_ai': True
-                }, room=DEFAULT_ROOM, broadcast=True)
-                
-                try:
-                    music_data = music_weather_api.search_music(music_name)
-                    if not music_data:
-                        # 如果搜索不到，使用随机音乐作为备选
-                        music_data = music_weather_api.get_random_music()
-                        emit('new_message', {
-                            'nickname': '川小农',
-                            'message': f'未找到《{music_name}》，为您推荐一首相似音乐...',
-                            'is_ai': True
-                        }, room=DEFAULT_ROOM, broadcast=True)
-                except Exception as e:
-                    print(f"搜索音乐失败: {str(e)}")
-                    music_data = music_weather_api.get_random_music()
-                    emit('new_message', {
-                        'nickname': '川小农',
-                        'message': f'搜索《{music_name}》失败，为您推荐一首随机音乐...',
-                        'is_ai': True
-                    }, room=DEFAULT_ROOM, broadcast=True)
+                'message': f'分享了一个视频链接：{url}',
+                'is_movie': True,
+                'movie_url': movie_url
+            })
+        return False
+    
+    # 用户没有提供URL，自动获取一个随机免费电影
+    # 保存用户消息到数据库
+    ctx.save(
+        nickname=nickname,
+        message=message,
+        message_type='at',
+        is_at_message=True
+    )
+    
+    ctx.emit('new_message', {
+        'nickname': nickname,
+        'message': '正在为您查找免费电影...',
+        'is_movie': False
+    })
+    return True
+
+def handle_movie_command(ctx):
+    """@电影：推荐随机免费电影"""
+    # 获取随机免费电影
+    random_video = video_crawler.get_random_free_video()
+    if random_video:
+        # 获取视频ID，兼容新旧格式
+        video_id = random_video.get('video_id', random_video.get('id', ''))
+        movie_url = video_crawler.get_iframe_url(video_id)
+        video_info = f"为您找到免费电影《{random_video['title']}》\n"
+        if random_video.get('duration') and random_video['duration'] != '未知时长':
+            video_info += f"时长：{random_video['duration']}\n"
+        if random_video.get('description') and random_video['description'] != '暂无简介':
+            video_info += f"简介：{random_video['description'][:200]}..."
+        
+        # 如果有播放链接，添加到消息中
+        play_url = random_video.get('url', random_video.get('play_url', ''))
+        if play_url:
+            video_info += f"\n播放链接：{play_url}"
+        
+        # 保存AI回复到数据库
+        ctx.save(
+            nickname='川小农',
+            message=video_info,
+            message_type='movie',
+            is_ai_response=True,
+            is_movie=True,
+            movie_url=movie_url,
+            movie_info=video_info
+        )
+        
+        ctx.emit('new_message', {
+            'nickname': '川小农',
+            'message': video_info,
+            'is_movie': True,
+            'movie_url': movie_url,
+            'is_ai': True
+        })
+    else:
+        ctx.emit('new_message', {
+            'nickname': '川小农',
+            'message': '暂时无法获取免费电影资源，请稍后再试',
+            'is_ai': True
+        })
+
+def movie_command_fallback(ctx, reason):
+    """@电影降级回复"""
+    ctx.emit('new_message', {
+        'nickname': '川小农',
+        'message': '获取电影信息时出错，请稍后重试',
+        'is_ai': True
+    })
+
+def handle_music_command(ctx):
+    """@音乐：搜索指定音乐或推荐随机音乐，并发送音乐卡片"""
+    # 提取用户输入的音乐名称
+    music_name = ctx.args or None
+    
+    # 获取音乐并发送音乐卡片
+    if music_name:
+        ctx.emit('new_message', {
+            'nickname': '川小农',
+            'message': f'正在为您搜索音乐《{music_name}》...',
+            'is_ai': True
+        })
+        
+        try:
+            local_music = music_index.best_match(music_name)
+            if local_music:
+                music_data = {field: local_music[field] for field in MUSIC_CARD_FIELDS if local_music.get(field)}
             else:
-                emit('new_message', {
+                music_data = music_weather_api.search_music(music_name)
+            if not music_data:
+                # 如果搜索不到，使用随机音乐作为备选
+                music_data = music_weather_api.get_random_music()
+                ctx.emit('new_message', {
                     'nickname': '川小农',
-                    'message': '正在为您推荐一首好听的音乐...',
+                    'message': f'未找到《{music_name}》，为您推荐一首相似音乐...',
                     'is_ai': True
-                }, room=DEFAULT_ROOM, broadcast=True)
-                
-                try:
-                    music_data = music_weather_api.get_random_music()
-                except Exception as e:
-                    print(f"获取随机音乐失败: {str(e)}")
-                    emit('new_message', {
-                        'nickname': '川小农',
-                        'message': '获取音乐失败，请稍后再试...',
-                        'is_ai': True
-                    }, room=DEFAULT_ROOM, broadcast=True)
-                    return
-                if music_data:
-                    # 发送音乐卡片给所有用户
-                    emit('music_card', {
-                        'nickname': '川小农',
-                        'music_data': music_data,
-                        'is_ai': True
-                    }, room=DEFAULT_ROOM, broadcast=True)
-                    
-                    # 保存音乐信息到数据库
-                    music_info = f"🎵 音乐推荐：《{music_data.get('name', '未知')}》 - {music_data.get('singer', '未知歌手')}"
-                    db_manager.save_message(
-                        nickname='川小农',
-                        message=music_info,
-                        session_id=session_id,
-                        message_type='music',
-                        is_ai_response=True,
-                        user_ip=client_ip,
-                        room=DEFAULT_ROOM
-                    )
-                else:
-                    emit('new_message', {
-                        'nickname': '川小农',
-                        'message': '抱歉，暂时无法获取音乐推荐，请稍后再试！',
-                        'is_ai': True
-                    }, room=DEFAULT_ROOM, broadcast=True)
-
-        elif '@天气' in message:
-            message_type = 'weather'
-            
-            # 保存用户消息到数据库
-            db_manager.save_message(
-                nickname=nickname,
-                message=message,
-                session_id=session_id,
-                message_type='weather',
-                is_at_message=True,
-                user_ip=client_ip,
-                room=DEFAULT_ROOM
-            )
-            
-            emit('new_message', {
-                'nickname': nickname,
-                'message': message,
-                'is_at': True
-            }, room=DEFAULT_ROOM, broadcast=True)
-            
-            # 提取城市名称（支持多种格式）
-            if '@天气' in message:
-                city_part = message.split('@天气', 1)[1].strip()
-                # 清理常见的前缀词
-                city_part = city_part.replace('查询', '').replace('查看', '').replace('一下', '')
-                city_part = city_part.replace('的', '').replace('天', '').replace('气', '')
-                city = city_part.strip() if city_part else "位置"  # 默认获取当前位置
-            else:
-                city = "位置"
-            
-            # 发送天气查询中提示
-            if city == "位置":
-                query_message = '正在获取你的当前位置天气信息...'
-            else:
-                query_message = f'正在查询{city}的天气信息...'
-            
-            emit('new_message', {
+                })
+        except Exception as e:
+            print(f"搜索音乐失败: {str(e)}")
+            music_data = music_weather_api.get_random_music()
+            ctx.emit('new_message', {
                 'nickname': '川小农',
-                'message': query_message,
+                'message': f'搜索《{music_name}》失败，为您推荐一首随机音乐...',
                 'is_ai': True
-            }, room=DEFAULT_ROOM, broadcast=True)
-            
-            try:
-                # 根据城市名称选择天气获取方法
-                if city == "位置" or city == "当前位置":
-                    weather_data = music_weather_api.get_current_location_weather()
-                else:
-                    weather_data = music_weather_api.get_weather_info(city)
-                
-                if weather_data:
-                    # 生成天气报告消息
-                    weather_report = f"""🌤️ {weather_data['city']}天气预报
+            })
+    else:
+        ctx.emit('new_message', {
+            'nickname': '川小农',
+            'message': '正在为您推荐一首好听的音乐...',
+            'is_ai': True
+        })
+        music_data = music_weather_api.get_random_music()
+    
+    if music_data:
+        # 卡片会广播给不同的客户端，使用按 Accept 协商的音频地址
+        music_data = audio_library.resolve_music(music_data)
+        # 发送音乐卡片给房间内所有用户
+        ctx.emit('music_card', {
+            'nickname': '川小农',
+            'music_data': music_data,
+            'is_ai': True
+        })
+        
+        # 保存音乐信息到数据库
+        music_info = f"🎵 音乐推荐：《{music_data.get('name', '未知')}》 - {music_data.get('singer', '未知歌手')}"
+        ctx.save(
+            nickname='川小农',
+            message=music_info,
+            message_type='music',
+            is_ai_response=True
+        )
+    else:
+        ctx.emit('new_message', {
+            'nickname': '川小农',
+            'message': '抱歉，暂时无法获取音乐推荐，请稍后再试！',
+            'is_ai': True
+        })
+
+def music_command_fallback(ctx, reason):
+    """@音乐降级回复"""
+    ctx.emit('new_message', {
+        'nickname': '川小农',
+        'message': '获取音乐失败，请稍后再试...',
+        'is_ai': True
+    })
+
+def parse_weather_city(args):
+    """从@天气命令参数中提取城市名称，未指定时返回"位置"表示当前位置"""
+    # 清理常见的前缀词
+    city_part = args.replace('查询', '').replace('查看', '').replace('一下', '')
+    city_part = city_part.replace('的', '').replace('天', '').replace('气', '')
+    return city_part.strip() or "位置"
+
+def handle_weather_command(ctx):
+    """@天气：查询城市或当前位置天气，并发送天气卡片"""
+    city = parse_weather_city(ctx.args)
+    
+    # 发送天气查询中提示
+    if city == "位置":
+        query_message = '正在获取你的当前位置天气信息...'
+    else:
+        query_message = f'正在查询{city}的天气信息...'
+    
+    ctx.emit('new_message', {
+        'nickname': '川小农',
+        'message': query_message,
+        'is_ai': True
+    })
+    
+    # 根据城市名称选择天气获取方法
+    if city == "位置" or city == "当前位置":
+        weather_data = music_weather_api.get_current_location_weather()
+    else:
+        weather_data = music_weather_api.get_weather_info(city)
+    
+    if weather_data:
+        # 生成天气报告消息
+        weather_report = f"""🌤️ {weather_data['city']}天气预报
 {weather_data['icon']} {weather_data['condition']} {weather_data['temperature']}
 💨 风力: {weather_data['wind']}
 💧 湿度: {weather_data['humidity']}%
 🕐 更新时间: {weather_data['update_time']}"""
-                    
-                    # 发送天气卡片给所有用户
-                    emit('weather_card', {
-                        'nickname': '川小农',
-                        'weather_data': weather_data,
-                        'is_ai': True
-                    }, room=DEFAULT_ROOM, broadcast=True)
-                    
-                    # 保存天气信息到数据库
-                    db_manager.save_message(
-                        nickname='川小农',
-                        message=weather_report,
-                        session_id=session_id,
-                        message_type='weather',
-                        is_ai_response=True,
-                        user_ip=client_ip,
-                        room=DEFAULT_ROOM
-                    )
-                else:
-                    error_msg = f'抱歉，无法获取{city}的天气信息，请稍后重试！'
-                    emit('new_message', {
-                        'nickname': '川小农',
-                        'message': error_msg,
-                        'is_ai': True
-                    }, room=DEFAULT_ROOM, broadcast=True)
-            except Exception as e:
-                print(f"获取天气失败: {str(e)}")
-                error_msg = f'获取{city}天气信息时出错，请稍后重试！'
-                emit('new_message', {
-                    'nickname': '川小农',
-                    'message': error_msg,
-                    'is_ai': True
-                }, room=DEFAULT_ROOM, broadcast=True)
-        else:
-            # 普通@提醒
-            # 保存用户消息到数据库
-            db_manager.save_message(
-                nickname=nickname,
-                message=message,
-                session_id=session_id,
-                message_type='at',
-                is_at_message=True,
-                user_ip=client_ip,
-                room=DEFAULT_ROOM
-            )
-            
-            emit('new_message', {
-                'nickname': nickname,
-                'message': message,
-                'is_at': True
-            }, room=DEFAULT_ROOM, broadcast=True)
+        
+        # 发送天气卡片给房间内所有用户
+        ctx.emit('weather_card', {
+            'nickname': '川小农',
+            'weather_data': weather_data,
+            'is_ai': True
+        })
+        
+        # 保存天气信息到数据库
+        ctx.save(
+            nickname='川小农',
+            message=weather_report,
+            message_type='weather',
+            is_ai_response=True
+        )
+    else:
+        ctx.emit('new_message', {
+            'nickname': '川小农',
+            'message': f'抱歉，无法获取{city}的天气信息，请稍后重试！',
+            'is_ai': True
+        })
+
+def weather_command_fallback(ctx, reason):
+    """@天气降级回复"""
+    city = parse_weather_city(ctx.args)
+    ctx.emit('new_message', {
+        'nickname': '川小农',
+        'message': f'获取{city}天气信息时出错，请稍后重试！',
+        'is_ai': True
+    })
+
+# 各@命令回显发送者消息的函数，在分派前同步执行，命令繁忙被拒绝或排队超时时提问也不会丢失
+COMMAND_ECHOES = {
+    'ai': lambda ctx: echo_command_message(ctx, 'at'),
+    'movie': echo_movie_command,
+    'music': lambda ctx: echo_command_message(ctx, 'music'),
+    'weather': lambda ctx: echo_command_message(ctx, 'weather'),
+}
+
+# 注册@命令：每个命令使用独立的线程池、并发限制和超时，
+# 上游服务再慢也只会占用自己命令的线程，不会阻塞普通消息
+command_router = CommandRouter()
+command_router.register('ai', '@川小农', handle_ai_command,
+                        max_workers=4, max_pending=32, timeout=30.0,
+                        fallback=ai_command_fallback)
+command_router.register('movie', '@电影', handle_movie_command,
+                        max_workers=2, max_pending=16, timeout=15.0,
+                        fallback=movie_command_fallback)
+command_router.register('music', '@音乐', handle_music_command,
+                        max_workers=2, max_pending=16, timeout=10.0,
+                        fallback=music_command_fallback)
+command_router.register('weather', '@天气', handle_weather_command,
+                        max_workers=2, max_pending=16, timeout=8.0,
+                        fallback=weather_command_fallback)
+
+@socketio.on('send_message')
+def handle_send_message(data):
+    nickname = data['nickname']
+    message = data['message']
+    # 消息只在发送者当前所在的房间内广播和存储
+    room = current_room(request.sid)
+    
+    # 获取会话ID
+    from flask import g
+    session_id = sid_sessions.get(request.sid) or getattr(g, 'session_id', None)
+    client_ip = getattr(g, 'client_ip', request.remote_addr)
+    session_activity.touch(session_id)
+    
+    # 检查是否为@命令，命令交给各自的线程池异步执行
+    command, args = command_router.parse(message)
+    if command:
+        ctx = CommandContext(
+            nickname=nickname,
+            message=message,
+            args=args,
+            room=room,
+            session_id=session_id,
+            client_ip=client_ip,
+            emitter=broadcast,
+            saver=db_manager.save_message
+        )
+        # 先保存并广播用户的原始消息，再把回复交给命令线程池
+        if COMMAND_ECHOES[command.name](ctx):
+            command_router.dispatch(command, ctx)
+    elif message.startswith('@'):
+        # 普通@提醒
+        # 保存用户消息到数据库
+        db_manager.save_message(
+            nickname=nickname,
+            message=message,
+            session_id=session_id,
+            message_type='at',
+            is_at_message=True,
+            user_ip=client_ip,
+            room=room
+        )
+        
+        emit('new_message', {
+            'nickname': nickname,
+            'message': message,
+            'is_at': True
+        }, room=room, broadcast=True)
     else:
         # 普通消息
         # 保存用户消息到数据库
@@ -960,13 +2041,13 @@ def handle_send_message(data):
             session_id=session_id,
             message_type='text',
             user_ip=client_ip,
-            room=DEFAULT_ROOM
+            room=room
         )
         
         emit('new_message', {
             'nickname': nickname,
             'message': message
-        }, room=DEFAULT_ROOM, broadcast=True)
+        }, room=room, broadcast=True)
 
 # AI流式回复生成器
 def generate_ai_stream_response(question):
@@ -995,11 +2076,21 @@ def generate_ai_stream_response(question):
             yield f"data: {json.dumps({'content': '', 'type': 'end'})}\n\n"
             return
         
+        # 语义相近的问题已经回答过时直接输出缓存的回答
+        cached_response = semantic_cache.get(question)
+        if cached_response:
+            for char in cached_response:
+                yield f"data: {json.dumps({'content': char, 'type': 'token'})}\n\n"
+                time.sleep(0.02)
+            yield f"data: {json.dumps({'content': '', 'type': 'end'})}\n\n"
+            return
+        
         # 构建川小农的角色提示词
         system_prompt = """你是川小农，四川农业大学的智能百科助手。你的使命是回答关于四川农业大学的各类问题，为学生、家长和关心川农的人士提供准确、及时、友好的信息。
 
 请始终以川小农的身份回答，保持友好、专业的语气，并确保信息的准确性。如果遇到不确定的信息，请诚实地表示不知道，并建议用户查询官方渠道获取最新信息。"""
         
+        llm_start = time.perf_counter()
         try:
             # 调用AI大模型流式接口
             stream = openai_client.chat.completions.create(
@@ -1009,26 +2100,37 @@ def generate_ai_stream_response(question):
                     {"role": "user", "content": question}
                 ],
                 stream=True,
-                max_tokens=1000,
-                temperature=0.7,
-                top_p=0.9
+                max_tokens=AI_CONFIG['max_tokens'],
+                temperature=AI_CONFIG['temperature'],
+                top_p=AI_CONFIG['top_p']
             )
             
             # 流式输出AI回复
+            first_token = True
+            pieces = []
             for chunk in stream:
                 if chunk.choices[0].delta.content is not None:
+                    if first_token:
+                        LLM_TTFT_SECONDS.observe(time.perf_counter() - llm_start)
+                        first_token = False
                     content = chunk.choices[0].delta.content
+                    pieces.append(content)
                     yield f"data: {json.dumps({'content': content, 'type': 'token'})}\n\n"
                     time.sleep(0.02)  # 控制输出速度
             
+            LLM_REQUEST_SECONDS.labels('stream', 'success').observe(time.perf_counter() - llm_start)
+            full_response = ''.join(pieces)
+            if len(full_response.strip()) >= 10:
+                semantic_cache.put(question, full_response)
             yield f"data: {json.dumps({'content': '', 'type': 'end'})}\n\n"
             
         except Exception as ai_error:
+            LLM_REQUEST_SECONDS.labels('stream', 'error').observe(time.perf_counter() - llm_start)
             print(f"AI流式模型调用失败: {str(ai_error)}")
             print("回退到川小农知识库...")
             
             # AI调用失败时回退到川小农知识库
-            fallback_response, _ = assistant.generate_response(question)
+            fallback_response = knowledge_response(question)
             
             # 模拟流式输出fallback回复
             for char in fallback_response:
@@ -1067,11 +2169,22 @@ def handle_leave_room(data):
     nickname = data['nickname']
     if nickname in online_users:
         del online_users[nickname]
-        leave_room(DEFAULT_ROOM)
+        room = exit_room(nickname, request.sid) or DEFAULT_ROOM
+        leave_room(room)
         emit('user_left', {
             'nickname': nickname,
-            'online_users': list(online_users.keys())
-        }, room=DEFAULT_ROOM, broadcast=True)
+            'online_users': get_room_users(room)
+        }, room=room, broadcast=True)
+
+def knowledge_response(question):
+    """
+    从川小农知识库获取回复：先用关键词自动机匹配（已包含助手自带的知识库），未命中再交给川小农助手
+    """
+    answer = knowledge_matcher.answer(question)
+    if answer:
+        return answer
+    response, _ = assistant.generate_response(question)
+    return response
 
 # AI回复生成函数 - 使用川小农助手类提供完整的关键词匹配功能
 def generate_ai_response(question, use_ai_model=True):
@@ -1097,17 +2210,35 @@ def generate_ai_response(question, use_ai_model=True):
         
         # 如果不使用AI模型，直接使用川小农知识库
         if not use_ai_model:
-            response, _ = assistant.generate_response(question)
+            response = knowledge_response(question)
             if not response or response.strip() == "":
                 return f"感谢你的提问：'{question}'。请尝试使用更具体的关键词，如'校区'、'专业'、'宿舍'、'招生'等，我会为你提供详细解答！"
             return response
         
-        # 使用AI大模型生成回复
+        # 先检索本地知识库，置信度足够时直接回答，不请求大模型
+        retrieval = knowledge_retriever.retrieve(question)
+        if retrieval['answer']:
+            AI_ANSWER_SECONDS.labels('local').observe(retrieval['seconds'])
+            return retrieval['answer']
+        grounding = knowledge_retriever.grounding_prompt(retrieval['passages'])
+        
+        # 语义相近的问题已经由大模型回答过时直接使用缓存的回答
+        cache_start = time.perf_counter()
+        cached_response = semantic_cache.get(question)
+        if cached_response:
+            AI_ANSWER_SECONDS.labels('cache').observe(retrieval['seconds'] + time.perf_counter() - cache_start)
+            return cached_response
+        
+        # 使用AI大模型生成回复（计时在 try 之前开始，构建提示词出错时 except 中也能使用）
+        llm_start = time.perf_counter()
         try:
             # 构建川小农的角色提示词
             system_prompt = """你是川小农，四川农业大学的智能百科助手。你的使命是回答关于四川农业大学的各类问题，为学生、家长和关心川农的人士提供准确、及时、友好的信息。
 
 请始终以川小农的身份回答，保持友好、专业的语气，并确保信息的准确性。如果遇到不确定的信息，请诚实地表示不知道，并建议用户查询官方渠道获取最新信息。"""
+            # 检索到相关资料时附在提示词后面，并限制回答长度
+            if grounding:
+                system_prompt = f"{system_prompt}\n\n{grounding}"
             
             # 调用AI大模型
             response = openai_client.chat.completions.create(
@@ -1117,26 +2248,32 @@ def generate_ai_response(question, use_ai_model=True):
                     {"role": "user", "content": question}
                 ],
                 stream=False,
-                max_tokens=1000,
-                temperature=0.7,
-                top_p=0.9
+                max_tokens=AI_CONFIG['grounded_max_tokens'] if grounding else AI_CONFIG['max_tokens'],
+                temperature=AI_CONFIG['temperature'],
+                top_p=AI_CONFIG['top_p']
             )
             
+            llm_seconds = time.perf_counter() - llm_start
+            LLM_REQUEST_SECONDS.labels('complete', 'success').observe(llm_seconds)
+            AI_ANSWER_SECONDS.labels('grounded' if grounding else 'llm').observe(retrieval['seconds'] + llm_seconds)
+            
             # 提取AI回复内容
             ai_response = response.choices[0].message.content
             
             # 如果AI回复为空或太短，回退到川小农知识库
             if not ai_response or len(ai_response.strip()) < 10:
-                fallback_response, _ = assistant.generate_response(question)
+                fallback_response = knowledge_response(question)
                 return fallback_response
             
+            semantic_cache.put(question, ai_response)
             return ai_response
             
         except Exception as ai_error:
+            LLM_REQUEST_SECONDS.labels('complete', 'error').observe(time.perf_counter() - llm_start)
             print(f"AI模型调用失败: {str(ai_error)}")
             print("回退到川小农知识库...")
             # AI调用失败时回退到川小农知识库
-            fallback_response, _ = assistant.generate_response(question)
+            fallback_response = knowledge_response(question)
             return fallback_response
             
     except Exception as e:
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态音频资源模块
+为 static/audio 下的WAV文件预先生成较小的变体（22kHz 16位PCM、22kHz IMA ADPCM），
+按内容哈希命名以便长期缓存，并生成清单供音乐卡片按客户端的 Accept 选择最小的可用变体
+
+用法:
+    python audio_assets.py build    # 重新生成变体和清单
+"""
+
+import array
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+import threading
+import wave
+from typing import Dict, List, Optional
+
+# 原始文件使用的变体名称
+ORIGINAL_VARIANT = 'original'
+# 可生成的变体：降采样倍数、编码，以及 Content-Type 中的 codecs 参数（WAV格式标签）
+VARIANTS = {
+    'pcm16_22k': {'decimate': 2, 'encoding': 'pcm16', 'codecs': '1'},
+    'adpcm_22k': {'decimate': 2, 'encoding': 'ima_adpcm', 'codecs': '17'},
+}
+# 浏览器普遍不能直接播放ADPCM，只有 Accept 中明确写出对应 codecs 时才选用
+EXPLICIT_CODECS = {'17'}
+WAV_MIME_TYPES = ('audio/wav', 'audio/x-wav', 'audio/wave')
+# 带内容哈希的文件名：<名称>.<12位哈希>.wav
+HASHED_NAME_PATTERN = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})\.wav$')
+MANIFEST_NAME = 'manifest.json'
+ADPCM_BLOCK_ALIGN = 512
+
+_IMA_INDEX_TABLE = [-1, -1, -1, -1, 2, 4, 6, 8] * 2
+_IMA_STEP_TABLE = [
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+    12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767,
+]
+
+
+def file_hash(path: str) -> str:
+    """文件内容的SHA-256前12位"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def _read_pcm16(path: str):
+    """读取16位PCM WAV，返回 (采样数组, 声道数, 采样率)"""
+    with wave.open(path, 'rb') as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError(f"只支持16位PCM: {path}")
+        channels, rate = wav.getnchannels(), wav.getframerate()
+        samples = array.array('h')
+        samples.frombytes(wav.readframes(wav.getnframes()))
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples, channels, rate
+
+
+def _decimate(samples: array.array, channels: int, factor: int) -> array.array:
+    """对每 factor 帧取平均后降采样（简单的低通滤波，避免混叠）"""
+    if factor == 1:
+        return samples
+    frames = len(samples) // channels
+    out = array.array('h')
+    for frame in range(0, frames - factor + 1, factor):
+        base = frame * channels
+        for channel in range(channels):
+            total = 0
+            for offset in range(factor):
+                total += samples[base + offset * channels + channel]
+            out.append(total // factor)
+    return out
+
+
+def _write_pcm16(path: str, samples: array.array, channels: int, rate: int):
+    if sys.byteorder == 'big':
+        samples = array.array('h', samples)
+        samples.byteswap()
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+
+
+def _encode_ima_block(samples, start: int, count: int, state) -> bytes:
+    """编码一个单声道IMA ADPCM块：4字节块头 + 每个采样4位"""
+    predictor, index = samples[start], state[1]
+    block = bytearray(struct.pack('<hBB', predictor, index, 0))
+    nibble_low = None
+    for position in range(start + 1, start + count):
+        step = _IMA_STEP_TABLE[index]
+        diff = samples[position] - predictor
+        code = 0
+        if diff < 0:
+            code = 8
+            diff = -diff
+        delta = step >> 3
+        if diff >= step:
+            code |= 4
+            diff -= step
+            delta += step
+        if diff >= step >> 1:
+            code |= 2
+            diff -= step >> 1
+            delta += step >> 1
+        if diff >= step >> 2:
+            code |= 1
+            delta += step >> 2
+        predictor = max(-32768, min(32767, predictor - delta if code & 8 else predictor + delta))
+        index = max(0, min(88, index + _IMA_INDEX_TABLE[code]))
+        if nibble_low is None:
+            nibble_low = code
+        else:
+            block.append(nibble_low | (code << 4))
+            nibble_low = None
+    if nibble_low is not None:
+        block.append(nibble_low)
+    state[1] = index
+    # 最后一块不足时补零，保证块长度一致
+    block.extend(b'\x00' * (ADPCM_BLOCK_ALIGN - len(block)))
+    return bytes(block)
+
+
+def _write_ima_adpcm(path: str, samples: array.array, channels: int, rate: int):
+    """写入单声道IMA ADPCM WAV（格式标签0x11）"""
+    if channels != 1:
+        raise ValueError("ADPCM变体只支持单声道")
+    samples_per_block = (ADPCM_BLOCK_ALIGN - 4) * 2 + 1
+    state = [0, 0]
+    blocks = [_encode_ima_block(samples, start, min(samples_per_block, len(samples) - start), state)
+              for start in range(0, len(samples), samples_per_block)]
+    data = b''.join(blocks)
+    byte_rate = rate * ADPCM_BLOCK_ALIGN // samples_per_block
+    fmt = struct.pack('<HHIIHHHH', 0x11, 1, rate, byte_rate, ADPCM_BLOCK_ALIGN, 4, 2, samples_per_block)
+    fact = struct.pack('<I', len(samples))
+    with open(path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', 4 + 8 + len(fmt) + 8 + len(fact) + 8 + len(data)) + b'WAVE')
+        f.write(b'fmt ' + struct.pack('<I', len(fmt)) + fmt)
+        f.write(b'fact' + struct.pack('<I', len(fact)) + fact)
+        f.write(b'data' + struct.pack('<I', len(data)) + data)
+
+
+def parse_accept(header: str) -> List[Dict]:
+    """
+    解析 Accept 请求头
+
+    Returns:
+        List[Dict]: [{'type': 'audio/wav', 'params': {...}, 'q': 1.0}, ...]
+    """
+    ranges = []
+    for part in (header or '*/*').split(','):
+        pieces = [piece.strip() for piece in part.split(';')]
+        if not pieces[0]:
+            continue
+        params, q = {}, 1.0
+        for piece in pieces[1:]:
+            key, _, value = piece.partition('=')
+            key, value = key.strip().lower(), value.strip().strip('"')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+            elif key:
+                params[key] = value
+        ranges.append({'type': pieces[0].lower(), 'params': params, 'q': q})
+    return ranges
+
+
+def accepts_variant(accept_ranges: List[Dict], variant: Dict) -> bool:
+    """客户端是否接受该变体"""
+    codecs = variant['codecs']
+    for item in accept_ranges:
+        if item['q'] <= 0:
+            continue
+        media = item['type']
+        if media in WAV_MIME_TYPES:
+            wanted = item['params'].get('codecs')
+            if wanted is None and codecs not in EXPLICIT_CODECS:
+                return True
+            if wanted is not None and codecs in [c.strip() for c in wanted.split(',')]:
+                return True
+        elif media in ('*/*', 'audio/*') and codecs not in EXPLICIT_CODECS:
+            return True
+    return False
+
+
+class AudioLibrary:
+    """static/audio 下的音频及其变体清单"""
+
+    def __init__(self, audio_dir: str, cache_dir: str = None, url_prefix: str = '/audio',
+                 peaks_prefix: str = None):
+        """
+        初始化音频库
+
+        Args:
+            audio_dir: 原始音频目录
+            cache_dir: 变体和清单的存放目录，默认为 audio_dir/variants
+            url_prefix: 音频访问地址前缀
+            peaks_prefix: 波形接口地址前缀，设置后音乐信息中附带 peaks_url
+        """
+        self.audio_dir = audio_dir
+        self.cache_dir = cache_dir or os.path.join(audio_dir, 'variants')
+        self.url_prefix = url_prefix.rstrip('/')
+        self.peaks_prefix = peaks_prefix.rstrip('/') if peaks_prefix else None
+        self.manifest: Dict[str, Dict] = {}
+        # 同一时间只允许一次生成
+        self._build_lock = threading.Lock()
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.cache_dir, MANIFEST_NAME)
+
+    def _load_manifest(self) -> Dict:
+        try:
+            with open(self._manifest_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def build(self) -> Dict:
+        """
+        生成缺失或过期的变体并写出清单，源文件未变化的变体直接复用
+
+        Returns:
+            Dict: 清单 名称 -> 源文件信息和各变体
+        """
+        with self._build_lock:
+            return self._build()
+
+    def _build(self) -> Dict:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        previous = self._load_manifest()
+        manifest = {}
+        for filename in sorted(os.listdir(self.audio_dir)):
+            path = os.path.join(self.audio_dir, filename)
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() != '.wav' or not os.path.isfile(path):
+                continue
+            source_hash = file_hash(path)
+            cached = previous.get(stem)
+            if cached and cached.get('hash') == source_hash and all(
+                    os.path.exists(os.path.join(self.cache_dir, variant['file']))
+                    for name, variant in cached['variants'].items() if name != ORIGINAL_VARIANT):
+                manifest[stem] = cached
+                continue
+            try:
+                manifest[stem] = self._build_entry(stem, filename, path, source_hash)
+                print(f"已生成音频变体: {filename}")
+            except (OSError, ValueError, EOFError, wave.Error) as e:
+                print(f"生成音频变体失败 {filename}: {str(e)}")
+
+        temp_path = self._manifest_path() + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self._manifest_path())
+        # 先换用新清单再删除旧变体，请求不会拿到已删除的文件
+        self.manifest = manifest
+        self._remove_stale_files(manifest)
+        return manifest
+
+    def _build_entry(self, stem: str, filename: str, path: str, source_hash: str) -> Dict:
+        samples, channels, rate = _read_pcm16(path)
+        variants = {
+            ORIGINAL_VARIANT: {
+                'file': filename,
+                'hash': source_hash,
+                'bytes': os.path.getsize(path),
+                'mime': 'audio/wav',
+                'codecs': '1',
+                'sample_rate': rate,
+            }
+        }
+        for name, spec in VARIANTS.items():
+            if spec['encoding'] == 'ima_adpcm' and channels != 1:
+                continue
+            reduced = _decimate(samples, channels, spec['decimate'])
+            variant_rate = rate // spec['decimate']
+            temp_path = os.path.join(self.cache_dir, f'{stem}.{name}.tmp')
+            if spec['encoding'] == 'pcm16':
+                _write_pcm16(temp_path, reduced, channels, variant_rate)
+            else:
+                _write_ima_adpcm(temp_path, reduced, channels, variant_rate)
+            variant_hash = file_hash(temp_path)
+            variant_file = f'{stem}.{variant_hash}.wav'
+            os.replace(temp_path, os.path.join(self.cache_dir, variant_file))
+            variants[name] = {
+                'file': variant_file,
+                'hash': variant_hash,
+                'bytes': os.path.getsize(os.path.join(self.cache_dir, variant_file)),
+                'mime': 'audio/wav',
+                'codecs': spec['codecs'],
+                'sample_rate': variant_rate,
+            }
+        return {
+            'source': filename,
+            'hash': source_hash,
+            'channels': channels,
+            'duration': round(len(samples) / channels / rate, 3),
+            'variants': variants,
+        }
+
+    def _remove_stale_files(self, manifest: Dict):
+        """删除清单中已不再引用的旧变体"""
+        referenced = {variant['file'] for entry in manifest.values()
+                      for name, variant in entry['variants'].items() if name != ORIGINAL_VARIANT}
+        for filename in os.listdir(self.cache_dir):
+            if HASHED_NAME_PATTERN.match(filename) and filename not in referenced:
+                os.remove(os.path.join(self.cache_dir, filename))
+
+    def ensure_loaded(self) -> bool:
+        """
+        首次使用时加载清单，没有清单时生成。后台正在生成（冷启动）时不等待
+
+        Returns:
+            bool: 清单是否可用，为False时调用方应直接使用原始音频
+        """
+        if self.manifest:
+            return True
+        manifest = self._load_manifest()
+        if manifest:
+            # 上次运行留下的清单，后台生成完成后会被替换
+            if not self.manifest:
+                self.manifest = manifest
+            return True
+        if not self._build_lock.acquire(blocking=False):
+            return False
+        try:
+            if not self.manifest:
+                self._build()
+        finally:
+            self._build_lock.release()
+        return bool(self.manifest)
+
+    def _original_variant(self, filename: str) -> Optional[Dict]:
+        """清单尚未生成时直接描述原始音频文件（不计算哈希，按修改时间和大小生成ETag）"""
+        if os.path.basename(filename) != filename:
+            return None
+        path = os.path.join(self.audio_dir, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return {
+            'file': filename,
+            'hash': f'{stat.st_mtime_ns:x}-{stat.st_size:x}',
+            'bytes': stat.st_size,
+            'mime': 'audio/wav',
+            'codecs': '1',
+        }
+
+    def _url(self, stem: str, variant: Dict) -> str:
+        return f"{self.url_prefix}/{stem}.{variant['hash']}.wav"
+
+    def resolve_file(self, filename: str) -> Optional[Dict]:
+        """
+        解析请求的文件名
+
+        Args:
+            filename: <名称>.<哈希>.wav（固定内容）或 <名称>.wav（按 Accept 协商）
+
+        Returns:
+            Optional[Dict]: {'stem', 'hashed', 'variant'(哈希文件名时)}，不存在返回None；
+                            清单生成中时为原始音频 {'stem', 'hashed': False, 'pending': True, 'name', 'variant'}
+        """
+        if not self.ensure_loaded():
+            stem, ext = os.path.splitext(filename)
+            variant = self._original_variant(filename) if ext.lower() == '.wav' else None
+            if variant is None:
+                return None
+            return {'stem': stem, 'hashed': False, 'pending': True, 'name': ORIGINAL_VARIANT, 'variant': variant}
+        match = HASHED_NAME_PATTERN.match(filename)
+        if match and match.group('stem') in self.manifest:
+            for name, variant in self.manifest[match.group('stem')]['variants'].items():
+                if variant['hash'] == match.group('hash'):
+                    return {'stem': match.group('stem'), 'hashed': True, 'name': name, 'variant': variant}
+            return None
+        stem, ext = os.path.splitext(filename)
+        if ext.lower() == '.wav' and stem in self.manifest:
+            return {'stem': stem, 'hashed': False}
+        return None
+
+    def path_for(self, name: str, variant: Dict) -> str:
+        """变体文件的磁盘路径"""
+        directory = self.audio_dir if name == ORIGINAL_VARIANT else self.cache_dir
+        return os.path.join(directory, variant['file'])
+
+    def negotiate(self, stem: str, accept: str = None, preferred: str = None):
+        """
+        选择客户端支持的最小变体
+
+        Args:
+            stem: 音频名称
+            accept: Accept 请求头
+            preferred: 指定变体名称（存在时优先）
+
+        Returns:
+            tuple: (变体名称, 变体信息)
+        """
+        variants = self.manifest[stem]['variants']
+        if preferred in variants:
+            return preferred, variants[preferred]
+        accept_ranges = parse_accept(accept)
+        candidates = [(variant['bytes'], name) for name, variant in variants.items()
+                      if accepts_variant(accept_ranges, variant)]
+        name = min(candidates)[1] if candidates else ORIGINAL_VARIANT
+        return name, variants[name]
+
+    def resolve_music(self, music_data: Dict, accept: str = None) -> Dict:
+        """
+        把音乐信息中指向 static/audio 的地址换成变体地址
+
+        accept 为空时（广播给多个客户端的卡片）使用按 Accept 协商的地址，
+        否则直接使用该客户端支持的最小变体的哈希地址；同时附上全部变体供前端选择
+
+        Args:
+            music_data: 音乐信息，url 形如 /static/audio/<名称>.wav
+            accept: 请求方的 Accept 请求头
+
+        Returns:
+            Dict: 新的音乐信息（不修改原字典）
+        """
+        url = (music_data or {}).get('url') or ''
+        if not url.startswith('/static/audio/'):
+            return music_data
+        if not self.ensure_loaded():
+            # 变体还在生成，先使用原始地址
+            return music_data
+        stem, ext = os.path.splitext(os.path.basename(url))
+        entry = self.manifest.get(stem)
+        if not entry or ext.lower() != '.wav':
+            return music_data
+        resolved = dict(music_data)
+        if accept:
+            _, variant = self.negotiate(stem, accept)
+            resolved['url'] = self._url(stem, variant)
+        else:
+            resolved['url'] = f'{self.url_prefix}/{stem}.wav'
+        resolved['duration'] = entry['duration']
+        if self.peaks_prefix:
+            resolved['peaks_url'] = f'{self.peaks_prefix}/{stem}/peaks'
+        resolved['variants'] = [
+            {'url': self._url(stem, variant), 'type': f"{variant['mime']}; codecs={variant['codecs']}",
+             'bytes': variant['bytes']}
+            for variant in sorted(entry['variants'].values(), key=lambda item: item['bytes'])
+        ]
+        return resolved
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'build':
+        base = os.path.dirname(os.path.abspath(__file__))
+        result = AudioLibrary(os.path.join(base, 'static', 'audio')).build()
+        for stem, entry in result.items():
+            sizes = ', '.join(f"{name}={variant['bytes']}" for name, variant in entry['variants'].items())
+            print(f"{stem}: {sizes}")
+    else:
+        print(__doc__)
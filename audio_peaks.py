@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+音频波形索引模块
+内存映射 static/audio 下的WAV文件，计算时长、采样率和降采样后的最小/最大值波形，
+结果按文件内容哈希缓存到磁盘，前端无需下载音频即可显示时长和波形。
+安装了 NumPy 时使用向量化计算，否则退回纯Python实现
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from audio_assets import file_hash
+
+DEFAULT_POINTS = 800
+MAX_POINTS = 4000
+# 可用的波形点数，请求的点数向上取到其中之一，每个音频最多只有这几份缓存
+POINT_SIZES = (100, 200, 400, DEFAULT_POINTS, 1600, MAX_POINTS)
+# 内存中最多缓存的波形数
+DEFAULT_MEMORY_ENTRIES = 64
+# 波形缓存格式版本，计算方式变化时递增使旧缓存失效
+PEAKS_VERSION = 1
+
+
+def read_wav_header(path: str) -> Dict:
+    """
+    解析WAV文件头
+
+    Returns:
+        Dict: format_tag、channels、sample_rate、bits_per_sample、data_offset、data_size
+    """
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f"不是WAV文件: {path}")
+        header = {}
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                break
+            chunk_id, size = struct.unpack('<4sI', chunk)
+            if chunk_id == b'fmt ':
+                fmt = f.read(size)
+                (header['format_tag'], header['channels'], header['sample_rate'],
+                 _, _, header['bits_per_sample']) = struct.unpack('<HHIIHH', fmt[:16])
+            elif chunk_id == b'data':
+                header['data_offset'] = f.tell()
+                header['data_size'] = size
+                break
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+    if 'format_tag' not in header or 'data_offset' not in header:
+        raise ValueError(f"WAV文件缺少fmt或data块: {path}")
+    # 1=PCM，0xFFFE=扩展格式（子格式为PCM时同样按整数采样读取）
+    if header['format_tag'] not in (1, 0xFFFE) or header['bits_per_sample'] not in (8, 16):
+        raise ValueError(f"只支持8位或16位PCM: {path}")
+    # 有的写入程序不回填data块长度，按文件实际大小截断
+    header['data_size'] = min(header['data_size'], os.path.getsize(path) - header['data_offset'])
+    return header
+
+
+def _peaks_numpy(path: str, header: Dict, frames: int, points: int) -> List[List[float]]:
+    dtype, scale, bias = ('<i2', 32768.0, 0) if header['bits_per_sample'] == 16 else ('u1', 128.0, 128)
+    channels = header['channels']
+    data = numpy.memmap(path, dtype=dtype, mode='r', offset=header['data_offset'],
+                        shape=(frames * channels,)).reshape(frames, channels)
+    edges = numpy.linspace(0, frames, points + 1).astype(numpy.int64)[:-1]
+    # 多声道取各声道的最小/最大值
+    lows = numpy.minimum.reduceat(data.min(axis=1), edges)
+    highs = numpy.maximum.reduceat(data.max(axis=1), edges)
+    lows = (lows.astype(numpy.float64) - bias) / scale
+    highs = (highs.astype(numpy.float64) - bias) / scale
+    return [[round(float(low), 4), round(float(high), 4)] for low, high in zip(lows, highs)]
+
+
+def _peaks_python(path: str, header: Dict, frames: int, points: int) -> List[List[float]]:
+    sixteen = header['bits_per_sample'] == 16
+    scale, bias = (32768.0, 0) if sixteen else (128.0, 128)
+    channels = header['channels']
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)[header['data_offset']:header['data_offset'] + frames * channels * (2 if sixteen else 1)]
+        samples = view.cast('h') if sixteen else view
+        try:
+            peaks = []
+            for point in range(points):
+                start = point * frames // points * channels
+                end = max((point + 1) * frames // points * channels, start + channels)
+                segment = samples[start:end]
+                peaks.append([round((min(segment) - bias) / scale, 4), round((max(segment) - bias) / scale, 4)])
+                segment.release()
+            return peaks
+        finally:
+            samples.release()
+            view.release()
+
+
+def snap_points(points: int) -> int:
+    """把请求的点数向上取到 POINT_SIZES 中最接近的值"""
+    return next((size for size in POINT_SIZES if size >= points), MAX_POINTS)
+
+
+def compute_peaks(path: str, points: int = DEFAULT_POINTS) -> Dict:
+    """
+    计算音频的元数据和波形
+
+    Args:
+        path: WAV文件路径
+        points: 波形点数（每点为一段采样的 [最小值, 最大值]，范围 -1~1）
+
+    Returns:
+        Dict: duration、sample_rate、channels、bits_per_sample、frames、points、peaks
+    """
+    header = read_wav_header(path)
+    frame_bytes = header['channels'] * header['bits_per_sample'] // 8
+    frames = header['data_size'] // frame_bytes
+    points = max(1, min(points, frames)) if frames else 0
+    if not points:
+        peaks = []
+    elif numpy is not None:
+        peaks = _peaks_numpy(path, header, frames, points)
+    else:
+        peaks = _peaks_python(path, header, frames, points)
+    return {
+        'duration': round(frames / header['sample_rate'], 3),
+        'sample_rate': header['sample_rate'],
+        'channels': header['channels'],
+        'bits_per_sample': header['bits_per_sample'],
+        'frames': frames,
+        'points': points,
+        'peaks': peaks,
+    }
+
+
+class AudioPeaksIndex:
+    """按内容哈希缓存的音频元数据和波形索引"""
+
+    def __init__(self, audio_dir: str, cache_dir: str = None, max_entries: int = DEFAULT_MEMORY_ENTRIES):
+        """
+        初始化索引
+
+        Args:
+            audio_dir: 音频目录
+            cache_dir: 波形缓存目录，默认为 audio_dir/variants/peaks
+            max_entries: 内存中最多缓存的波形数，按最近最少使用淘汰
+        """
+        self.audio_dir = audio_dir
+        self.cache_dir = cache_dir or os.path.join(audio_dir, 'variants', 'peaks')
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # 路径 -> (修改时间, 大小, 内容哈希)，避免每次请求都重新计算哈希
+        self._hashes: Dict[str, tuple] = {}
+        # (内容哈希, 点数) -> 结果，最久未用的在前面
+        self._cache: 'OrderedDict[tuple, Dict]' = OrderedDict()
+
+    def _path_for(self, stem: str) -> Optional[str]:
+        if os.path.basename(stem) != stem:
+            return None
+        path = os.path.join(self.audio_dir, f'{stem}.wav')
+        return path if os.path.isfile(path) else None
+
+    def _hash_for(self, path: str) -> str:
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._hashes.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        content_hash = file_hash(path)
+        with self._lock:
+            self._hashes[path] = (stat.st_mtime_ns, stat.st_size, content_hash)
+        return content_hash
+
+    def get(self, stem: str, points: int = DEFAULT_POINTS) -> Optional[Dict]:
+        """
+        获取音频的元数据和波形
+
+        Args:
+            stem: 音频名称（不含扩展名）
+            points: 波形点数，向上取到 POINT_SIZES 中的值，最大 MAX_POINTS
+
+        Returns:
+            Optional[Dict]: 结果（含 hash），音频不存在返回None
+        """
+        path = self._path_for(stem)
+        if path is None:
+            return None
+        points = snap_points(max(1, min(int(points), MAX_POINTS)))
+        content_hash = self._hash_for(path)
+        key = (content_hash, points)
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+        if result is not None:
+            return result
+
+        cache_path = os.path.join(self.cache_dir, f'{content_hash}_{points}_v{PEAKS_VERSION}.json')
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            result = compute_peaks(path, points)
+            result['name'] = stem
+            result['hash'] = content_hash
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # 同一波形可能被并发计算，各自写入独立的临时文件再改名
+            fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(result, f, separators=(',', ':'))
+                os.replace(temp_path, cache_path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        with self._lock:
+            self._cache[key] = result
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return result
+
+    def list_audio(self) -> List[Dict]:
+        """列出所有音频的元数据（不含波形）"""
+        items = []
+        for filename in sorted(os.listdir(self.audio_dir)):
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() != '.wav':
+                continue
+            try:
+                info = self.get(stem)
+            except (OSError, ValueError) as e:
+                print(f"读取音频信息失败 {filename}: {str(e)}")
+                continue
+            items.append({key: value for key, value in info.items() if key != 'peaks'})
+        return items
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+登录认证服务模块
+把耗时的密码哈希计算放到有界线程池中执行，排队过多时直接拒绝（削峰），
+并用短时缓存减少登录高峰期按用户名查询数据库的次数
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Optional
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class AuthBusyError(Exception):
+    """认证请求排队已满或等待超时，调用方应提示稍后重试"""
+
+
+class AuthService:
+    """带线程池、削峰和用户缓存的认证服务"""
+
+    def __init__(self, db, max_workers: int = None, max_pending: int = 32,
+                 timeout: float = 10.0, cache_ttl: float = 30.0, cache_size: int = 2048):
+        """
+        初始化认证服务
+
+        Args:
+            db: DatabaseManager 实例
+            max_workers: 哈希计算线程数，默认为CPU核数
+            max_pending: 允许的最大排队和执行中的哈希任务数，超过后直接拒绝
+            timeout: 等待哈希结果的最长秒数
+            cache_ttl: 用户记录缓存秒数
+            cache_size: 最多缓存的用户数
+        """
+        self.db = db
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix='auth-hash')
+        self._lock = threading.Lock()
+        self._cache: 'OrderedDict[str, tuple]' = OrderedDict()
+        self.pending = 0
+        self.stats = {
+            'logins': 0,
+            'login_failures': 0,
+            'registrations': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+        }
+        self.hash_latencies = deque(maxlen=512)
+
+    def _submit(self, func: Callable, *args):
+        """
+        在线程池中执行哈希计算并等待结果
+
+        Raises:
+            AuthBusyError: 排队已满或等待超时
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.stats['rejected'] += 1
+                raise AuthBusyError("认证请求过多")
+            self.pending += 1
+
+        def run():
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.hash_latencies.append((time.perf_counter() - started) * 1000)
+                with self._lock:
+                    self.pending -= 1
+
+        future = self._executor.submit(run)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # 任务仍会执行完，只是不再等待它的结果
+            with self._lock:
+                self.stats['timeouts'] += 1
+            raise AuthBusyError("认证请求超时")
+
+    def get_user(self, username: str) -> Optional[Dict]:
+        """
+        获取用户记录（带缓存，不存在的用户同样缓存）
+
+        Args:
+            username: 用户名
+
+        Returns:
+            Optional[Dict]: 用户记录，不存在返回None
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(username)
+            if cached and cached[0] > now:
+                self._cache.move_to_end(username)
+                self.stats['cache_hits'] += 1
+                return cached[1]
+            self.stats['cache_misses'] += 1
+
+        user = self.db.get_user_by_username(username)
+        with self._lock:
+            self._cache[username] = (now + self.cache_ttl, user)
+            self._cache.move_to_end(username)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return user
+
+    def invalidate(self, username: str):
+        """使某个用户的缓存失效"""
+        with self._lock:
+            self._cache.pop(username, None)
+
+    def verify(self, username: str, password: str) -> Optional[int]:
+        """
+        验证用户名和密码
+
+        Returns:
+            Optional[int]: 验证成功返回用户ID，失败返回None
+
+        Raises:
+            AuthBusyError: 排队已满或等待超时
+        """
+        user = self.get_user(username)
+        verified = bool(user) and self._submit(check_password_hash, user['password_hash'], password)
+        with self._lock:
+            self.stats['logins' if verified else 'login_failures'] += 1
+        return user['id'] if verified else None
+
+    def register(self, username: str, password: str) -> bool:
+        """
+        注册用户
+
+        Returns:
+            bool: 成功返回True，用户名已存在返回False
+
+        Raises:
+            AuthBusyError: 排队已满或等待超时
+        """
+        if self.get_user(username):
+            return False
+        password_hash = self._submit(generate_password_hash, password)
+        created = self.db.create_user(username, password, password_hash=password_hash)
+        self.invalidate(username)
+        if created:
+            with self._lock:
+                self.stats['registrations'] += 1
+        return created
+
+    def get_stats(self) -> Dict:
+        """获取认证服务统计信息"""
+        latencies = sorted(self.hash_latencies)
+
+        def percentile(q):
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * q))], 3) if latencies else 0.0
+
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pending'] = self.pending
+            stats['cached_users'] = len(self._cache)
+        stats.update({
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'hash_p50_ms': percentile(0.50),
+            'hash_p95_ms': percentile(0.95),
+            'hash_p99_ms': percentile(0.99),
+        })
+        return stats
+
+    def shutdown(self):
+        """关闭线程池"""
+        self._executor.shutdown(wait=False)
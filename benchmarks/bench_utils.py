@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试公共工具
+分位数统计、结果保存和与基线结果的对比
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterable
+
+from stub_backends import REPO_ROOT
+
+RESULTS_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'results')
+
+
+def percentile(sorted_values, q: float) -> float:
+    """计算已排序列表的分位数"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def summarize(latencies_ms: Iterable[float]) -> Dict:
+    """汇总延迟样本（毫秒）"""
+    values = sorted(latencies_ms)
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 0.50), 3),
+        'p95_ms': round(percentile(values, 0.95), 3),
+        'p99_ms': round(percentile(values, 0.99), 3),
+        'max_ms': round(values[-1], 3) if values else 0.0,
+    }
+
+
+def save_report(report: Dict, name: str, output: str = None) -> str:
+    """
+    保存基准测试结果
+
+    Args:
+        report: 结果字典
+        name: 基准测试名称，用作默认文件名前缀
+        output: 输出文件路径，默认写入 benchmarks/results/
+
+    Returns:
+        str: 输出文件路径
+    """
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"基准测试结果已保存: {output}")
+    return output
+
+
+def _flatten(value, prefix: str = '') -> Dict[str, float]:
+    """把嵌套结果展开为 点分路径 -> 数值"""
+    flat = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flat.update(_flatten(item, f'{prefix}.{key}' if prefix else str(key)))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        flat[prefix] = value
+    return flat
+
+
+def compare_reports(baseline_path: str, report: Dict):
+    """与基线结果对比，打印两边都有的数值指标的变化"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    old_values = _flatten(baseline.get('results', {}))
+    new_values = _flatten(report.get('results', {}))
+    print(f"与基线 {baseline_path} 对比:")
+    for key, new in new_values.items():
+        if key not in old_values:
+            continue
+        old = old_values[key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+        print(f"  {key}: {old} -> {new} ({change})")
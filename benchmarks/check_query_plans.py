@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+历史查询执行计划检查
+生成一个小规模的合成数据集，用 EXPLAIN QUERY PLAN 检查 get_messages 的各种查询形状
+（不应出现全表扫描和临时B树排序）以及时间范围换算ID的边界查询（只能走 created_ms 索引），
+再打乱部分消息的写入时间顺序，核对按时间范围查询的结果与直接按 created_ms 过滤一致。
+有任何问题时以非零状态退出，可在提交前或CI中运行
+
+用法:
+    python benchmarks/check_query_plans.py
+    python benchmarks/check_query_plans.py --rows 100000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from db_benchmark import DatasetSpec, generate_dataset
+from stub_backends import REPO_ROOT
+
+
+def check_time_ranges(manager, db_path: str, spec: DatasetSpec, windows: int) -> list:
+    """打乱相邻消息的写入时间后，核对时间范围查询的结果，返回不一致的时间范围"""
+    rng = random.Random(spec.seed)
+    conn = sqlite3.connect(db_path)
+    # 模拟并发写入：每7条中有一条ID较大的消息带有比前面几条更早的时间（偏差在 ID_ORDER_SLACK_MS 以内）
+    conn.execute('UPDATE messages SET created_ms = created_ms - 20000 WHERE id % 7 = 0')
+    conn.commit()
+
+    failures = []
+    end = datetime.utcnow()
+    for _ in range(windows):
+        start_time = end - timedelta(days=rng.uniform(0, spec.days))
+        end_time = start_time + timedelta(hours=rng.uniform(0.01, 6))
+        start_text = start_time.strftime('%Y-%m-%d %H:%M:%S')
+        end_text = end_time.strftime('%Y-%m-%d %H:%M:%S')
+        got = sorted(message['id'] for message in manager.get_messages(
+            limit=1000000, room='chat_room', start_time=start_text, end_time=end_text))
+        start_ms = manager._parse_time_ms(start_text)
+        end_ms = manager._parse_time_ms(end_text, end=True)
+        expected = [row[0] for row in conn.execute('''
+            SELECT id FROM messages WHERE room = 'chat_room' AND created_ms >= ? AND created_ms <= ?
+            ORDER BY id
+        ''', (start_ms, end_ms))]
+        if got != expected:
+            failures.append({'start_time': start_text, 'end_time': end_text,
+                             'expected': len(expected), 'got': len(got)})
+    conn.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='历史查询执行计划检查')
+    parser.add_argument('--rows', type=int, default=20000, help='合成消息条数')
+    parser.add_argument('--days', type=int, default=1, help='消息时间跨度（天），跨度越小相邻消息越密')
+    parser.add_argument('--windows', type=int, default=50, help='核对结果的随机时间范围数')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory() as data_dir:
+        # database 模块导入时会在当前目录创建默认数据库，切换到临时目录避免污染仓库
+        os.chdir(data_dir)
+        if REPO_ROOT not in sys.path:
+            sys.path.insert(0, REPO_ROOT)
+        from database import DatabaseManager
+
+        spec = DatasetSpec(rows=args.rows, nicknames=200, sessions=1000, rooms=5,
+                           days=args.days, seed=args.seed)
+        db_path = os.path.join(data_dir, 'plans.db')
+        generate_dataset(db_path, spec)
+        manager = DatabaseManager(db_path)
+
+        plans = manager.verify_query_plans()
+        for name, result in plans['queries'].items():
+            status = '有问题' if result['problems'] else '通过'
+            print(f"{name}: {status}")
+            for detail in result['plan']:
+                print(f"    {detail}")
+        if not plans['ok']:
+            ok = False
+            print(f"执行计划检查失败: {plans.get('error') or '存在全表扫描或临时排序'}")
+
+        failures = check_time_ranges(manager, db_path, spec, args.windows)
+        for failure in failures:
+            print(f"时间范围查询结果不一致: {failure}")
+        print(f"时间范围查询核对 {args.windows} 个，不一致 {len(failures)} 个")
+        ok = ok and not failures
+        os.chdir(REPO_ROOT)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
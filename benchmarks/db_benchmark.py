@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DatabaseManager 规模基准测试
+生成百万到千万级消息的合成数据集，测量 save_message 吞吐量（单线程和并发）、
+get_messages 在浅分页和深分页下各过滤条件的延迟、get_user_stats、
+export_messages、backup_database 和 cleanup_old_messages，结果输出为JSON
+
+用法:
+    python benchmarks/db_benchmark.py --sizes 1m
+    python benchmarks/db_benchmark.py --sizes 1m,10m,50m --data-dir /data/daip_bench
+    python benchmarks/db_benchmark.py --sizes 100k --compare benchmarks/results/base.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bench_utils import compare_reports, save_report, summarize
+from stub_backends import REPO_ROOT
+
+MESSAGE_TYPES = [('text', 0.80), ('at', 0.06), ('ai', 0.06), ('movie', 0.02),
+                 ('music', 0.03), ('weather', 0.03)]
+INSERT_BATCH = 50000
+
+
+def parse_size(text: str) -> int:
+    """解析数据集规模，支持 k/m 后缀，例如 1m、500k"""
+    text = text.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(text[-1], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+
+def _timed_ms(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000, result
+
+
+class DatasetSpec:
+    """合成数据集的分布参数"""
+
+    def __init__(self, rows: int, nicknames: int, sessions: int, rooms: int, days: int, seed: int):
+        self.rows = rows
+        self.nicknames = nicknames
+        self.sessions = sessions
+        self.rooms = rooms
+        self.days = days
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+def generate_dataset(db_path: str, spec: DatasetSpec):
+    """
+    生成合成数据集（已存在且参数相同则复用）
+
+    Args:
+        db_path: 数据库文件路径
+        spec: 数据集参数
+    """
+    meta_path = db_path + '.meta.json'
+    if os.path.exists(db_path) and os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == spec.to_dict():
+                print(f"复用已有数据集: {db_path}")
+                return
+    for path in (db_path, meta_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    from database import DatabaseManager
+    DatabaseManager(db_path)  # 创建表结构和索引
+
+    rng = random.Random(spec.seed)
+    types, weights = zip(*MESSAGE_TYPES)
+    now = datetime.now()
+    start_time = now - timedelta(days=spec.days)
+    span_seconds = spec.days * 86400
+    # created_ms 与 timestamp 文本一致，按UTC解释
+    EPOCH = datetime(1970, 1, 1)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA journal_mode = MEMORY')
+    conn.executemany(
+        'INSERT OR IGNORE INTO rooms (name, created_by) VALUES (?, ?)',
+        [(f'room_{index}', 'bench') for index in range(1, spec.rooms)])
+    conn.executemany(
+        'INSERT INTO user_sessions (session_id, nickname, ip_address, status) VALUES (?, ?, ?, ?)',
+        [(f'session_{index}', f'user_{index % spec.nicknames}', '127.0.0.1',
+          'closed' if index % 10 else 'active') for index in range(spec.sessions)])
+    conn.commit()
+
+    print(f"正在生成 {spec.rows} 条消息: {db_path}")
+    generated = 0
+    started = time.time()
+    while generated < spec.rows:
+        batch = []
+        count = min(INSERT_BATCH, spec.rows - generated)
+        # 时间按插入顺序单调递增，与真实聊天记录一致
+        for offset in range(count):
+            position = (generated + offset) / spec.rows
+            timestamp = start_time + timedelta(seconds=position * span_seconds)
+            message_type = rng.choices(types, weights)[0]
+            nickname = f'user_{int(rng.paretovariate(1.2)) % spec.nicknames}'
+            room = 'chat_room' if rng.random() < 0.5 else f'room_{rng.randrange(1, max(2, spec.rooms))}'
+            length = 200 + rng.randrange(800) if message_type == 'ai' else 5 + rng.randrange(60)
+            batch.append((
+                f'session_{rng.randrange(spec.sessions)}', nickname, 'x' * length, message_type,
+                message_type == 'ai', message_type in ('at', 'ai'), message_type == 'movie',
+                timestamp.strftime('%Y-%m-%d %H:%M:%S'), int((timestamp - EPOCH).total_seconds()) * 1000,
+                '127.0.0.1', room
+            ))
+        conn.executemany('''
+            INSERT INTO messages (session_id, nickname, message, message_type, is_ai_response,
+                                  is_at_message, is_movie, timestamp, created_ms, user_ip, room)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+        conn.commit()
+        generated += count
+        print(f"  已生成 {generated}/{spec.rows} ({generated / (time.time() - started):.0f} 行/秒)")
+    conn.execute('ANALYZE')
+    conn.close()
+
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(spec.to_dict(), f)
+
+
+def bench_save_message(manager, count: int, threads: int) -> dict:
+    """测量 save_message 吞吐量"""
+    def worker(worker_id, per_worker, latencies):
+        for index in range(per_worker):
+            elapsed, _ = _timed_ms(manager.save_message, nickname=f'bench_writer_{worker_id}',
+                                   message=f'基准测试消息 {index}', session_id=f'session_{index}',
+                                   room='chat_room')
+            latencies.append(elapsed)
+
+    latencies = []
+    per_worker = max(1, count // threads)
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(worker_id, per_worker, latencies))
+               for worker_id in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    result = summarize(latencies)
+    result['threads'] = threads
+    result['rows_per_second'] = round(len(latencies) / elapsed, 1)
+    return result
+
+
+def bench_repeat(func, repeat: int, **kwargs) -> dict:
+    """重复调用并汇总延迟"""
+    latencies = [_timed_ms(func, **kwargs)[0] for _ in range(repeat)]
+    return summarize(latencies)
+
+
+def bench_get_messages(manager, spec: DatasetSpec, repeat: int, deep_offset: int) -> dict:
+    """测量 get_messages 在各过滤条件下的浅分页和深分页延迟"""
+    middle = datetime.now() - timedelta(days=spec.days / 2)
+    filters = {
+        'all_rooms': {'room': None},
+        'room': {'room': 'chat_room'},
+        'quiet_room': {'room': f'room_{max(1, spec.rooms - 1)}'},
+        'nickname': {'room': None, 'nickname': 'user_1'},
+        'room_nickname': {'room': 'chat_room', 'nickname': 'user_1'},
+        'message_type': {'room': None, 'message_type': 'movie'},
+        'time_range': {'room': 'chat_room',
+                       'start_time': (middle - timedelta(hours=12)).strftime('%Y-%m-%d %H:%M:%S'),
+                       'end_time': middle.strftime('%Y-%m-%d %H:%M:%S')},
+    }
+    results = {}
+    for name, kwargs in filters.items():
+        results[name] = {
+            'shallow': bench_repeat(manager.get_messages, repeat, limit=50, offset=0, **kwargs),
+            'deep': bench_repeat(manager.get_messages, max(1, repeat // 5), limit=50,
+                                 offset=deep_offset, **kwargs),
+        }
+    return results
+
+
+def bench_user_stats(manager, spec: DatasetSpec, repeat: int) -> dict:
+    """测量 get_user_stats"""
+    since = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d %H:%M:%S')
+    return {
+        'all': bench_repeat(manager.get_user_stats, repeat),
+        'nickname': bench_repeat(manager.get_user_stats, repeat, nickname='user_1'),
+        'last_day': bench_repeat(manager.get_user_stats, repeat, start_time=since),
+    }
+
+
+def run_size(rows: int, args) -> dict:
+    """对一个规模的数据集执行全部基准测试"""
+    spec = DatasetSpec(rows=rows, nicknames=args.nicknames, sessions=args.sessions,
+                       rooms=args.rooms, days=args.days, seed=args.seed)
+    db_path = os.path.join(args.data_dir, f'bench_{rows}.db')
+    generate_started = time.time()
+    generate_dataset(db_path, spec)
+
+    from database import DatabaseManager
+    manager = DatabaseManager(db_path)
+    result = {
+        'dataset': spec.to_dict(),
+        'dataset_seconds': round(time.time() - generate_started, 1),
+        'database_size_mb': round(os.path.getsize(db_path) / (1024 * 1024), 1),
+    }
+    if not manager.epoch_ms_ready:
+        # 旧版本生成的数据集没有毫秒时间戳，顺便测量在线回填耗时
+        print("回填 created_ms ...")
+        elapsed, _ = _timed_ms(manager.backfill_created_ms, pause=0)
+        result['backfill_created_ms'] = {'ms': round(elapsed, 1)}
+    plans = manager.verify_query_plans()
+    result['query_plans_ok'] = plans['ok']
+    if not plans['ok']:
+        print(f"警告：历史查询存在全表扫描或临时排序: {plans['queries']}")
+
+    print("测量 get_messages ...")
+    result['get_messages'] = bench_get_messages(manager, spec, args.repeat, args.deep_offset)
+    print("测量 get_user_stats ...")
+    result['get_user_stats'] = bench_user_stats(manager, spec, max(1, args.repeat // 5))
+
+    with tempfile.TemporaryDirectory(dir=args.data_dir) as scratch:
+        print("测量 export_messages ...")
+        elapsed, ok = _timed_ms(manager.export_messages, os.path.join(scratch, 'export.json'), 'json')
+        result['export_messages'] = {'ms': round(elapsed, 1), 'success': ok}
+        print("测量 backup_database ...")
+        elapsed, ok = _timed_ms(manager.backup_database, os.path.join(scratch, 'backups'))
+        result['backup_database'] = {'ms': round(elapsed, 1), 'success': ok}
+
+    print("测量 save_message ...")
+    result['save_message'] = {
+        'single_thread': bench_save_message(manager, args.writes, 1),
+        'concurrent': bench_save_message(manager, args.writes, args.writer_threads),
+    }
+
+    # 清理会删除数据，放在最后执行，并让下一次运行重新生成数据集
+    print("测量 cleanup_old_messages ...")
+    elapsed, ok = _timed_ms(manager.cleanup_old_messages, args.retention_days)
+    result['cleanup_old_messages'] = {'ms': round(elapsed, 1), 'retention_days': args.retention_days,
+                                      'success': ok}
+    os.remove(db_path + '.meta.json')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DatabaseManager 规模基准测试')
+    parser.add_argument('--sizes', default='1m', help='数据集规模列表，例如 1m,10m,50m')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'daip_db_bench'),
+                        help='数据集存放目录（可复用）')
+    parser.add_argument('--nicknames', type=int, default=5000, help='用户昵称数量')
+    parser.add_argument('--sessions', type=int, default=50000, help='会话数量')
+    parser.add_argument('--rooms', type=int, default=20, help='聊天室数量')
+    parser.add_argument('--days', type=int, default=90, help='消息时间跨度（天）')
+    parser.add_argument('--seed', type=int, default=42, help='随机种子')
+    parser.add_argument('--repeat', type=int, default=20, help='每项查询重复次数')
+    parser.add_argument('--deep-offset', type=int, default=100000, help='深分页的偏移量')
+    parser.add_argument('--writes', type=int, default=2000, help='save_message 写入次数')
+    parser.add_argument('--writer-threads', type=int, default=8, help='并发写入线程数')
+    parser.add_argument('--retention-days', type=int, default=80, help='cleanup_old_messages 的保留天数')
+    parser.add_argument('--output', help='结果输出文件')
+    parser.add_argument('--compare', help='用于对比的基线结果文件')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    # database 模块导入时会在当前目录创建默认数据库，切换到数据目录避免污染仓库
+    os.chdir(args.data_dir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    report = {
+        'benchmark': 'db_benchmark',
+        'generated_at': datetime.now().isoformat(),
+        'sqlite_version': sqlite3.sqlite_version,
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': {},
+    }
+    for size_text in args.sizes.split(','):
+        rows = parse_size(size_text)
+        print(f"===== 数据集规模: {rows} 条消息 =====")
+        report['results'][size_text.strip()] = run_size(rows, args)
+
+    print(json.dumps(report['results'], ensure_ascii=False, indent=2))
+    save_report(report, 'db_benchmark', args.output)
+    if args.compare:
+        compare_reports(args.compare, report)
+
+
+if __name__ == '__main__':
+    main()
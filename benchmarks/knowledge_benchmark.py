@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+知识库关键词匹配基准测试
+在一组常见问题上对比逐条目、逐关键词做子串查找的匹配方式（对每个关键词做一次 in 判断）
+和 KnowledgeMatcher 的 Aho–Corasick 自动机，并用随机生成的条目把知识库放大若干倍，
+观察两者的延迟随知识库规模的变化。两种方式的打分规则相同，同时核对结果是否一致。
+另外统计 KnowledgeRetriever（BM25）能在本地直接回答的问题占比和检索耗时，
+并核对提到学校地名但与知识库无关的问题没有被直接回答
+
+用法:
+    python benchmarks/knowledge_benchmark.py
+    python benchmarks/knowledge_benchmark.py --scales 1,10,100,1000 --questions my_questions.txt
+"""
+
+import argparse
+import os
+import random
+import time
+from datetime import datetime
+
+from bench_utils import compare_reports, save_report, summarize
+from stub_backends import REPO_ROOT
+
+from knowledge_matcher import (KnowledgeMatcher, SYNONYM_WEIGHT, TITLE_WEIGHT,
+                               load_entries, normalize)
+from knowledge_retrieval import DEFAULT_THRESHOLD, KnowledgeRetriever
+
+# 群聊中 @川小农 的常见提问，可用 --questions 换成从聊天记录导出的问题
+QUESTIONS = [
+    '川农有几个校区',
+    '四川农业大学校区有哪些',
+    '雅安校区在哪里',
+    '成都校区是在温江吗',
+    '都江堰校区怎么去',
+    '川农是211吗',
+    '川农是双一流吗，排名怎么样',
+    '川农哪一年建校的',
+    '学校的前身是什么',
+    '川农有多少年历史了',
+    '川农有哪些专业',
+    '农学专业怎么样',
+    '动物医学是王牌专业吗',
+    '园艺专业学什么',
+    '今年在四川的录取分数线是多少',
+    '报考川农要多少分',
+    '川农的学费一年多少钱',
+    '住宿费怎么收',
+    '有哪些奖学金和助学金',
+    '家里困难可以申请贷款吗',
+    '宿舍是几人间',
+    '寝室有空调吗',
+    '宿舍有独立卫浴和热水吗',
+    '食堂好吃吗',
+    '食堂饭菜贵不贵',
+    '图书馆几点开门',
+    '图书馆可以自习吗',
+    '怎么借书',
+    '从成都坐高铁到雅安校区怎么走',
+    '火车站到学校坐几路公交',
+    '川农考研难吗',
+    '保研率高不高',
+    '有博士点吗',
+    '毕业好找工作吗',
+    '就业率怎么样',
+    '有没有实习机会',
+    '川农的校训是什么',
+    '川农大精神是什么',
+    '招生办电话是多少',
+    '学校官网网址是什么',
+    '你好',
+    '今天天气怎么样',
+    '给我讲个笑话',
+    '川小农你是谁',
+    '明天几点上课',
+]
+
+# 和知识库用字相近但不该直接用知识库回答的问题
+OFF_TOPIC_QUESTIONS = [
+    '都江堰好玩吗',
+    '川农在哪个城市',
+    '雅安今天下雨吗',
+    '温江离成都多远',
+    '成都有什么好吃的',
+    '雅安有什么特产',
+]
+
+# 生成填充条目用的常用汉字
+FILLER_CHARS = '的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严'
+
+
+def entry_terms(entries):
+    """预先整理每个条目的 关键词 -> 权重（与 KnowledgeMatcher 的规则相同）"""
+    prepared = []
+    for entry in entries:
+        keywords = entry.get('keywords') or {}
+        if not isinstance(keywords, dict):
+            keywords = {keyword: 1.0 for keyword in keywords}
+        terms = {}
+        candidates = [(keyword, float(weight)) for keyword, weight in keywords.items()]
+        candidates += [(synonym, SYNONYM_WEIGHT) for synonym in entry.get('synonyms') or []]
+        if entry.get('title'):
+            candidates.append((entry['title'], TITLE_WEIGHT))
+        for term, weight in candidates:
+            term = normalize(term).strip()
+            if term:
+                terms[term] = max(terms.get(term, 0.0), weight)
+        prepared.append((entry.get('id'), terms))
+    return prepared
+
+
+def naive_match(prepared, question: str, min_score: float):
+    """逐条目、逐关键词做子串查找，打分规则与 KnowledgeMatcher 相同"""
+    text = normalize(question)
+    best = None
+    for entry_index, (entry_id, terms) in enumerate(prepared):
+        matched = [term for term in terms if term in text]
+        score = sum(terms[term] for term in matched)
+        if score < min_score:
+            continue
+        key = (-score, -len(matched), entry_index)
+        if best is None or key < best[0]:
+            best = (key, entry_id)
+    return best[1] if best else None
+
+
+def filler_entries(count: int, seed: int):
+    """生成随机关键词的填充条目，模拟知识库扩充"""
+    rng = random.Random(seed)
+    entries = []
+    for index in range(count):
+        keywords = {''.join(rng.sample(FILLER_CHARS, rng.randint(2, 4))): rng.randint(1, 3)
+                    for _ in range(rng.randint(3, 6))}
+        synonyms = [''.join(rng.sample(FILLER_CHARS, rng.randint(2, 5))) for _ in range(rng.randint(2, 5))]
+        entries.append({'id': f'filler_{index}', 'keywords': keywords, 'synonyms': synonyms,
+                        'answer': f'填充条目 {index}'})
+    return entries
+
+
+def time_matcher(match, questions, rounds: int):
+    """对每个问题重复匹配 rounds 次，返回每次匹配的耗时（毫秒）和最后一轮的结果"""
+    latencies = []
+    results = []
+    for _ in range(rounds):
+        results = []
+        for question in questions:
+            started = time.perf_counter()
+            results.append(match(question))
+            latencies.append((time.perf_counter() - started) * 1000)
+    return latencies, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='知识库关键词匹配基准测试')
+    parser.add_argument('--knowledge', default=os.path.join(REPO_ROOT, 'scau_knowledge.json'), help='知识库文件')
+    parser.add_argument('--questions', help='问题文件（每行一个），默认使用内置问题集')
+    parser.add_argument('--scales', default='1,10,100,1000', help='知识库放大倍数（逗号分隔）')
+    parser.add_argument('--rounds', type=int, default=20, help='每种规模重复的轮数')
+    parser.add_argument('--seed', type=int, default=7, help='填充条目的随机种子')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='BM25直接回答的置信度阈值')
+    parser.add_argument('--output', help='结果输出文件')
+    parser.add_argument('--compare', help='用于对比的基线结果文件')
+    args = parser.parse_args()
+
+    questions = QUESTIONS
+    if args.questions:
+        with open(args.questions, 'r', encoding='utf-8') as f:
+            questions = [line.strip() for line in f if line.strip()]
+    base_entries = load_entries(args.knowledge)
+    print(f"知识库 {len(base_entries)} 条，问题 {len(questions)} 个")
+
+    results = {}
+    for scale in [int(value) for value in args.scales.split(',') if value.strip()]:
+        entries = base_entries + filler_entries(len(base_entries) * (scale - 1), args.seed)
+        build_started = time.perf_counter()
+        matcher = KnowledgeMatcher(entries)
+        build_ms = (time.perf_counter() - build_started) * 1000
+
+        def automaton_match(question):
+            hits = matcher.match(question, 1)
+            return hits[0]['id'] if hits else None
+
+        prepared = entry_terms(matcher.entries)
+        naive_latencies, naive_results = time_matcher(
+            lambda question: naive_match(prepared, question, matcher.min_score), questions, args.rounds)
+        automaton_latencies, automaton_results = time_matcher(automaton_match, questions, args.rounds)
+        mismatches = [question for question, left, right in zip(questions, naive_results, automaton_results)
+                      if left != right]
+        results[f'x{scale}'] = {
+            'entries': len(entries),
+            'keywords': matcher.get_stats()['keywords'],
+            'build_ms': round(build_ms, 3),
+            'answered': sum(1 for result in automaton_results if result),
+            'mismatches': len(mismatches),
+            'substring_scan': summarize(naive_latencies),
+            'aho_corasick': summarize(automaton_latencies),
+        }
+        for question in mismatches[:5]:
+            print(f"  结果不一致: {question}")
+
+    retriever = KnowledgeRetriever(base_entries, threshold=args.threshold)
+    retrieval_latencies, retrievals = time_matcher(retriever.retrieve, questions, args.rounds)
+    stats = retriever.get_stats()
+    off_topic_answered = [question for question in OFF_TOPIC_QUESTIONS if retriever.retrieve(question)['answer']]
+    results['retrieval'] = {
+        'local_ratio': stats['local_ratio'],
+        'grounded_ratio': round(stats['grounded'] / stats['queries'], 4) if stats['queries'] else 0.0,
+        'unmatched_ratio': round(stats['unmatched'] / stats['queries'], 4) if stats['queries'] else 0.0,
+        'latency': summarize(retrieval_latencies),
+        'off_topic_answered': len(off_topic_answered),
+    }
+
+    report = {
+        'benchmark': 'knowledge_benchmark',
+        'generated_at': datetime.now().isoformat(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results,
+    }
+    for name, result in results.items():
+        if name == 'retrieval':
+            latency = result['latency']
+            print(f"BM25检索：本地直接回答 {result['local_ratio']:.0%}，带资料请求大模型 {result['grounded_ratio']:.0%}，"
+                  f"无相关资料 {result['unmatched_ratio']:.0%}，p50={latency['p50_ms']}ms p95={latency['p95_ms']}ms；"
+                  f"无关问题被直接回答 {result['off_topic_answered']}/{len(OFF_TOPIC_QUESTIONS)}")
+            for question in off_topic_answered:
+                print(f"  无关问题被直接回答: {question}")
+            continue
+        naive, automaton = result['substring_scan'], result['aho_corasick']
+        print(f"{name}: {result['entries']} 条 / {result['keywords']} 个关键词，构建 {result['build_ms']}ms，"
+              f"命中 {result['answered']}/{len(questions)}，不一致 {result['mismatches']}；"
+              f"子串查找 p50={naive['p50_ms']}ms p95={naive['p95_ms']}ms，"
+              f"自动机 p50={automaton['p50_ms']}ms p95={automaton['p95_ms']}ms")
+    save_report(report, 'knowledge_benchmark', args.output)
+    if args.compare:
+        compare_reports(args.compare, report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+登录吞吐量基准测试
+模拟上课前的集中登录：T个并发请求线程在D秒内持续登录，对比在请求线程中直接
+计算密码哈希（DatabaseManager.verify_user_password）和通过 AuthService
+（有界线程池 + 削峰 + 用户缓存）两种方式的吞吐量、延迟和被拒绝的请求数
+
+用法:
+    python benchmarks/login_benchmark.py --threads 32 --duration 10
+    python benchmarks/login_benchmark.py --users 500 --max-pending 16 --compare benchmarks/results/base.json
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from bench_utils import compare_reports, save_report, summarize
+from stub_backends import REPO_ROOT
+
+PASSWORD = 'bench_password'
+
+
+def create_users(manager, count: int):
+    """创建压测用户，所有用户共用同一个密码哈希以缩短准备时间"""
+    from werkzeug.security import generate_password_hash
+    password_hash = generate_password_hash(PASSWORD)
+    for index in range(count):
+        manager.create_user(f'bench_login_{index}', PASSWORD, password_hash=password_hash)
+
+
+def login_storm(login, users: int, threads: int, duration: float, wrong_ratio: float, busy_error,
+                backoff_ms: float = 0.0) -> dict:
+    """
+    在 duration 秒内用 threads 个线程持续调用 login(username, password)，
+    被拒绝的请求等待 backoff_ms 毫秒后再重试（模拟客户端遵守 Retry-After）
+
+    Returns:
+        dict: 成功、失败、被拒绝次数，吞吐量和延迟分位数
+    """
+    lock = threading.Lock()
+    latencies = []
+    counts = {'ok': 0, 'failed': 0, 'rejected': 0}
+    deadline = time.perf_counter() + duration
+
+    def worker(seed):
+        rng = random.Random(seed)
+        local_latencies = []
+        local_counts = {'ok': 0, 'failed': 0, 'rejected': 0}
+        while time.perf_counter() < deadline:
+            username = f'bench_login_{rng.randrange(users)}'
+            password = PASSWORD if rng.random() >= wrong_ratio else 'wrong_password'
+            started = time.perf_counter()
+            try:
+                outcome = 'ok' if login(username, password) else 'failed'
+            except busy_error:
+                outcome = 'rejected'
+            local_latencies.append((time.perf_counter() - started) * 1000)
+            local_counts[outcome] += 1
+            if outcome == 'rejected' and backoff_ms > 0:
+                time.sleep(backoff_ms / 1000.0)
+        with lock:
+            latencies.extend(local_latencies)
+            for key, value in local_counts.items():
+                counts[key] += value
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(seed,), daemon=True) for seed in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        **counts,
+        'logins_per_second': round(counts['ok'] / elapsed, 2) if elapsed else 0.0,
+        'requests_per_second': round(sum(counts.values()) / elapsed, 2) if elapsed else 0.0,
+        'latency': summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='登录吞吐量基准测试')
+    parser.add_argument('--users', type=int, default=200, help='压测用户数')
+    parser.add_argument('--threads', type=int, default=32, help='并发请求线程数')
+    parser.add_argument('--duration', type=float, default=10.0, help='每种方式的压测时长（秒）')
+    parser.add_argument('--wrong-ratio', type=float, default=0.05, help='输错密码的比例')
+    parser.add_argument('--workers', type=int, default=0, help='AuthService 哈希线程数，默认CPU核数')
+    parser.add_argument('--max-pending', type=int, default=32, help='AuthService 最大排队数')
+    parser.add_argument('--cache-ttl', type=float, default=30.0, help='AuthService 用户缓存秒数')
+    parser.add_argument('--backoff-ms', type=float, default=100.0, help='被拒绝后重试前的等待毫秒数')
+    parser.add_argument('--output', help='结果输出文件')
+    parser.add_argument('--compare', help='用于对比的基线结果文件')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='daip_login_bench_')
+    # database 模块导入时会在当前目录创建默认数据库，切换到临时目录避免污染仓库
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    from database import DatabaseManager
+    from auth_service import AuthService, AuthBusyError
+
+    manager = DatabaseManager(os.path.join(workdir, 'login_bench.db'))
+    print(f"创建 {args.users} 个压测用户 ...")
+    create_users(manager, args.users)
+
+    print(f"请求线程中直接计算哈希：{args.threads} 线程，{args.duration} 秒 ...")
+    inline = login_storm(manager.verify_user_password, args.users, args.threads,
+                         args.duration, args.wrong_ratio, AuthBusyError)
+
+    service = AuthService(manager, max_workers=args.workers or None,
+                          max_pending=args.max_pending, cache_ttl=args.cache_ttl)
+    print(f"AuthService：{service.max_workers} 个哈希线程，最大排队 {args.max_pending} ...")
+    try:
+        pooled = login_storm(service.verify, args.users, args.threads,
+                             args.duration, args.wrong_ratio, AuthBusyError, args.backoff_ms)
+        pooled['service'] = service.get_stats()
+    finally:
+        service.shutdown()
+
+    report = {
+        'benchmark': 'login_benchmark',
+        'generated_at': datetime.now().isoformat(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': {
+            'inline': inline,
+            'auth_service': pooled,
+        }
+    }
+    for name, result in report['results'].items():
+        latency = result['latency']
+        print(f"{name}: 成功 {result['ok']} 次（{result['logins_per_second']} 次/秒），失败 {result['failed']}，"
+              f"拒绝 {result['rejected']}，p50={latency['p50_ms']}ms p95={latency['p95_ms']}ms "
+              f"p99={latency['p99_ms']}ms")
+    save_report(report, 'login_benchmark', args.output)
+    if args.compare:
+        compare_reports(args.compare, report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI回答语义缓存基准测试
+先缓存一组问题的回答，再用它们的同义改写查询（应命中）和换了主题的相似问法查询（不应命中），
+统计不同相似度阈值下的命中率和误命中率，并核对含时间词的问题没有被缓存；再用随机问题把缓存填到不同规模，测量查询耗时
+
+用法:
+    python benchmarks/semantic_cache_benchmark.py
+    python benchmarks/semantic_cache_benchmark.py --thresholds 0.6,0.7,0.8,0.9 --sizes 100,1000,10000
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime
+
+from bench_utils import compare_reports, save_report, summarize
+
+from semantic_cache import SemanticCache
+
+# (已缓存的问题, 同义改写, 换了主题的问法)
+PARAPHRASES = [
+    ('川农有几个校区', '四川农业大学校区有哪些', '川农有几个食堂'),
+    ('川农有几个校区', '学校一共有几个校区啊', '川农有几个学院'),
+    ('川农是211吗', '川农是不是211', '川农是985吗'),
+    ('川农的学费多少', '请问川农的学费是多少', '川农的住宿费多少'),
+    ('宿舍有空调吗', '宿舍有没有空调', '教室有空调吗'),
+    ('图书馆几点开门', '请问图书馆几点开门呢', '食堂几点开门'),
+    ('川农的校训是什么', '四川农业大学校训是什么', '川农的校歌是什么'),
+    ('雅安校区在哪里', '雅安校区在哪', '温江校区在哪里'),
+    ('川农考研难吗', '川农考研难不难', '川农保研难吗'),
+    ('川农有哪些专业', '四川农业大学都有什么专业', '川农有哪些社团'),
+]
+# 答案随时间变化的问题，不应缓存
+TIME_SENSITIVE = ['今天雅安下雨吗', '明天食堂几点开门', '现在图书馆人多吗', '这周末有什么活动']
+FILLER_CHARS = '的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严'
+
+
+def accuracy(threshold: float) -> dict:
+    """统计同义改写的命中率和换主题问法的误命中率"""
+    cache = SemanticCache(threshold=threshold)
+    for question, _, _ in PARAPHRASES:
+        cache.put(question, f'回答：{question}')
+    hits = sum(1 for _, paraphrase, _ in PARAPHRASES if cache.get(paraphrase))
+    false_hits = sum(1 for _, _, other in PARAPHRASES if cache.get(other))
+    for question in TIME_SENSITIVE:
+        cache.put(question, f'回答：{question}')
+    time_hits = sum(1 for question in TIME_SENSITIVE if cache.get(question))
+    return {
+        'paraphrase_hit_rate': round(hits / len(PARAPHRASES), 4),
+        'false_hit_rate': round(false_hits / len(PARAPHRASES), 4),
+        'time_sensitive_hits': time_hits,
+    }
+
+
+def lookup_latency(size: int, queries: int, seed: int) -> dict:
+    """缓存 size 个随机问题后测量查询耗时"""
+    rng = random.Random(seed)
+    cache = SemanticCache(max_entries=size, max_bytes=1 << 40)
+    questions = [''.join(rng.choice(FILLER_CHARS) for _ in range(rng.randint(6, 16))) for _ in range(size)]
+    started = time.perf_counter()
+    for question in questions:
+        cache.put(question, '回答')
+    fill_seconds = time.perf_counter() - started
+    latencies = []
+    for index in range(queries):
+        # 一半查已缓存的问题，一半查新问题
+        question = questions[rng.randrange(size)] if index % 2 else ''.join(rng.sample(FILLER_CHARS, 10))
+        started = time.perf_counter()
+        cache.get(question)
+        latencies.append((time.perf_counter() - started) * 1000)
+    stats = cache.get_stats()
+    return {
+        'fill_seconds': round(fill_seconds, 3),
+        'bytes': stats['bytes'],
+        'hit_rate': stats['hit_rate'],
+        'lookup': summarize(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI回答语义缓存基准测试')
+    parser.add_argument('--thresholds', default='0.6,0.7,0.8,0.9', help='相似度阈值（逗号分隔）')
+    parser.add_argument('--sizes', default='100,1000,10000', help='缓存条目数（逗号分隔）')
+    parser.add_argument('--queries', type=int, default=500, help='每种规模的查询次数')
+    parser.add_argument('--seed', type=int, default=7, help='随机种子')
+    parser.add_argument('--output', help='结果输出文件')
+    parser.add_argument('--compare', help='用于对比的基线结果文件')
+    args = parser.parse_args()
+
+    results = {'accuracy': {}, 'latency': {}}
+    for threshold in [float(value) for value in args.thresholds.split(',') if value.strip()]:
+        result = accuracy(threshold)
+        results['accuracy'][f't{threshold}'] = result
+        print(f"阈值 {threshold}: 同义改写命中 {result['paraphrase_hit_rate']:.0%}，"
+              f"换主题误命中 {result['false_hit_rate']:.0%}，含时间词的问题命中 {result['time_sensitive_hits']} 个")
+    for size in [int(value) for value in args.sizes.split(',') if value.strip()]:
+        result = lookup_latency(size, args.queries, args.seed)
+        results['latency'][f'n{size}'] = result
+        lookup = result['lookup']
+        print(f"{size} 条（{result['bytes'] / 1024 / 1024:.1f}MB）：填充 {result['fill_seconds']}s，"
+              f"查询 p50={lookup['p50_ms']}ms p95={lookup['p95_ms']}ms，命中率 {result['hit_rate']:.0%}")
+
+    report = {
+        'benchmark': 'semantic_cache_benchmark',
+        'generated_at': datetime.now().isoformat(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results,
+    }
+    save_report(report, 'semantic_cache_benchmark', args.output)
+    if args.compare:
+        compare_reports(args.compare, report)
+
+
+if __name__ == '__main__':
+    main()
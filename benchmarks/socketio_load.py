@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Socket.IO压测工具
+在本地子进程中启动使用桩后端的 app.py，再连接N个模拟用户，按配置的速率和
+@命令比例发送消息，统计从发送到收到 new_message 的投递延迟和吞吐量
+
+用法:
+    python benchmarks/socketio_load.py run --clients 50 --rate 1 --duration 30
+    python benchmarks/socketio_load.py run --mix text=0.8,ai=0.1,weather=0.1 --compare benchmarks/results/base.json
+    python benchmarks/socketio_load.py run --url http://127.0.0.1:5000   # 压测已启动的服务
+"""
+
+import argparse
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from bench_utils import compare_reports, save_report, summarize
+from stub_backends import install_stub_backends
+
+# 消息中携带的标记：bench:<客户端编号>:<序号>:<发送时间>
+TOKEN_PATTERN = re.compile(r'bench:(\d+):(\d+):(\d+\.\d+)')
+DEFAULT_MIX = 'text=0.8,ai=0.05,weather=0.05,music=0.05,movie=0.05'
+# 各消息类型的模板，{token} 会被替换为压测标记
+MESSAGE_TEMPLATES = {
+    'text': '大家好 {token}',
+    'at': '@同学 {token}',
+    'ai': '@川小农 川农有几个校区 {token}',
+    'weather': '@天气 成都 {token}',
+    'music': '@音乐 吉他 {token}',
+    'movie': '@电影 https://example.com/{token}',
+}
+
+
+def parse_mix(text: str) -> dict:
+    """解析消息类型比例，例如 text=0.8,ai=0.2"""
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in MESSAGE_TEMPLATES:
+            raise ValueError(f"未知的消息类型: {name}，可选: {', '.join(MESSAGE_TEMPLATES)}")
+        mix[name] = float(weight)
+    return mix
+
+
+def serve(args):
+    """在当前进程中使用桩后端启动 app.py"""
+    install_stub_backends(ai_latency_ms=args.ai_latency_ms, upstream_latency_ms=args.upstream_latency_ms)
+    # 数据库文件创建在工作目录，避免污染仓库中的数据库
+    os.makedirs(args.workdir, exist_ok=True)
+    os.chdir(args.workdir)
+    import app as chat_app
+    print(f"压测服务已启动: http://127.0.0.1:{args.port}", flush=True)
+    chat_app.socketio.run(chat_app.app, host='127.0.0.1', port=args.port,
+                          debug=False, use_reloader=False, log_output=False,
+                          allow_unsafe_werkzeug=True)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"压测服务在 {timeout} 秒内未能启动")
+
+
+class SimulatedClient:
+    """一个模拟聊天用户"""
+
+    def __init__(self, index: int, url: str, room: str, results: 'LoadResults'):
+        import socketio
+        self.index = index
+        self.nickname = f'bench_user_{index}'
+        self.url = url
+        self.room = room
+        self.results = results
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('new_message', self._on_new_message)
+        self.joined = threading.Event()
+        self.sio.on('room_joined', lambda data: self.joined.set())
+
+    def connect(self):
+        self.sio.connect(self.url, transports=['websocket'])
+        self.sio.emit('join_room', {'nickname': self.nickname, 'room': self.room})
+        self.joined.wait(10)
+
+    def _on_new_message(self, data):
+        match = TOKEN_PATTERN.search(str(data.get('message', '')))
+        if not match:
+            return
+        sender = int(match.group(1))
+        # 只统计用户消息本身的投递，忽略川小农回复中引用的标记
+        if data.get('nickname') != f'bench_user_{sender}':
+            return
+        latency_ms = (time.time() - float(match.group(3))) * 1000
+        self.results.record_delivery(sender == self.index, (sender, int(match.group(2))), latency_ms)
+
+    def run(self, rate: float, duration: float, mix: dict, stop: threading.Event):
+        """按泊松到达速率发送消息"""
+        kinds = list(mix)
+        weights = [mix[kind] for kind in kinds]
+        deadline = time.time() + duration
+        sequence = 0
+        while not stop.is_set() and time.time() < deadline:
+            time.sleep(random.expovariate(rate))
+            kind = random.choices(kinds, weights)[0]
+            token = f'bench:{self.index}:{sequence}:{time.time():.6f}'
+            try:
+                self.sio.emit('send_message', {
+                    'nickname': self.nickname,
+                    'message': MESSAGE_TEMPLATES[kind].format(token=token)
+                })
+                self.results.record_send(kind, (self.index, sequence))
+            except Exception as e:
+                self.results.record_error(str(e))
+            sequence += 1
+
+    def close(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+
+class LoadResults:
+    """线程安全的压测结果收集器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = {}
+        self.sent_tokens = set()
+        self.echo_latencies = []
+        self.fanout_latencies = []
+        self.delivered_tokens = set()
+        self.errors = []
+
+    def record_send(self, kind: str, token):
+        with self._lock:
+            self.sent[kind] = self.sent.get(kind, 0) + 1
+            self.sent_tokens.add(token)
+
+    def record_delivery(self, is_echo: bool, token, latency_ms: float):
+        with self._lock:
+            if is_echo:
+                self.echo_latencies.append(latency_ms)
+                self.delivered_tokens.add(token)
+            else:
+                self.fanout_latencies.append(latency_ms)
+
+    def record_error(self, error: str):
+        with self._lock:
+            self.errors.append(error)
+
+
+def run(args):
+    """启动服务（除非指定 --url）并执行压测"""
+    mix = parse_mix(args.mix)
+    server = None
+    url = args.url
+    if not url:
+        port = args.port or _free_port()
+        workdir = args.workdir or tempfile.mkdtemp(prefix='daip_bench_')
+        server = subprocess.Popen([
+            sys.executable, os.path.abspath(__file__), 'serve',
+            '--port', str(port), '--workdir', workdir,
+            '--ai-latency-ms', str(args.ai_latency_ms),
+            '--upstream-latency-ms', str(args.upstream_latency_ms),
+        ])
+        _wait_for_port(port)
+        url = f'http://127.0.0.1:{port}'
+
+    results = LoadResults()
+    clients = []
+    stop = threading.Event()
+    try:
+        for index in range(args.clients):
+            client = SimulatedClient(index, url, args.room, results)
+            client.connect()
+            clients.append(client)
+        print(f"{len(clients)} 个模拟用户已加入房间 {args.room}，开始压测 {args.duration} 秒...")
+
+        started = time.time()
+        threads = [threading.Thread(target=client.run, args=(args.rate, args.duration, mix, stop), daemon=True)
+                   for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 等待在途消息投递完成
+        time.sleep(args.drain)
+        elapsed = time.time() - started
+    finally:
+        stop.set()
+        for client in clients:
+            client.close()
+        if server is not None:
+            server.terminate()
+            server.wait(10)
+
+    total_sent = sum(results.sent.values())
+    report = {
+        'benchmark': 'socketio_load',
+        'generated_at': datetime.now().isoformat(),
+        'config': {
+            'clients': args.clients,
+            'rate_per_client': args.rate,
+            'duration_seconds': args.duration,
+            'mix': mix,
+            'room': args.room,
+            'ai_latency_ms': args.ai_latency_ms,
+            'upstream_latency_ms': args.upstream_latency_ms,
+            'target': args.url or 'local',
+        },
+        'results': {
+            'sent': total_sent,
+            'sent_by_type': results.sent,
+            'delivered': len(results.delivered_tokens),
+            'lost': len(results.sent_tokens - results.delivered_tokens),
+            'errors': len(results.errors),
+            'sent_per_second': round(total_sent / elapsed, 2) if elapsed else 0.0,
+            'deliveries_per_second': round(
+                (len(results.echo_latencies) + len(results.fanout_latencies)) / elapsed, 2) if elapsed else 0.0,
+            'echo_latency': summarize(results.echo_latencies),
+            'fanout_latency': summarize(results.fanout_latencies),
+        }
+    }
+    print_report(report)
+    save_report(report, 'socketio_load', args.output)
+    if args.compare:
+        compare_reports(args.compare, report)
+    return report
+
+
+def print_report(report: dict):
+    results = report['results']
+    print(f"发送 {results['sent']} 条，送达 {results['delivered']} 条，丢失 {results['lost']} 条，错误 {results['errors']} 个")
+    print(f"发送速率 {results['sent_per_second']} 条/秒，投递速率 {results['deliveries_per_second']} 次/秒")
+    for name in ('echo_latency', 'fanout_latency'):
+        stats = results[name]
+        print(f"{name}: p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms max={stats['max_ms']}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Socket.IO聊天室压测工具')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='执行压测')
+    run_parser.add_argument('--clients', type=int, default=20, help='模拟用户数')
+    run_parser.add_argument('--rate', type=float, default=1.0, help='每个用户每秒发送的消息数')
+    run_parser.add_argument('--duration', type=float, default=30.0, help='压测时长（秒）')
+    run_parser.add_argument('--drain', type=float, default=3.0, help='压测结束后等待在途消息的时间（秒）')
+    run_parser.add_argument('--mix', default=DEFAULT_MIX, help='消息类型比例')
+    run_parser.add_argument('--room', default='chat_room', help='压测使用的聊天室')
+    run_parser.add_argument('--url', help='压测已启动的服务，不再启动本地桩服务')
+    run_parser.add_argument('--port', type=int, help='本地桩服务端口，默认随机')
+    run_parser.add_argument('--workdir', help='本地桩服务的工作目录（数据库位置），默认临时目录')
+    run_parser.add_argument('--ai-latency-ms', type=float, default=200.0, help='AI桩延迟')
+    run_parser.add_argument('--upstream-latency-ms', type=float, default=50.0, help='天气/音乐/视频桩延迟')
+    run_parser.add_argument('--output', help='结果输出文件')
+    run_parser.add_argument('--compare', help='用于对比的基线结果文件')
+
+    serve_parser = subparsers.add_parser('serve', help='只启动使用桩后端的服务')
+    serve_parser.add_argument('--port', type=int, default=5055)
+    serve_parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'daip_bench'))
+    serve_parser.add_argument('--ai-latency-ms', type=float, default=200.0)
+    serve_parser.add_argument('--upstream-latency-ms', type=float, default=50.0)
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试用的桩后端
+在导入 app 之前调用 install_stub_backends()，用固定延迟的本地实现替换
+川小农知识库、AI大模型、天气、音乐、新闻和腾讯视频爬虫，避免压测时访问外网
+"""
+
+import os
+import random
+import sys
+import time
+import types
+
+# 仓库根目录，供 benchmarks 下的脚本导入 app、database 等模块
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def _sleep_ms(latency_ms: float):
+    if latency_ms > 0:
+        time.sleep(latency_ms / 1000.0)
+
+
+class StubSCAUAssistant:
+    """川小农知识库桩"""
+
+    latency_ms = 1.0
+
+    def generate_response(self, question):
+        _sleep_ms(self.latency_ms)
+        return f"（知识库）关于“{question}”：四川农业大学有雅安、成都、都江堰三个校区。", 'stub'
+
+
+class StubMusicWeatherAPI:
+    """音乐天气API桩"""
+
+    latency_ms = 50.0
+
+    def _music(self, name='吉他独奏'):
+        return {
+            'name': name,
+            'singer': '川农乐队',
+            'url': '/static/audio/guitar-solo.wav',
+        }
+
+    def search_music(self, music_name):
+        _sleep_ms(self.latency_ms)
+        return self._music(music_name)
+
+    def get_random_music(self):
+        _sleep_ms(self.latency_ms)
+        return self._music(random.choice(['吉他独奏', '爵士钢琴', '小提琴协奏曲']))
+
+    def get_weather_info(self, city):
+        _sleep_ms(self.latency_ms)
+        return {
+            'city': city,
+            'icon': '☀️',
+            'condition': '晴',
+            'temperature': '25°C',
+            'wind': '东风2级',
+            'humidity': 60,
+            'update_time': time.strftime('%H:%M'),
+        }
+
+    def get_current_location_weather(self):
+        return self.get_weather_info('成都')
+
+
+class StubVideoCrawler:
+    """腾讯视频爬虫桩"""
+
+    latency_ms = 50.0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_random_free_video(self):
+        _sleep_ms(self.latency_ms)
+        return {'title': '三体', 'video_id': 'mzc00200l1yvsv8', 'duration': '50分钟/集',
+                'description': '桩数据', 'url': 'https://v.qq.com/x/cover/mzc00200l1yvsv8.html'}
+
+    def get_iframe_url(self, video_id):
+        return f'https://v.qq.com/txp/iframe/player.html?vid={video_id}'
+
+
+class _StubCompletions:
+    latency_ms = 200.0
+
+    def create(self, model=None, messages=None, stream=False, **kwargs):
+        question = messages[-1]['content'] if messages else ''
+        answer = f"（AI）关于“{question}”的回答：这是压测用的桩回复，内容足够长以通过长度检查。"
+        if stream:
+            return self._stream(answer)
+        _sleep_ms(self.latency_ms)
+        message = types.SimpleNamespace(content=answer)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+    def _stream(self, answer):
+        _sleep_ms(self.latency_ms)
+        for index in range(0, len(answer), 8):
+            delta = types.SimpleNamespace(content=answer[index:index + 8])
+            yield types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
+
+
+class StubOpenAIClient:
+    """OpenAI兼容客户端桩"""
+
+    def __init__(self, *args, **kwargs):
+        self.chat = types.SimpleNamespace(completions=_StubCompletions())
+
+
+def install_stub_backends(ai_latency_ms: float = 200.0, upstream_latency_ms: float = 50.0):
+    """
+    把桩模块注册到 sys.modules，必须在导入 app 之前调用
+
+    Args:
+        ai_latency_ms: AI大模型桩的响应延迟（毫秒）
+        upstream_latency_ms: 天气、音乐、视频桩的响应延迟（毫秒）
+    """
+    _StubCompletions.latency_ms = ai_latency_ms
+    StubMusicWeatherAPI.latency_ms = upstream_latency_ms
+    StubVideoCrawler.latency_ms = upstream_latency_ms
+
+    scau_assistant = types.ModuleType('scau_assistant')
+    scau_assistant.SCAUAssistant = StubSCAUAssistant
+    sys.modules['scau_assistant'] = scau_assistant
+
+    music_weather_api = types.ModuleType('music_weather_api')
+    music_weather_api.MusicWeatherAPI = StubMusicWeatherAPI
+    sys.modules['music_weather_api'] = music_weather_api
+
+    news_api = types.ModuleType('news_api')
+    news_api.get_recent_cctv_news = lambda days=3: [{'title': '桩新闻', 'date': time.strftime('%Y-%m-%d')}]
+    news_api.get_news_list = lambda category='全部', limit=10: []
+    news_api.get_categories = lambda: ['全部']
+    news_api.get_trending_news = lambda limit=5: []
+    news_api.get_news_detail = lambda news_id: None
+    sys.modules['news_api'] = news_api
+
+    crawler = types.ModuleType('tencent_video_crawler')
+    crawler.TencentVideoCrawler = StubVideoCrawler
+    sys.modules['tencent_video_crawler'] = crawler
+
+    try:
+        import openai
+    except ImportError:
+        # AI已被替换为桩，压测环境不需要安装openai
+        openai = types.ModuleType('openai')
+        sys.modules['openai'] = openai
+    openai.OpenAI = StubOpenAIClient
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@命令路由模块
+负责解析聊天消息中的@命令，并把每个命令分派到各自独立的线程池中执行，
+为每个命令提供并发限制、超时、降级回复以及耗时/错误统计
+"""
+
+import heapq
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class CommandContext:
+    """一次@命令调用的上下文"""
+
+    def __init__(self, nickname: str, message: str, args: str, room: str,
+                 session_id: str = None, client_ip: str = None,
+                 emitter: Callable = None, saver: Callable = None):
+        """
+        初始化命令上下文
+
+        Args:
+            nickname: 发送者昵称
+            message: 原始消息
+            args: 命令后面的参数文本
+            room: 消息所在聊天室
+            session_id: 会话ID
+            client_ip: 客户端IP
+            emitter: 广播函数 emitter(event, data, room)
+            saver: 消息保存函数，参数同 DatabaseManager.save_message
+        """
+        self.nickname = nickname
+        self.message = message
+        self.args = args
+        self.room = room
+        self.session_id = session_id
+        self.client_ip = client_ip
+        self.cancelled = False
+        self._emitter = emitter
+        self._saver = saver
+
+    def detached(self) -> 'CommandContext':
+        """复制一个未取消的上下文，供超时后的降级回复使用"""
+        return CommandContext(self.nickname, self.message, self.args, self.room,
+                              self.session_id, self.client_ip, self._emitter, self._saver)
+
+    def emit(self, event: str, data: Dict):
+        """向命令所在房间广播事件，命令超时后不再发送"""
+        if self.cancelled or self._emitter is None:
+            return
+        self._emitter(event, data, self.room)
+
+    def save(self, **kwargs) -> Optional[int]:
+        """保存消息到数据库，自动补全会话ID、IP和房间，命令超时后不再保存"""
+        if self.cancelled or self._saver is None:
+            return None
+        kwargs.setdefault('session_id', self.session_id)
+        kwargs.setdefault('user_ip', self.client_ip)
+        kwargs.setdefault('room', self.room)
+        return self._saver(**kwargs)
+
+
+class Command:
+    """已注册的@命令及其执行器和统计信息"""
+
+    def __init__(self, name: str, prefix: str, handler: Callable,
+                 max_workers: int = 2, max_pending: int = 20, timeout: float = 15.0,
+                 fallback: Callable = None):
+        """
+        初始化命令
+
+        Args:
+            name: 命令名称（用于统计）
+            prefix: 命令前缀，如 '@天气'
+            handler: 处理函数 handler(ctx)
+            max_workers: 同时执行的最大数量
+            max_pending: 执行中加排队的最大数量，超出后直接降级
+            timeout: 超时时间（秒），从提交时开始计算。超时后立即释放排队名额，
+                     处理函数若仍卡在上游调用中会继续占用一个工作线程，直到上游调用自身超时返回
+            fallback: 降级函数 fallback(ctx, reason)，reason 为 'timeout'、'busy' 或 'error'
+        """
+        self.name = name
+        self.prefix = prefix
+        self.handler = handler
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.fallback = fallback
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix=f'cmd-{name}')
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.latencies = deque(maxlen=512)
+
+    def record(self, elapsed_ms: float, error: bool):
+        """记录一次执行结果"""
+        with self._lock:
+            self.calls += 1
+            self.total_ms += elapsed_ms
+            if elapsed_ms > self.max_ms:
+                self.max_ms = elapsed_ms
+            self.latencies.append(elapsed_ms)
+            if error:
+                self.errors += 1
+
+    def get_stats(self) -> Dict:
+        """获取命令统计信息"""
+        with self._lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                'name': self.name,
+                'prefix': self.prefix,
+                'calls': self.calls,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'pending': self.pending,
+                'max_workers': self.max_workers,
+                'timeout_seconds': self.timeout,
+                'avg_ms': round(self.total_ms / self.calls, 2) if self.calls else 0.0,
+                'max_ms': round(self.max_ms, 2),
+            }
+        for label, q in (('p50_ms', 0.5), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+            stats[label] = round(latencies[min(len(latencies) - 1, int(len(latencies) * q))], 2) if latencies else 0.0
+        return stats
+
+
+class _Watchdog:
+    """单线程超时监视器，到期后对未完成的命令触发降级"""
+
+    def __init__(self):
+        self._heap = []
+        self._cond = threading.Condition()
+        self._counter = 0
+        self._thread = threading.Thread(target=self._run, name='cmd-watchdog', daemon=True)
+        self._thread.start()
+
+    def watch(self, deadline: float, callback: Callable) -> List[bool]:
+        """登记一个截止时间，返回可置为True以取消监视的标记"""
+        token = [False]
+        with self._cond:
+            self._counter += 1
+            heapq.heappush(self._heap, (deadline, self._counter, token, callback))
+            self._cond.notify()
+        return token
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                deadline, _, token, callback = self._heap[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+            if not token[0]:
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"命令超时处理出错: {str(e)}")
+
+
+class CommandRouter:
+    """@命令注册表和分派器"""
+
+    def __init__(self):
+        self.commands: Dict[str, Command] = {}
+        self._by_prefix: Dict[str, Command] = {}
+        self._pattern = None
+        self._priority: Dict[str, int] = {}
+        self._watchdog = _Watchdog()
+
+    def register(self, name: str, prefix: str, handler: Callable, **options) -> Command:
+        """
+        注册一个@命令
+
+        Args:
+            name: 命令名称
+            prefix: 命令前缀
+            handler: 处理函数 handler(ctx)
+            **options: 传给 Command 的执行选项（max_workers、max_pending、timeout、fallback）
+
+        Returns:
+            Command: 注册的命令
+        """
+        command = Command(name, prefix, handler, **options)
+        self.commands[name] = command
+        self._by_prefix[prefix] = command
+        # 所有命令前缀编译成一个正则，解析时只扫描一次消息
+        prefixes = sorted(self._by_prefix, key=len, reverse=True)
+        self._pattern = re.compile('|'.join(re.escape(p) for p in prefixes))
+        # 注册顺序即优先级，消息里同时出现多个命令时先注册的优先
+        self._priority = {p: index for index, p in enumerate(self._by_prefix)}
+        return command
+
+    def command(self, name: str, prefix: str, **options) -> Callable:
+        """注册命令的装饰器形式"""
+        def decorator(handler):
+            self.register(name, prefix, handler, **options)
+            return handler
+        return decorator
+
+    def parse(self, message: str) -> Tuple[Optional[Command], str]:
+        """
+        解析消息中的@命令
+
+        Args:
+            message: 消息内容
+
+        Returns:
+            Tuple[Optional[Command], str]: 匹配到的命令（没有则为None）和命令参数
+        """
+        if self._pattern is None or not message.startswith('@'):
+            return None, ''
+        best = None
+        for match in self._pattern.finditer(message):
+            if best is None or self._priority[match.group(0)] < self._priority[best.group(0)]:
+                best = match
+        if best is None:
+            return None, ''
+        return self._by_prefix[best.group(0)], message[best.end():].strip()
+
+    def dispatch(self, command: Command, ctx: CommandContext) -> bool:
+        """
+        把命令提交到它自己的线程池执行，立即返回
+
+        Args:
+            command: 要执行的命令
+            ctx: 命令上下文
+
+        Returns:
+            bool: 已提交返回True，因排队过多被拒绝返回False
+        """
+        with command._lock:
+            if command.pending >= command.max_pending:
+                command.rejected += 1
+                rejected = True
+            else:
+                command.pending += 1
+                rejected = False
+        if rejected:
+            self._fallback(command, ctx, 'busy')
+            return False
+
+        def on_timeout():
+            if not self._finish(command, token):
+                return
+            ctx.cancelled = True
+            with command._lock:
+                command.timeouts += 1
+            print(f"命令 {command.name} 执行超时（{command.timeout}秒）")
+            self._fallback(command, ctx.detached(), 'timeout')
+
+        token = self._watchdog.watch(time.monotonic() + command.timeout, on_timeout)
+        command.executor.submit(self._run, command, ctx, token)
+        return True
+
+    def _finish(self, command: Command, token: List[bool]) -> bool:
+        """
+        结束一次调用并释放排队名额，处理函数返回和超时两者只有先到的一方成功
+
+        Returns:
+            bool: 本次调用此前未结束返回True
+        """
+        with command._lock:
+            if token[0]:
+                return False
+            token[0] = True
+            command.pending -= 1
+            return True
+
+    def _run(self, command: Command, ctx: CommandContext, token: List[bool]):
+        """在命令线程池中执行处理函数并记录统计"""
+        if ctx.cancelled:
+            # 排队期间已经超时并发送了降级回复，不再调用上游
+            return
+        start = time.perf_counter()
+        error = None
+        try:
+            command.handler(ctx)
+        except Exception as e:
+            error = e
+        # 处理函数一返回就结束本次调用，避免已回复后看门狗再发送超时降级
+        finished = self._finish(command, token)
+        if error is not None:
+            print(f"命令 {command.name} 执行出错: {str(error)}")
+            if finished:
+                self._fallback(command, ctx, 'error')
+        command.record((time.perf_counter() - start) * 1000, error is not None)
+
+    def _fallback(self, command: Command, ctx: CommandContext, reason: str):
+        """执行命令的降级回复"""
+        if command.fallback is None:
+            return
+        try:
+            command.fallback(ctx, reason)
+        except Exception as e:
+            print(f"命令 {command.name} 降级处理出错: {str(e)}")
+
+    def get_stats(self) -> List[Dict]:
+        """获取所有命令的统计信息"""
+        return [command.get_stats() for command in self.commands.values()]
+
+    def shutdown(self, wait: bool = False):
+        """关闭所有命令线程池"""
+        for command in self.commands.values():
+            command.executor.shutdown(wait=wait)
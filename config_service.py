@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+配置服务模块
+config.json 只在启动和文件变化时解析一次，按模式校验并补齐默认值，其他模块直接读取内存中的配置。
+后台线程监视配置文件（安装了 inotify_simple 时使用 inotify，否则定时比较修改时间），
+文件变化时自动重新加载并通知订阅了相应配置段的模块。新文件校验失败时保留旧配置
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+
+class ConfigError(ValueError):
+    """配置文件格式或取值错误"""
+
+
+class Setting:
+    """配置项：类型、默认值、取值范围和可覆盖它的环境变量"""
+
+    def __init__(self, kind: type, default, env: str = None, minimum: float = None,
+                 maximum: float = None, secret: bool = False, item_keys: tuple = ()):
+        """
+        Args:
+            kind: 类型（str、int、float、bool、list）
+            default: 默认值
+            env: 设置后优先于配置文件的环境变量名
+            minimum: 数值下限
+            maximum: 数值上限
+            secret: 是否为密钥，管理接口中只显示是否已设置
+            item_keys: 列表项（字典）必须包含的字段
+        """
+        self.kind = kind
+        self.default = default
+        self.env = env
+        self.minimum = minimum
+        self.maximum = maximum
+        self.secret = secret
+        self.item_keys = item_keys
+
+    def coerce(self, value, name: str):
+        """把配置文件或环境变量中的值转换为配置项的类型并检查范围"""
+        if self.kind is bool and isinstance(value, str):
+            value = value.strip().lower() in ('1', 'true', 'yes', 'on')
+        elif self.kind in (int, float) and not isinstance(value, bool):
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                raise ConfigError(f"{name} 应为数字: {value!r}")
+            if self.kind is int and not number.is_integer():
+                raise ConfigError(f"{name} 应为整数: {value!r}")
+            value = self.kind(number)
+        if not isinstance(value, self.kind) or (self.kind is int and isinstance(value, bool)):
+            raise ConfigError(f"{name} 应为 {self.kind.__name__}: {value!r}")
+        if self.minimum is not None and value < self.minimum:
+            raise ConfigError(f"{name} 不能小于 {self.minimum}: {value!r}")
+        if self.maximum is not None and value > self.maximum:
+            raise ConfigError(f"{name} 不能大于 {self.maximum}: {value!r}")
+        for index, item in enumerate(value if self.kind is list else []):
+            if self.item_keys and (not isinstance(item, dict)
+                                   or any(not isinstance(item.get(key), str) for key in self.item_keys)):
+                raise ConfigError(f"{name}[{index}] 应包含字符串字段 {', '.join(self.item_keys)}")
+        return value
+
+
+# config.json 的模式：配置段 -> 配置项，或顶层配置项。环境变量优先于配置文件，配置文件优先于默认值
+DEFAULT_SCHEMA = {
+    # 登录页可选的服务器列表
+    'servers': Setting(list, [], item_keys=('name', 'address')),
+    # AI大模型接口和生成参数
+    'ai': {
+        'api_key': Setting(str, '', env='DAIP_AI_API_KEY', secret=True),
+        'model_name': Setting(str, 'Qwen/Qwen2.5-7B-Instruct', env='DAIP_AI_MODEL'),
+        'api_url': Setting(str, 'https://api.siliconflow.cn/v1/'),
+        'base_url': Setting(str, 'https://api.siliconflow.cn/v1/', env='DAIP_AI_BASE_URL'),
+        'max_tokens': Setting(int, 1000, minimum=1),
+        # 带知识库资料请求时的回答长度上限
+        'grounded_max_tokens': Setting(int, 500, minimum=1),
+        'temperature': Setting(float, 0.7, minimum=0, maximum=2),
+        'top_p': Setting(float, 0.9, minimum=0, maximum=1),
+        # 单次请求超时（秒）和重试次数，总耗时应小于@川小农命令的30秒超时，卡住的请求不会长期占用命令线程
+        'timeout': Setting(float, 25.0, env='DAIP_AI_TIMEOUT', minimum=1),
+        'max_retries': Setting(int, 0, minimum=0),
+    },
+    # 知识库BM25检索
+    'knowledge': {
+        'threshold': Setting(float, 0.3, env='DAIP_KNOWLEDGE_THRESHOLD', minimum=0),
+    },
+    # 管理接口（/api/admin/*）的访问令牌，未设置时管理接口一律拒绝访问
+    'admin': {
+        'token': Setting(str, '', env='DAIP_ADMIN_TOKEN', secret=True),
+    },
+    # AI回答语义缓存
+    'semantic_cache': {
+        'threshold': Setting(float, 0.8, env='DAIP_SEMANTIC_CACHE_THRESHOLD', minimum=0, maximum=1),
+        'max_mb': Setting(float, 16.0, env='DAIP_SEMANTIC_CACHE_MB', minimum=0),
+        'ttl': Setting(float, 86400.0, env='DAIP_SEMANTIC_CACHE_TTL', minimum=0),
+    },
+}
+
+
+def validate(raw: Dict, schema: Dict = DEFAULT_SCHEMA) -> Dict:
+    """
+    按模式校验配置并补齐默认值，模式中没有的键原样保留
+
+    Raises:
+        ConfigError: 类型或取值不符合模式
+    """
+    if not isinstance(raw, dict):
+        raise ConfigError("配置文件顶层应为对象")
+    config = dict(raw)
+    for key, spec in schema.items():
+        if isinstance(spec, dict):
+            section = raw.get(key, {})
+            if not isinstance(section, dict):
+                raise ConfigError(f"{key} 应为对象")
+            config[key] = validate(section, spec)
+            continue
+        value = raw.get(key, spec.default)
+        if spec.env and os.environ.get(spec.env) is not None:
+            value = os.environ[spec.env]
+        config[key] = spec.coerce(value, key)
+    return config
+
+
+def redact(config: Dict, schema: Dict = DEFAULT_SCHEMA) -> Dict:
+    """把密钥类配置项替换为是否已设置，用于管理接口"""
+    result = dict(config)
+    for key, spec in schema.items():
+        if isinstance(spec, dict) and isinstance(result.get(key), dict):
+            result[key] = redact(result[key], spec)
+        elif isinstance(spec, Setting) and spec.secret and key in result:
+            result[key] = '***' if result[key] else ''
+    return result
+
+
+class ConfigService:
+    """可热加载的配置服务"""
+
+    def __init__(self, path: str, schema: Dict = DEFAULT_SCHEMA, check_interval: float = 2.0):
+        """
+        初始化配置服务并加载配置
+
+        Args:
+            path: 配置文件路径
+            schema: 配置模式
+            check_interval: 没有 inotify 时检查文件修改时间的间隔（秒）
+        """
+        self.path = os.path.abspath(path)
+        self.schema = schema
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._config: Dict = {}
+        self._fingerprint = None
+        self._last_check = 0.0
+        # (配置段或None, 回调)，配置段为None的回调在任何配置变化时都会被调用
+        self._subscribers: List[tuple] = []
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.watcher = None
+        self.stats = {'reloads': 0, 'errors': 0, 'loaded_at': None, 'last_error': None}
+        if not self.reload(force=True):
+            # 启动时配置文件有误，先用默认值（和环境变量）运行，修正文件后会自动加载
+            self._config = validate({}, schema)
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        配置文件变化时重新加载
+
+        Args:
+            force: 文件未变化时也重新加载
+
+        Returns:
+            bool: 是否加载了新配置
+        """
+        fingerprint = self._stat()
+        self._last_check = time.monotonic()
+        if not force and fingerprint == self._fingerprint:
+            return False
+        try:
+            raw = {}
+            if fingerprint is not None:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+            config = validate(raw, self.schema)
+        except (OSError, ValueError) as e:
+            # 文件写到一半、JSON格式错误或校验失败时保留旧配置
+            with self._lock:
+                self._fingerprint = fingerprint
+                self.stats['errors'] += 1
+                self.stats['last_error'] = str(e)
+            print(f"加载配置文件失败，继续使用原配置: {str(e)}")
+            return False
+
+        with self._lock:
+            previous = self._config
+            self._config = config
+            self._fingerprint = fingerprint
+            self.stats['reloads'] += 1
+            self.stats['loaded_at'] = time.time()
+            self.stats['last_error'] = None
+            subscribers = list(self._subscribers)
+        if previous:
+            self._notify(subscribers, previous, config)
+        return True
+
+    def _notify(self, subscribers, previous: Dict, config: Dict):
+        for section, callback in subscribers:
+            if section is None:
+                if previous == config:
+                    continue
+                value = config
+            else:
+                if previous.get(section) == config.get(section):
+                    continue
+                value = config.get(section)
+            try:
+                callback(value)
+            except Exception as e:
+                print(f"配置变更回调出错 {section or '*'}: {str(e)}")
+
+    def get(self, section: str = None, default=None):
+        """
+        获取当前配置（不要修改返回的字典）
+
+        Args:
+            section: 配置段名称，为None时返回整个配置
+            default: 配置段不存在时的返回值
+        """
+        if self._thread is None and time.monotonic() - self._last_check >= self.check_interval:
+            # 没有启动后台监视时在读取时检查
+            self.reload()
+        config = self._config
+        return config if section is None else config.get(section, default)
+
+    def subscribe(self, callback: Callable, section: str = None):
+        """
+        订阅配置变化
+
+        Args:
+            callback: 回调函数，参数为变化后的配置段（section为None时为整个配置）
+            section: 只在该配置段变化时回调
+        """
+        with self._lock:
+            self._subscribers.append((section, callback))
+
+    def _watch_inotify(self):
+        # 监视所在目录而不是文件本身，编辑器保存时常用“写临时文件再改名”的方式替换文件
+        notifier = INotify()
+        try:
+            notifier.add_watch(os.path.dirname(self.path),
+                               inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO
+                               | inotify_flags.CREATE | inotify_flags.DELETE)
+            filename = os.path.basename(self.path)
+            while not self._stop_event.is_set():
+                events = notifier.read(timeout=1000)
+                if any(event.name == filename for event in events):
+                    self.reload()
+        finally:
+            notifier.close()
+
+    def _watch_poll(self):
+        while not self._stop_event.wait(self.check_interval):
+            self.reload()
+
+    def _run(self):
+        if INotify is not None:
+            try:
+                self.watcher = 'inotify'
+                self._watch_inotify()
+                return
+            except OSError as e:
+                print(f"inotify不可用，改为定时检查配置文件: {str(e)}")
+        self.watcher = 'poll'
+        self._watch_poll()
+
+    def start(self):
+        """启动后台监视线程"""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='config-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台监视线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def get_stats(self) -> Dict:
+        """获取加载次数、错误和监视方式"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['path'] = self.path
+        stats['watcher'] = self.watcher
+        stats['subscribers'] = len(self._subscribers)
+        return stats
+
+    def snapshot(self) -> Dict:
+        """当前配置（密钥已隐藏），用于管理接口"""
+        return redact(self._config, self.schema)
@@ -8,9 +8,106 @@ SQLite数据库管理模块
 import sqlite3
 import json
 import os
+import re
+import string
+import csv
+import shutil
+import gzip
+import io
+import threading
+import time
+import zlib
 from datetime import datetime
-from typing import Optional, Dict, List, Tuple
+from typing import Optional, Dict, List, Tuple, Iterator
 from werkzeug.security import generate_password_hash, check_password_hash
+from query_profiler import QueryProfiler, ProfiledConnection
+from message_partitions import MessagePartitions, month_bounds
+from payload_codec import compress_text, decompress_text
+
+# 默认聊天室名称
+DEFAULT_ROOM = 'chat_room'
+# 消息汇总粒度：(名称, 秒数)，按从细到粗排列
+ROLLUP_GRANULARITIES = (('minute', 60), ('hour', 3600), ('day', 86400))
+# 时间范围换算成ID范围时容许的写入时间与ID顺序的最大偏差（毫秒）：并发写入时
+# created_ms 在插入前生成，ID较大的消息可能带有稍早的时间
+ID_ORDER_SLACK_MS = 60000
+# 时间范围下界/上界对应的ID：先在 created_ms 索引上定位边界处的第一条消息，
+# 再只在它之后/之前 ID_ORDER_SLACK_MS 内取最小/最大ID，读取的条目数与历史总量无关
+TIME_LOWER_ID_SQL = '''
+    SELECT MIN(id) FROM messages
+    WHERE created_ms >= ? AND created_ms <= (
+        SELECT created_ms FROM messages WHERE created_ms >= ? ORDER BY created_ms LIMIT 1
+    ) + ?
+'''
+TIME_UPPER_ID_SQL = '''
+    SELECT MAX(id) FROM messages
+    WHERE created_ms <= ? AND created_ms >= (
+        SELECT created_ms FROM messages WHERE created_ms <= ? ORDER BY created_ms DESC LIMIT 1
+    ) - ?
+'''
+# 时间序列最多返回的点数，超过时拒绝查询（没有消息的点也要补齐，点数决定内存和响应大小）
+MAX_TIMESERIES_POINTS = 5000
+# 导出的消息字段
+EXPORT_COLUMNS = ('id', 'session_id', 'nickname', 'message', 'message_type',
+                  'is_ai_response', 'is_at_message', 'is_movie', 'movie_url',
+                  'movie_info', 'is_music', 'music_data', 'is_weather',
+                  'weather_data', 'timestamp', 'user_ip', 'room')
+EXPORT_FORMATS = ('json', 'jsonl', 'csv')
+# 可移出主表单独压缩保存的大字段
+PAYLOAD_FIELDS = ('message', 'movie_info', 'music_data', 'weather_data')
+# 大字段移出后主表中保留的预览字符数
+PREVIEW_CHARS = 200
+# ASCII大写字母转小写（与SQLite的LIKE一致，不改变其他字符）
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+# 超过该字节数的字段才移出主表
+DEFAULT_PAYLOAD_THRESHOLD = 1024
+# 旧分区缺少的列及其默认值
+PARTITION_COLUMN_DEFAULTS = {
+    'has_payload': '0',
+    'created_ms': "CAST(strftime('%s', timestamp) AS INTEGER) * 1000",
+}
+# 支持的时间字符串格式（UTC，与 CURRENT_TIMESTAMP 一致）
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+# 备份文件名：backup_YYYYmmdd_HHMMSS.db[.gz]
+BACKUP_FILE_PATTERN = re.compile(r'^backup_\d{8}_\d{6}\.db(\.gz)?$')
+# 移动消息到分区期间在事务内写入的标记，计数器删除触发器据此跳过减计数
+PARTITION_MOVE_FLAG = 'partition_move_in_progress'
+# 增量完整性检查累计的问题计数，保存在 watermarks 表中（名称前缀 integrity_）
+INTEGRITY_COUNTERS = ('orphan_messages', 'long_messages', 'duplicate_sessions')
+# 消息内容的完整字符数（表别名 m），大字段已移出主表的消息按 message_payloads 中记录的原文长度计算
+MESSAGE_LENGTH_SQL = '''CASE WHEN m.has_payload = 1 THEN COALESCE((
+    SELECT p.length FROM main.message_payloads p WHERE p.message_id = m.id AND p.field = 'message'
+), LENGTH(m.message)) ELSE LENGTH(m.message) END'''
+
+class _BackupRestartLimit(Exception):
+    """分页备份重启次数过多"""
+
+
+class _TrackedConnectionMixin:
+    """关闭时通知 DatabaseManager 的连接，恢复数据库前据此等待所有连接关闭"""
+    
+    _manager = None
+    
+    def close(self):
+        manager, self._manager = self._manager, None
+        super().close()
+        if manager is not None:
+            manager._release_connection()
+    
+    def __del__(self):
+        # 未显式关闭的连接被回收时同样释放计数
+        if self._manager is not None:
+            manager, self._manager = self._manager, None
+            manager._release_connection()
+
+
+class TrackedConnection(_TrackedConnectionMixin, sqlite3.Connection):
+    """可跟踪的普通连接"""
+
+
+class TrackedProfiledConnection(_TrackedConnectionMixin, ProfiledConnection):
+    """可跟踪的性能分析连接"""
+
 
 class DatabaseManager:
     """SQLite数据库管理器"""
@@ -23,6 +120,30 @@ class DatabaseManager:
             db_path: 数据库文件路径
         """
         self.db_path = db_path
+        # 查询性能分析器，默认关闭，通过 enable_query_profiling 开启
+        self.query_profiler = None
+        # 统计计数器表是否开启，由 init_database 根据触发器是否存在设置
+        self.stat_counters_enabled = False
+        # 最近一次保留期清理的进度
+        self.retention_status = {'running': False}
+        self._retention_lock = threading.Lock()
+        # 按月分区存储，调用 enable_partitioning 后开启
+        self.partitions = None
+        # 打开中的连接数，恢复数据库时先阻止新连接并等待其归零
+        self._connection_gate = threading.Condition()
+        self._active_connections = 0
+        self._restoring = False
+        # 最近一次备份的进度
+        self.backup_status = {'running': False}
+        self._backup_lock = threading.Lock()
+        # 最近一次完整性检查的结果（缓存）
+        self.integrity_status = None
+        self._integrity_lock = threading.Lock()
+        # 大字段单独压缩存储，调用 enable_compact_payloads 后对新消息生效
+        self.compact_payloads = False
+        self.payload_threshold = DEFAULT_PAYLOAD_THRESHOLD
+        # 所有消息的 created_ms 是否都已回填，回填完成前时间过滤仍使用 timestamp 文本
+        self.epoch_ms_ready = False
         self.init_database()
     
     def get_connection(self) -> sqlite3.Connection:
@@ -32,17 +153,81 @@ class DatabaseManager:
         Returns:
             sqlite3.Connection: 数据库连接对象
         """
-        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self._connection_gate:
+            # 正在恢复数据库时等待恢复完成
+            while self._restoring:
+                self._connection_gate.wait()
+            self._active_connections += 1
+        try:
+            profiler = self.query_profiler
+            if profiler is not None:
+                conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=TrackedProfiledConnection)
+                conn.profiler = profiler
+            else:
+                conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=TrackedConnection)
+        except Exception:
+            self._release_connection()
+            raise
+        conn._manager = self
         conn.row_factory = sqlite3.Row  # 允许通过列名访问结果
         return conn
+    
+    def _release_connection(self):
+        """连接关闭时减少打开中的连接数"""
+        with self._connection_gate:
+            self._active_connections -= 1
+            if self._active_connections <= 0:
+                self._connection_gate.notify_all()
+    
+    def enable_query_profiling(self, slow_threshold_ms: float = 100.0, capture_plans: bool = True) -> QueryProfiler:
+        """
+        开启查询性能分析：对每条语句计时，记录慢查询，首次出现的查询形状抓取执行计划
+        
+        Args:
+            slow_threshold_ms: 慢查询阈值（毫秒）
+            capture_plans: 是否抓取 EXPLAIN QUERY PLAN
+            
+        Returns:
+            QueryProfiler: 查询分析器
+        """
+        self.query_profiler = QueryProfiler(slow_threshold_ms=slow_threshold_ms, capture_plans=capture_plans)
+        print(f"查询性能分析已开启，慢查询阈值: {slow_threshold_ms}ms")
+        return self.query_profiler
+    
+    def disable_query_profiling(self):
+        """关闭查询性能分析"""
+        self.query_profiler = None
+    
+    def get_slow_queries(self, top_n: int = 10, order_by: str = 'total_ms') -> Dict:
+        """
+        获取最慢的查询形状
+        
+        Args:
+            top_n: 返回数量
+            order_by: 排序字段（total_ms、max_ms、avg_ms、count）
+            
+        Returns:
+            Dict: 分析器状态和查询形状统计
+        """
+        profiler = self.query_profiler
+        if profiler is None:
+            return {'enabled': False, 'queries': [], 'full_scans': []}
+        return {
+            'enabled': True,
+            'slow_threshold_ms': profiler.slow_threshold_ms,
+            'untracked_statements': profiler.untracked,
+            'queries': profiler.get_top_queries(top_n, order_by),
+            'full_scans': [entry['shape'] for entry in profiler.get_full_scans()]
+        }
         
-    def create_user(self, username: str, password: str) -> bool:
+    def create_user(self, username: str, password: str, password_hash: str = None) -> bool:
         """
         创建新用户
         
         Args:
             username: 用户名
             password: 密码
+            password_hash: 已计算好的密码哈希（为空时在此处计算）
             
         Returns:
             bool: 成功返回True，失败返回False
@@ -52,7 +237,8 @@ class DatabaseManager:
             cursor = conn.cursor()
             
             # 生成密码哈希
-            password_hash = generate_password_hash(password)
+            if password_hash is None:
+                password_hash = generate_password_hash(password)
             
             # 插入用户数据
             cursor.execute('''
@@ -125,6 +311,9 @@ class DatabaseManager:
             conn = self.get_connection()
             cursor = conn.cursor()
             
+            # 新建的数据库文件使用增量回收空闲页（已有数据库需执行一次 optimize_database 才会生效）
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            
             # 创建用户表
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -172,6 +361,8 @@ class DatabaseManager:
                     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                     user_ip TEXT,
                     room TEXT DEFAULT 'chat_room',
+                    has_payload INTEGER DEFAULT 0,
+                    created_ms INTEGER,
                     FOREIGN KEY (session_id) REFERENCES user_sessions(session_id)
                 )
             ''')
@@ -189,6 +380,45 @@ class DatabaseManager:
                 )
             ''')
             
+            # 创建聊天室表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS rooms (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT UNIQUE NOT NULL,
+                    description TEXT,
+                    created_by TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # 确保默认聊天室存在
+            cursor.execute('''
+                INSERT OR IGNORE INTO rooms (name, description, created_by)
+                VALUES (?, ?, ?)
+            ''', (DEFAULT_ROOM, '默认聊天室', 'system'))
+            
+            # 创建后台任务水位表（记录增量任务处理到的位置）
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # 创建按分钟、小时、天汇总的消息数表（bucket_start 为UTC秒级时间戳）
+            for granularity, _ in ROLLUP_GRANULARITIES:
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS message_rollup_{granularity} (
+                        bucket_start INTEGER NOT NULL,
+                        room TEXT NOT NULL,
+                        message_type TEXT NOT NULL,
+                        is_ai INTEGER NOT NULL,
+                        message_count INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (bucket_start, room, message_type, is_ai)
+                    ) WITHOUT ROWID
+                ''')
+            
             # 为现有数据库添加音乐和天气功能列
             try:
                 cursor.execute('''
@@ -209,7 +439,76 @@ class DatabaseManager:
                 if "duplicate column name" not in str(e).lower():
                     print(f"警告：添加列时发生错误（可能列已存在）: {str(e)}")
 
+            # 为现有数据库添加大字段标记列
+            try:
+                cursor.execute('''
+                    ALTER TABLE messages ADD COLUMN has_payload INTEGER DEFAULT 0
+                ''')
+            except sqlite3.OperationalError as e:
+                if "duplicate column name" not in str(e).lower():
+                    print(f"警告：添加列时发生错误（可能列已存在）: {str(e)}")
+            
+            # 为现有数据库添加毫秒时间戳列（UTC毫秒，由 backfill_created_ms 回填旧消息）
+            try:
+                cursor.execute('''
+                    ALTER TABLE messages ADD COLUMN created_ms INTEGER
+                ''')
+            except sqlite3.OperationalError as e:
+                if "duplicate column name" not in str(e).lower():
+                    print(f"警告：添加列时发生错误（可能列已存在）: {str(e)}")
+            # save_message 直接写入 created_ms，其他写入方式由触发器补齐
+            cursor.execute('''
+                CREATE TRIGGER IF NOT EXISTS trg_messages_created_ms
+                AFTER INSERT ON messages
+                WHEN NEW.created_ms IS NULL
+                BEGIN
+                    UPDATE messages
+                    SET created_ms = CAST(strftime('%s', COALESCE(NEW.timestamp, CURRENT_TIMESTAMP)) AS INTEGER) * 1000
+                    WHERE id = NEW.id;
+                END
+            ''')
+            
+            # 创建消息大字段表：长文本压缩后保存在这里，主表只保留预览
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS message_payloads (
+                    message_id INTEGER NOT NULL,
+                    field TEXT NOT NULL,
+                    codec TEXT NOT NULL,
+                    original_size INTEGER NOT NULL,
+                    length INTEGER,
+                    data BLOB NOT NULL,
+                    PRIMARY KEY (message_id, field)
+                )
+            ''')
+            # 为现有数据库添加原文字符数列，并回填已移出的消息内容
+            try:
+                cursor.execute('''
+                    ALTER TABLE message_payloads ADD COLUMN length INTEGER
+                ''')
+            except sqlite3.OperationalError as e:
+                if "duplicate column name" not in str(e).lower():
+                    print(f"警告：添加列时发生错误（可能列已存在）: {str(e)}")
+            cursor.execute('''
+                SELECT message_id, codec, data FROM message_payloads
+                WHERE field = 'message' AND length IS NULL
+            ''')
+            cursor.executemany('''
+                UPDATE message_payloads SET length = ? WHERE message_id = ? AND field = 'message'
+            ''', [(len(decompress_text(codec, data)), message_id)
+                  for message_id, codec, data in cursor.fetchall()])
+            # 删除消息时一并删除大字段（移动到分区时保留）
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_message_payloads_delete
+                AFTER DELETE ON messages
+                WHEN OLD.has_payload = 1
+                     AND NOT EXISTS (SELECT 1 FROM watermarks WHERE name = '{PARTITION_MOVE_FLAG}')
+                BEGIN
+                    DELETE FROM message_payloads WHERE message_id = OLD.id;
+                END
+            ''')
+            
             # 创建索引以提高查询性能
+            # 普通索引末尾隐含rowid，(nickname) 即 (nickname, id)，可按ID顺序返回某个用户的消息
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_messages_nickname 
                 ON messages(nickname)
@@ -225,11 +524,34 @@ class DatabaseManager:
                 ON messages(session_id)
             ''')
             
+            # 历史查询总是按房间过滤并按ID倒序分页，索引以room开头、以id结尾，
+            # 过滤和排序都由索引完成，不需要临时B树排序
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_messages_room_id 
+                ON messages(room, id)
+            ''')
+            
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_messages_room_nickname_id 
+                ON messages(room, nickname, id)
+            ''')
+            
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_messages_room_type_id 
+                ON messages(room, message_type, id)
+            ''')
+            
+            # 时间范围先通过该索引换算成ID范围
             cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_messages_room 
-                ON messages(room)
+                CREATE INDEX IF NOT EXISTS idx_messages_created_ms 
+                ON messages(created_ms)
             ''')
             
+            # 旧索引已被上面以id结尾的复合索引取代
+            for old_index in ('idx_messages_room', 'idx_messages_room_timestamp',
+                              'idx_messages_room_nickname_timestamp'):
+                cursor.execute(f'DROP INDEX IF EXISTS {old_index}')
+            
             cursor.execute('''
                 CREATE INDEX IF NOT EXISTS idx_user_sessions_nickname 
                 ON user_sessions(nickname)
@@ -240,6 +562,26 @@ class DatabaseManager:
                 ON user_sessions(status)
             ''')
             
+            # 检查毫秒时间戳是否已全部回填
+            cursor.execute('SELECT 1 FROM messages WHERE created_ms IS NULL LIMIT 1')
+            self.epoch_ms_ready = cursor.fetchone() is None
+            
+            # 检查统计计数器是否已开启
+            cursor.execute('''
+                SELECT COUNT(*) FROM sqlite_master
+                WHERE type = 'trigger' AND name = 'trg_message_counters_insert'
+            ''')
+            self.stat_counters_enabled = cursor.fetchone()[0] > 0
+            if self.stat_counters_enabled:
+                # 旧版删除触发器不识别分区移动标记，需要重建
+                cursor.execute('''
+                    SELECT sql FROM sqlite_master
+                    WHERE type = 'trigger' AND name = 'trg_message_counters_delete'
+                ''')
+                row = cursor.fetchone()
+                if not row or PARTITION_MOVE_FLAG not in row[0]:
+                    self._create_counter_triggers(cursor)
+            
             conn.commit()
             print("数据库初始化成功！")
             
@@ -311,14 +653,56 @@ class DatabaseManager:
             return False
         finally:
             conn.close()
-    
+
+    def flush_session_activity(self, activities: Dict[str, Tuple[str, bool]]) -> bool:
+        """
+        在一个事务中批量写入会话的最后活动时间和关闭状态
+
+        Args:
+            activities: session_id -> (最后活动时间 YYYY-MM-DD HH:MM:SS, 是否已关闭)
+
+        Returns:
+            bool: 成功返回True
+        """
+        if not activities:
+            return True
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+
+            active = [(last_activity, session_id)
+                      for session_id, (last_activity, closed) in activities.items() if not closed]
+            closed = [(last_activity, session_id)
+                      for session_id, (last_activity, closed) in activities.items() if closed]
+            if active:
+                cursor.executemany('''
+                    UPDATE user_sessions
+                    SET last_activity = ?
+                    WHERE session_id = ?
+                ''', active)
+            if closed:
+                cursor.executemany('''
+                    UPDATE user_sessions
+                    SET status = 'closed', last_activity = ?
+                    WHERE session_id = ?
+                ''', closed)
+
+            conn.commit()
+            return True
+
+        except sqlite3.Error as e:
+            print(f"批量更新会话活动时间失败: {str(e)}")
+            return False
+        finally:
+            conn.close()
+
     def save_message(self, nickname: str, message: str, session_id: str = None, 
                     message_type: str = 'text', is_ai_response: bool = False,
                     is_at_message: bool = False, is_movie: bool = False,
                     movie_url: str = None, movie_info: str = None,
                     is_music: bool = False, music_data: str = None,
                     is_weather: bool = False, weather_data: str = None,
-                    user_ip: str = None, room: str = 'chat_room') -> Optional[int]:
+                    user_ip: str = None, room: str = DEFAULT_ROOM) -> Optional[int]:
         """
         保存聊天消息
         
@@ -342,6 +726,10 @@ class DatabaseManager:
         Returns:
             int: 消息ID，失败返回None
         """
+        fields = {'message': message, 'movie_info': movie_info,
+                  'music_data': music_data, 'weather_data': weather_data}
+        payloads = self._split_payloads(fields) if self.compact_payloads else []
+        
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
@@ -351,16 +739,22 @@ class DatabaseManager:
                     session_id, nickname, message, message_type,
                     is_ai_response, is_at_message, is_movie,
                     movie_url, movie_info, is_music, music_data,
-                    is_weather, weather_data, user_ip, room
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    is_weather, weather_data, user_ip, room, has_payload, created_ms
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
-                session_id, nickname, message, message_type,
+                session_id, nickname, fields['message'], message_type,
                 is_ai_response, is_at_message, is_movie,
-                movie_url, movie_info, is_music, music_data,
-                is_weather, weather_data, user_ip, room
+                movie_url, fields['movie_info'], is_music, fields['music_data'],
+                is_weather, fields['weather_data'], user_ip, room, 1 if payloads else 0,
+                int(time.time() * 1000)
             ))
             
             message_id = cursor.lastrowid
+            if payloads:
+                cursor.executemany('''
+                    INSERT INTO message_payloads (message_id, field, codec, original_size, length, data)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', [(message_id, *payload) for payload in payloads])
             conn.commit()
             return message_id
             
@@ -370,10 +764,212 @@ class DatabaseManager:
         finally:
             conn.close()
     
+    def _split_payloads(self, fields: Dict) -> List[Tuple]:
+        """
+        把超过阈值的大字段压缩后移出，原字段改为预览（消息内容）或置空
+        
+        Args:
+            fields: 字段名 -> 值，会被原地修改
+            
+        Returns:
+            List[Tuple]: (字段名, 压缩算法, 原始字节数, 原始字符数, 压缩数据) 列表
+        """
+        payloads = []
+        for field in PAYLOAD_FIELDS:
+            value = fields.get(field)
+            if not isinstance(value, str):
+                continue
+            size = len(value.encode('utf-8'))
+            if size < self.payload_threshold:
+                continue
+            codec, data = compress_text(value)
+            payloads.append((field, codec, size, len(value), data))
+            fields[field] = value[:PREVIEW_CHARS] + '…' if field == 'message' else None
+        return payloads
+    
+    def _load_payloads(self, messages: List[Dict], conn: sqlite3.Connection = None):
+        """
+        为带大字段标记的消息读取并解压完整内容（原地修改）
+        
+        Args:
+            messages: 包含 id 和 has_payload 的消息字典列表
+            conn: 可选，复用的主库连接
+        """
+        ids = [message['id'] for message in messages if message.get('has_payload')]
+        if not ids:
+            return
+        own_conn = conn is None
+        if own_conn:
+            conn = self.get_connection()
+        try:
+            by_id = {message['id']: message for message in messages}
+            for index in range(0, len(ids), 500):
+                batch = ids[index:index + 500]
+                rows = conn.execute(f'''
+                    SELECT message_id, field, codec, data FROM message_payloads
+                    WHERE message_id IN ({", ".join("?" * len(batch))})
+                ''', batch).fetchall()
+                for message_id, field, codec, data in rows:
+                    by_id[message_id][field] = decompress_text(codec, data)
+        finally:
+            if own_conn:
+                conn.close()
+    
+    def enable_compact_payloads(self, threshold: int = DEFAULT_PAYLOAD_THRESHOLD):
+        """
+        开启大字段压缩存储：新消息中超过阈值的长文本压缩后存入 message_payloads，
+        主表只保留预览，历史扫描不再把长文本读入页缓存
+        
+        Args:
+            threshold: 字段超过该字节数才移出主表
+        """
+        self.payload_threshold = threshold
+        self.compact_payloads = True
+        print(f"大字段压缩存储已开启，阈值 {threshold} 字节")
+    
+    def compact_message_payloads(self, batch_size: int = 200, pause: float = 0.01) -> Dict:
+        """
+        把已有消息中超过阈值的大字段移出主表，按消息ID分批处理，可中断后继续
+        
+        Args:
+            batch_size: 每批检查的消息数
+            pause: 批次之间暂停的秒数
+            
+        Returns:
+            Dict: 处理的消息数和移出的字段数
+        """
+        result = {'scanned': 0, 'compacted_messages': 0, 'payloads': 0}
+        columns = ', '.join(PAYLOAD_FIELDS)
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            while True:
+                cursor.execute('BEGIN IMMEDIATE')
+                last_id = self.get_watermark('payload_compaction_id', cursor)
+                cursor.execute(f'''
+                    SELECT id, {columns} FROM messages
+                    WHERE id > ? AND has_payload = 0
+                    ORDER BY id LIMIT ?
+                ''', (last_id, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    conn.rollback()
+                    break
+                for row in rows:
+                    fields = {field: row[field] for field in PAYLOAD_FIELDS}
+                    payloads = self._split_payloads(fields)
+                    if not payloads:
+                        continue
+                    cursor.executemany('''
+                        INSERT OR REPLACE INTO message_payloads (message_id, field, codec, original_size, length, data)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', [(row['id'], *payload) for payload in payloads])
+                    cursor.execute(f'''
+                        UPDATE messages SET {", ".join(f"{field} = ?" for field in PAYLOAD_FIELDS)},
+                                            has_payload = 1
+                        WHERE id = ?
+                    ''', (*(fields[field] for field in PAYLOAD_FIELDS), row['id']))
+                    result['compacted_messages'] += 1
+                    result['payloads'] += len(payloads)
+                self._set_watermark(cursor, 'payload_compaction_id', rows[-1]['id'])
+                conn.commit()
+                result['scanned'] += len(rows)
+                if pause > 0:
+                    time.sleep(pause)
+            
+            print(f"大字段整理完成: 检查 {result['scanned']} 条，移出 {result['payloads']} 个字段")
+            return result
+            
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"整理消息大字段失败: {str(e)}")
+            result['error'] = str(e)
+            return result
+        finally:
+            conn.close()
+    
+    def get_payload_stats(self) -> Dict:
+        """
+        获取大字段压缩存储的空间节省情况
+        
+        Returns:
+            Dict: 按字段和压缩算法统计的原始字节数、存储字节数和节省比例
+        """
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT field, codec, COUNT(*) as count,
+                       SUM(original_size) as original_bytes, SUM(length(data)) as stored_bytes
+                FROM message_payloads
+                GROUP BY field, codec
+            ''')
+            groups = [dict(row) for row in cursor.fetchall()]
+            original = sum(group['original_bytes'] for group in groups)
+            stored = sum(group['stored_bytes'] for group in groups)
+            return {
+                'enabled': self.compact_payloads,
+                'threshold_bytes': self.payload_threshold,
+                'payloads': sum(group['count'] for group in groups),
+                'original_bytes': original,
+                'stored_bytes': stored,
+                'saved_bytes': original - stored,
+                'saved_ratio': round(1 - stored / original, 4) if original else 0.0,
+                'groups': groups
+            }
+        except sqlite3.Error as e:
+            print(f"获取大字段统计失败: {str(e)}")
+            return {}
+        finally:
+            conn.close()
+    
+    def _build_history_query(self, cursor: sqlite3.Cursor, nickname: str = None,
+                             room: str = None, message_type: str = None,
+                             start_time: str = None, end_time: str = None) -> Tuple[str, List]:
+        """
+        构建历史消息分页查询
+        
+        Returns:
+            Tuple[str, List]: 以 LIMIT ? OFFSET ? 结尾的查询语句和参数（不含 LIMIT 和 OFFSET）
+        """
+        # 构建查询条件
+        where_conditions = ["1=1"]
+        params = []
+        
+        if nickname:
+            where_conditions.append("nickname = ?")
+            params.append(nickname)
+        
+        if room:
+            where_conditions.append("room = ?")
+            params.append(room)
+        
+        if message_type:
+            where_conditions.append("message_type = ?")
+            params.append(message_type)
+        
+        self._add_time_conditions(cursor, where_conditions, params, start_time, end_time)
+        
+        where_clause = " AND ".join(where_conditions)
+        
+        # 按ID倒序即按写入时间倒序，可直接沿 (room, ..., id) 索引倒序读取
+        sql = f'''
+            SELECT id, session_id, nickname, message, message_type,
+                   is_ai_response, is_at_message, is_movie, movie_url,
+                   movie_info, is_music, music_data, is_weather, 
+                   weather_data, timestamp, user_ip, room, has_payload
+            FROM messages 
+            WHERE {where_clause}
+            ORDER BY id DESC
+            LIMIT ? OFFSET ?
+        '''
+        return sql, params
+    
     def get_messages(self, limit: int = 50, offset: int = 0, 
-                    nickname: str = None, room: str = 'chat_room',
+                    nickname: str = None, room: str = DEFAULT_ROOM,
                     message_type: str = None, start_time: str = None,
-                    end_time: str = None) -> List[Dict]:
+                    end_time: str = None, preview: bool = False) -> List[Dict]:
         """
         获取聊天消息历史
         
@@ -385,6 +981,7 @@ class DatabaseManager:
             message_type: 按消息类型过滤
             start_time: 开始时间
             end_time: 结束时间
+            preview: 为True时大字段只返回预览，不读取和解压完整内容
             
         Returns:
             List[Dict]: 消息列表
@@ -393,50 +990,21 @@ class DatabaseManager:
             conn = self.get_connection()
             cursor = conn.cursor()
             
-            # 构建查询条件
-            where_conditions = ["1=1"]
-            params = []
-            
-            if nickname:
-                where_conditions.append("nickname = ?")
-                params.append(nickname)
-            
-            if room:
-                where_conditions.append("room = ?")
-                params.append(room)
-            
-            if message_type:
-                where_conditions.append("message_type = ?")
-                params.append(message_type)
-            
-            if start_time:
-                where_conditions.append("timestamp >= ?")
-                params.append(start_time)
-            
-            if end_time:
-                where_conditions.append("timestamp <= ?")
-                params.append(end_time)
-            
-            where_clause = " AND ".join(where_conditions)
-            
-            cursor.execute(f'''
-                SELECT id, session_id, nickname, message, message_type,
-                       is_ai_response, is_at_message, is_movie, movie_url,
-                       movie_info, is_music, music_data, is_weather, 
-                       weather_data, timestamp, user_ip, room
-                FROM messages 
-                WHERE {where_clause}
-                ORDER BY timestamp DESC
-                LIMIT ? OFFSET ?
-            ''', (*params, limit, offset))
-            
-            rows = cursor.fetchall()
+            sql, params = self._build_history_query(cursor, nickname, room, message_type,
+                                                    start_time, end_time)
+            if self.partitions:
+                rows = self._fan_out_newest(cursor, sql, params, limit, offset, start_time, end_time)
+            else:
+                cursor.execute(sql, (*params, limit, offset))
+                rows = cursor.fetchall()
             
             # 转换为字典列表
             messages = []
             for row in rows:
                 message_dict = dict(row)
                 messages.append(message_dict)
+            if not preview:
+                self._load_payloads(messages, conn)
             
             # 返回正序（最新的消息在最后）
             return messages[::-1]
@@ -488,46 +1056,317 @@ class DatabaseManager:
         finally:
             conn.close()
 
-    def get_message_history(self, nickname: str = None, limit: int = 50, offset: int = 0) -> List[Dict]:
+    @staticmethod
+    def _parse_time_ms(value, end: bool = False) -> Optional[int]:
         """
-        获取消息历史（get_messages方法的别名）
+        把时间转换为UTC毫秒时间戳
         
         Args:
-            nickname: 按用户昵称过滤
-            limit: 返回消息数量限制
+            value: 毫秒时间戳，或 TIME_FORMATS 中格式的UTC时间字符串
+            end: 是否为范围结束时间；精确到秒的结束时间包含该秒内的所有毫秒
+            
+        Returns:
+            Optional[int]: 毫秒时间戳，无法识别返回None
+        """
+        if isinstance(value, (int, float)):
+            return int(value)
+        for fmt in TIME_FORMATS:
+            try:
+                parsed = datetime.strptime(value, fmt)
+            except ValueError:
+                continue
+            ms = int((parsed - datetime(1970, 1, 1)).total_seconds() * 1000)
+            if end and parsed.microsecond == 0:
+                ms += 999
+            return ms
+        return None
+    
+    def _add_time_conditions(self, cursor: sqlite3.Cursor, where_conditions: List[str],
+                             params: List, start_time=None, end_time=None):
+        """
+        添加时间范围条件
+        
+        毫秒时间戳已回填完成时，先通过 created_ms 索引把时间范围换算成ID范围，
+        查询就能沿 (room, ..., id) 索引只读取范围内的条目；ID范围只用于缩小扫描，
+        created_ms 条件保证结果精确。换算只读取范围边界附近的条目（见 TIME_LOWER_ID_SQL），
+        否则按 timestamp 文本比较
+        """
+        start_ms = self._parse_time_ms(start_time) if start_time else None
+        end_ms = self._parse_time_ms(end_time, end=True) if end_time else None
+        if not self.epoch_ms_ready or (start_time and start_ms is None) or (end_time and end_ms is None):
+            if start_time:
+                where_conditions.append("timestamp >= ?")
+                params.append(start_time)
+            if end_time:
+                where_conditions.append("timestamp <= ?")
+                params.append(end_time)
+            return
+        
+        # 一元加号阻止优化器改用 created_ms 索引（那样需要额外排序）；
+        # 开启分区时主库的ID范围不适用于分区，只保留时间条件
+        if start_ms is not None:
+            where_conditions.append("+created_ms >= ?")
+            params.append(start_ms)
+            if not self.partitions:
+                cursor.execute(TIME_LOWER_ID_SQL, (start_ms, start_ms, ID_ORDER_SLACK_MS))
+                low_id = cursor.fetchone()[0]
+                if low_id is not None:
+                    where_conditions.append("id >= ?")
+                    params.append(low_id)
+        if end_ms is not None:
+            where_conditions.append("+created_ms <= ?")
+            params.append(end_ms)
+            if not self.partitions:
+                cursor.execute(TIME_UPPER_ID_SQL, (end_ms, end_ms, ID_ORDER_SLACK_MS))
+                high_id = cursor.fetchone()[0]
+                if high_id is not None:
+                    where_conditions.append("id <= ?")
+                    params.append(high_id)
+    
+    def _fan_out_newest(self, cursor: sqlite3.Cursor, sql: str, params: List,
+                        limit: int, offset: int, start_time: str = None,
+                        end_time: str = None) -> List[sqlite3.Row]:
+        """
+        在主库和分区上执行按时间倒序的分页查询
+        
+        主库只保存比所有分区都新的消息，因此按主库、新分区、旧分区的顺序读取，
+        凑够 offset + limit 条后不再打开更早的分区
+        
+        Args:
+            cursor: 主库游标
+            sql: 以 LIMIT ? OFFSET ? 结尾的查询语句
+            params: 查询参数（不含 LIMIT 和 OFFSET）
+            limit: 返回数量
             offset: 偏移量
+            start_time: 开始时间，用于筛选分区
+            end_time: 结束时间，用于筛选分区
             
         Returns:
-            List[Dict]: 消息列表
+            List[sqlite3.Row]: 按时间倒序的结果
         """
-        return self.get_messages(nickname=nickname, limit=limit, offset=offset)
-
-    def get_user_stats(self, nickname: str = None, start_time: str = None, 
-                      end_time: str = None) -> Dict:
+        needed = offset + limit
+        cursor.execute(sql, (*params, needed, 0))
+        rows = cursor.fetchall()
+        for month in self.partitions.months_for_range(start_time, end_time):
+            if len(rows) >= needed:
+                break
+            part_conn = self.partitions.connect(month)
+            try:
+                rows.extend(part_conn.execute(sql, (*params, needed - len(rows), 0)).fetchall())
+            finally:
+                part_conn.close()
+        return rows[offset:needed]
+    
+    def search_messages(self, keyword: str, room: str = None, nickname: str = None,
+                        start_time: str = None, end_time: str = None,
+                        limit: int = 50, offset: int = 0) -> List[Dict]:
         """
-        获取用户统计信息
+        按关键词搜索消息（从新到旧），开启分区后只搜索时间范围涉及的分区；
+        大字段已移出主表的消息先匹配预览，预览未命中时解压完整内容再匹配
         
         Args:
-            nickname: 用户昵称
+            keyword: 关键词
+            room: 按聊天室过滤，为空时搜索所有聊天室
+            nickname: 按用户昵称过滤
             start_time: 开始时间
             end_time: 结束时间
+            limit: 返回数量
+            offset: 偏移量
             
         Returns:
-            Dict: 统计信息
+            List[Dict]: 消息列表
         """
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
             
-            # 构建查询条件
-            where_conditions = ["1=1"]
-            params = []
-            
+            # 转义LIKE通配符，按字面匹配关键词
+            pattern = '%' + keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            # 预览未命中但带大字段的消息也作为候选，解压后再判断
+            where_conditions = ["(message LIKE ? ESCAPE '\\' OR has_payload = 1)"]
+            params = [pattern, pattern]
+            if room:
+                where_conditions.append("room = ?")
+                params.append(room)
             if nickname:
                 where_conditions.append("nickname = ?")
                 params.append(nickname)
+            self._add_time_conditions(cursor, where_conditions, params, start_time, end_time)
             
-            if start_time:
+            sql = f'''
+                SELECT {", ".join(EXPORT_COLUMNS)}, has_payload, message LIKE ? ESCAPE '\\' AS preview_match
+                FROM messages
+                WHERE {" AND ".join(where_conditions)}
+                ORDER BY id DESC
+                LIMIT ? OFFSET ?
+            '''
+            # 与 LIKE 一样只对ASCII字母不区分大小写
+            needle = keyword.translate(ASCII_LOWER)
+            needed = offset + limit
+            batch = max(needed, 100)
+            matches = []
+            scanned = 0
+            while len(matches) < needed:
+                if self.partitions:
+                    rows = self._fan_out_newest(cursor, sql, params, batch, scanned, start_time, end_time)
+                else:
+                    cursor.execute(sql, (*params, batch, scanned))
+                    rows = cursor.fetchall()
+                scanned += len(rows)
+                messages = [dict(row) for row in rows]
+                self._load_payloads(messages, conn)
+                for message in messages:
+                    if message.pop('preview_match') or needle in (message['message'] or '').translate(ASCII_LOWER):
+                        matches.append(message)
+                if len(rows) < batch:
+                    break
+            return matches[offset:needed]
+            
+        except sqlite3.Error as e:
+            print(f"搜索消息失败: {str(e)}")
+            return []
+        finally:
+            conn.close()
+    
+    def get_message_history(self, nickname: str = None, limit: int = 50, offset: int = 0,
+                            room: str = DEFAULT_ROOM, preview: bool = False) -> List[Dict]:
+        """
+        获取消息历史（get_messages方法的别名）
+        
+        Args:
+            nickname: 按用户昵称过滤
+            limit: 返回消息数量限制
+            offset: 偏移量
+            room: 聊天室名称
+            preview: 为True时大字段只返回预览
+            
+        Returns:
+            List[Dict]: 消息列表
+        """
+        return self.get_messages(nickname=nickname, limit=limit, offset=offset, room=room,
+                                 preview=preview)
+
+    def create_room(self, name: str, created_by: str = None, description: str = None) -> bool:
+        """
+        创建聊天室
+        
+        Args:
+            name: 聊天室名称
+            created_by: 创建者昵称
+            description: 聊天室描述
+            
+        Returns:
+            bool: 成功返回True，聊天室已存在或失败返回False
+        """
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                INSERT INTO rooms (name, description, created_by)
+                VALUES (?, ?, ?)
+            ''', (name, description, created_by))
+            
+            conn.commit()
+            return True
+            
+        except sqlite3.IntegrityError:
+            # 聊天室已存在
+            return False
+        except sqlite3.Error as e:
+            print(f"创建聊天室失败: {str(e)}")
+            return False
+        finally:
+            conn.close()
+
+    def get_room(self, name: str) -> Optional[Dict]:
+        """
+        获取聊天室信息
+        
+        Args:
+            name: 聊天室名称
+            
+        Returns:
+            Optional[Dict]: 聊天室信息，不存在返回None
+        """
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT name, description, created_by, created_at
+                FROM rooms
+                WHERE name = ?
+            ''', (name,))
+            
+            row = cursor.fetchone()
+            return dict(row) if row else None
+            
+        except sqlite3.Error as e:
+            print(f"获取聊天室失败: {str(e)}")
+            return None
+        finally:
+            conn.close()
+
+    def get_rooms(self) -> List[Dict]:
+        """
+        获取所有聊天室列表
+        
+        Returns:
+            List[Dict]: 聊天室列表
+        """
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT name, description, created_by, created_at
+                FROM rooms
+                ORDER BY id
+            ''')
+            
+            return [dict(row) for row in cursor.fetchall()]
+            
+        except sqlite3.Error as e:
+            print(f"获取聊天室列表失败: {str(e)}")
+            return []
+        finally:
+            conn.close()
+
+    def get_user_stats(self, nickname: str = None, start_time: str = None, 
+                      end_time: str = None) -> Dict:
+        """
+        获取用户统计信息
+        
+        没有时间范围且已开启计数器表时直接读取计数器（常数时间），
+        否则对消息表做一次按昵称分组的扫描，同时得到所有计数和活跃用户
+        
+        Args:
+            nickname: 用户昵称
+            start_time: 开始时间
+            end_time: 结束时间
+            
+        Returns:
+            Dict: 统计信息
+        """
+        if self.stat_counters_enabled and not start_time and not end_time:
+            stats = self._get_counter_stats(nickname)
+            if stats is not None:
+                return stats
+        
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            
+            # 构建查询条件
+            where_conditions = ["1=1"]
+            params = []
+            
+            if nickname:
+                where_conditions.append("nickname = ?")
+                params.append(nickname)
+            
+            if start_time:
                 where_conditions.append("timestamp >= ?")
                 params.append(start_time)
             
@@ -537,60 +1376,547 @@ class DatabaseManager:
             
             where_clause = " AND ".join(where_conditions)
             
-            # 获取总消息数
-            cursor.execute(f'''
-                SELECT COUNT(*) as total_messages
+            # 一次扫描得到每个用户的各类消息数，总数由各用户累加
+            sql = f'''
+                SELECT nickname,
+                       COUNT(*) as message_count,
+                       SUM(is_ai_response = 1) as ai_messages,
+                       SUM(is_at_message = 1) as at_messages,
+                       SUM(is_movie = 1) as movie_messages
                 FROM messages 
                 WHERE {where_clause}
-            ''', params)
-            total_messages = cursor.fetchone()['total_messages']
+                GROUP BY nickname
+            '''
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            
+            # 开启分区时合并时间范围涉及的各个分区
+            if self.partitions:
+                for month in self.partitions.months_for_range(start_time, end_time):
+                    part_conn = self.partitions.connect(month)
+                    try:
+                        rows.extend(part_conn.execute(sql, params).fetchall())
+                    finally:
+                        part_conn.close()
+            
+            users = {}
+            for row in rows:
+                user = users.setdefault(row['nickname'], [0, 0, 0, 0])
+                user[0] += row['message_count']
+                user[1] += row['ai_messages']
+                user[2] += row['at_messages']
+                user[3] += row['movie_messages']
+            
+            active_users = sorted(
+                ({'nickname': name, 'message_count': counts[0]} for name, counts in users.items()),
+                key=lambda user: user['message_count'], reverse=True
+            )[:10]
+            
+            return {
+                'total_messages': sum(counts[0] for counts in users.values()),
+                'ai_messages': sum(counts[1] for counts in users.values()),
+                'at_messages': sum(counts[2] for counts in users.values()),
+                'movie_messages': sum(counts[3] for counts in users.values()),
+                'active_users': active_users
+            }
+            
+        except sqlite3.Error as e:
+            print(f"获取用户统计失败: {str(e)}")
+            return {}
+        finally:
+            conn.close()
+    
+    def _get_counter_stats(self, nickname: str = None) -> Optional[Dict]:
+        """
+        从计数器表读取统计信息
+        
+        Args:
+            nickname: 用户昵称，为空时读取全局计数
+            
+        Returns:
+            Optional[Dict]: 统计信息，读取失败返回None
+        """
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            
+            scope, key = ('nickname', nickname) if nickname else ('global', '')
+            cursor.execute('''
+                SELECT total_messages, ai_messages, at_messages, movie_messages
+                FROM message_counters
+                WHERE scope = ? AND key = ?
+            ''', (scope, key))
+            row = cursor.fetchone()
+            
+            if nickname:
+                active_users = [{'nickname': nickname, 'message_count': row['total_messages']}] \
+                    if row and row['total_messages'] else []
+            else:
+                cursor.execute('''
+                    SELECT key as nickname, total_messages as message_count
+                    FROM message_counters
+                    WHERE scope = 'nickname' AND total_messages > 0
+                    ORDER BY total_messages DESC
+                    LIMIT 10
+                ''')
+                active_users = [dict(user) for user in cursor.fetchall()]
+            
+            return {
+                'total_messages': row['total_messages'] if row else 0,
+                'ai_messages': row['ai_messages'] if row else 0,
+                'at_messages': row['at_messages'] if row else 0,
+                'movie_messages': row['movie_messages'] if row else 0,
+                'active_users': active_users
+            }
+            
+        except sqlite3.Error as e:
+            print(f"读取统计计数器失败: {str(e)}")
+            return None
+        finally:
+            conn.close()
+    
+    def enable_stat_counters(self) -> bool:
+        """
+        开启统计计数器表：用触发器在插入和删除消息时增量维护全局和每个用户的计数，
+        并用一次分组扫描回填现有数据
+        
+        Returns:
+            bool: 成功返回True
+        """
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            
+            # 回填期间阻止其他写入，避免计数遗漏
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS message_counters (
+                    scope TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    total_messages INTEGER NOT NULL DEFAULT 0,
+                    ai_messages INTEGER NOT NULL DEFAULT 0,
+                    at_messages INTEGER NOT NULL DEFAULT 0,
+                    movie_messages INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (scope, key)
+                )
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_message_counters_total
+                ON message_counters(scope, total_messages)
+            ''')
+            cursor.execute('DELETE FROM message_counters')
+            cursor.execute('''
+                INSERT INTO message_counters (scope, key, total_messages, ai_messages, at_messages, movie_messages)
+                SELECT 'nickname', nickname, COUNT(*), SUM(is_ai_response = 1),
+                       SUM(is_at_message = 1), SUM(is_movie = 1)
+                FROM messages
+                GROUP BY nickname
+            ''')
+            # 已移动到分区的消息同样计入
+            for month in (self.partitions.list_months() if self.partitions else []):
+                part_conn = self.partitions.connect(month)
+                try:
+                    rows = part_conn.execute('''
+                        SELECT nickname, COUNT(*), SUM(is_ai_response = 1),
+                               SUM(is_at_message = 1), SUM(is_movie = 1)
+                        FROM messages
+                        GROUP BY nickname
+                    ''').fetchall()
+                finally:
+                    part_conn.close()
+                cursor.executemany('''
+                    INSERT INTO message_counters (scope, key, total_messages, ai_messages, at_messages, movie_messages)
+                    VALUES ('nickname', ?, ?, ?, ?, ?)
+                    ON CONFLICT(scope, key) DO UPDATE SET
+                        total_messages = total_messages + excluded.total_messages,
+                        ai_messages = ai_messages + excluded.ai_messages,
+                        at_messages = at_messages + excluded.at_messages,
+                        movie_messages = movie_messages + excluded.movie_messages
+                ''', [tuple(row) for row in rows])
+            cursor.execute('''
+                INSERT INTO message_counters (scope, key, total_messages, ai_messages, at_messages, movie_messages)
+                SELECT 'global', '', COALESCE(SUM(total_messages), 0), COALESCE(SUM(ai_messages), 0),
+                       COALESCE(SUM(at_messages), 0), COALESCE(SUM(movie_messages), 0)
+                FROM message_counters
+                WHERE scope = 'nickname'
+            ''')
+            
+            self._create_counter_triggers(cursor)
             
-            # 获取AI回复数
+            conn.commit()
+            self.stat_counters_enabled = True
+            print("统计计数器已开启")
+            return True
+            
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"开启统计计数器失败: {str(e)}")
+            return False
+        finally:
+            conn.close()
+    
+    def _create_counter_triggers(self, cursor: sqlite3.Cursor):
+        """
+        创建（或重建）维护计数器表的插入和删除触发器
+        
+        消息移动到分区时不是真正删除，删除触发器在事务内存在移动标记时不减计数
+        """
+        for event, row, sign in (('INSERT', 'NEW', '+'), ('DELETE', 'OLD', '-')):
+            condition = ''
+            if event == 'DELETE':
+                condition = f"WHEN NOT EXISTS (SELECT 1 FROM watermarks WHERE name = '{PARTITION_MOVE_FLAG}')"
+            cursor.execute(f'DROP TRIGGER IF EXISTS trg_message_counters_{event.lower()}')
             cursor.execute(f'''
-                SELECT COUNT(*) as ai_messages
-                FROM messages 
-                WHERE {where_clause} AND is_ai_response = 1
-            ''', params)
-            ai_messages = cursor.fetchone()['ai_messages']
+                CREATE TRIGGER trg_message_counters_{event.lower()}
+                AFTER {event} ON messages
+                {condition}
+                BEGIN
+                    INSERT INTO message_counters (scope, key, total_messages, ai_messages, at_messages, movie_messages)
+                    VALUES ('global', '', {sign}1, {sign}({row}.is_ai_response = 1),
+                            {sign}({row}.is_at_message = 1), {sign}({row}.is_movie = 1))
+                    ON CONFLICT(scope, key) DO UPDATE SET
+                        total_messages = total_messages + excluded.total_messages,
+                        ai_messages = ai_messages + excluded.ai_messages,
+                        at_messages = at_messages + excluded.at_messages,
+                        movie_messages = movie_messages + excluded.movie_messages;
+                    INSERT INTO message_counters (scope, key, total_messages, ai_messages, at_messages, movie_messages)
+                    VALUES ('nickname', {row}.nickname, {sign}1, {sign}({row}.is_ai_response = 1),
+                            {sign}({row}.is_at_message = 1), {sign}({row}.is_movie = 1))
+                    ON CONFLICT(scope, key) DO UPDATE SET
+                        total_messages = total_messages + excluded.total_messages,
+                        ai_messages = ai_messages + excluded.ai_messages,
+                        at_messages = at_messages + excluded.at_messages,
+                        movie_messages = movie_messages + excluded.movie_messages;
+                END
+            ''')
+    
+    def disable_stat_counters(self) -> bool:
+        """
+        关闭统计计数器表（删除触发器和计数器表）
+        
+        Returns:
+            bool: 成功返回True
+        """
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute('DROP TRIGGER IF EXISTS trg_message_counters_insert')
+            cursor.execute('DROP TRIGGER IF EXISTS trg_message_counters_delete')
+            cursor.execute('DROP TABLE IF EXISTS message_counters')
+            
+            conn.commit()
+            self.stat_counters_enabled = False
+            return True
+            
+        except sqlite3.Error as e:
+            print(f"关闭统计计数器失败: {str(e)}")
+            return False
+        finally:
+            conn.close()
+    
+    def backfill_created_ms(self, batch_size: int = 5000, pause: float = 0.01) -> int:
+        """
+        按消息ID分批为旧消息回填毫秒时间戳，每批一个短事务，可中断后继续
+        
+        Args:
+            batch_size: 每批处理的消息数
+            pause: 批次之间暂停的秒数
+            
+        Returns:
+            int: 回填的消息数，失败返回-1
+        """
+        updated = 0
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            while True:
+                cursor.execute('BEGIN IMMEDIATE')
+                low = self.get_watermark('created_ms_backfill_id', cursor)
+                cursor.execute('''
+                    SELECT MAX(id) FROM (
+                        SELECT id FROM messages WHERE id > ? ORDER BY id LIMIT ?
+                    )
+                ''', (low, batch_size))
+                high = cursor.fetchone()[0]
+                if high is None:
+                    conn.rollback()
+                    break
+                cursor.execute('''
+                    UPDATE messages
+                    SET created_ms = COALESCE(CAST(strftime('%s', timestamp) AS INTEGER) * 1000, 0)
+                    WHERE id > ? AND id <= ? AND created_ms IS NULL
+                ''', (low, high))
+                updated += cursor.rowcount
+                self._set_watermark(cursor, 'created_ms_backfill_id', high)
+                conn.commit()
+                if pause > 0:
+                    time.sleep(pause)
+            
+            cursor.execute('SELECT 1 FROM messages WHERE created_ms IS NULL LIMIT 1')
+            self.epoch_ms_ready = cursor.fetchone() is None
+            print(f"毫秒时间戳回填完成，共 {updated} 条")
+            return updated
+            
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"回填毫秒时间戳失败: {str(e)}")
+            return -1
+        finally:
+            conn.close()
+    
+    def verify_query_plans(self) -> Dict:
+        """
+        用 EXPLAIN QUERY PLAN 检查历史查询的各种形状：
+        不应出现全表扫描，也不应使用临时B树排序；时间范围换算ID的边界查询只能走 created_ms 索引
+        
+        Returns:
+            Dict: ok 表示全部通过，queries 为每种形状的执行计划和问题
+        """
+        shapes = {
+            'room': {'room': DEFAULT_ROOM},
+            'room_nickname': {'room': DEFAULT_ROOM, 'nickname': 'user'},
+            'room_type': {'room': DEFAULT_ROOM, 'message_type': 'ai'},
+            'room_nickname_type': {'room': DEFAULT_ROOM, 'nickname': 'user', 'message_type': 'ai'},
+            'room_time_range': {'room': DEFAULT_ROOM, 'start_time': '2024-01-01 00:00:00',
+                                'end_time': '2024-01-31 23:59:59'},
+            'nickname_all_rooms': {'nickname': 'user'},
+        }
+        results = {}
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            for name, filters in shapes.items():
+                sql, params = self._build_history_query(cursor, **filters)
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', (*params, 50, 0))
+                plan = [row[3] for row in cursor.fetchall()]
+                problems = [detail for detail in plan
+                            if 'TEMP B-TREE' in detail
+                            or (detail.startswith('SCAN ') and ' USING ' not in detail)]
+                results[name] = {'plan': plan, 'problems': problems}
+            # 时间范围换算ID的边界查询同样不能扫描整个历史
+            for name, sql in (('time_lower_id', TIME_LOWER_ID_SQL), ('time_upper_id', TIME_UPPER_ID_SQL)):
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', (0, 0, ID_ORDER_SLACK_MS))
+                plan = [row[3] for row in cursor.fetchall()]
+                problems = [detail for detail in plan
+                            if detail.startswith(('SCAN ', 'SEARCH ')) and 'idx_messages_created_ms' not in detail]
+                results[name] = {'plan': plan, 'problems': problems}
+            return {
+                'ok': not any(result['problems'] for result in results.values()),
+                'epoch_ms_ready': self.epoch_ms_ready,
+                'queries': results
+            }
+        except sqlite3.Error as e:
+            print(f"检查查询计划失败: {str(e)}")
+            return {'ok': False, 'error': str(e), 'queries': results}
+        finally:
+            conn.close()
+    
+    def get_watermark(self, name: str, cursor: sqlite3.Cursor = None) -> int:
+        """
+        获取后台任务的水位
+        
+        Args:
+            name: 水位名称
+            cursor: 可选，在已有事务中读取
+            
+        Returns:
+            int: 水位值，不存在返回0
+        """
+        if cursor is not None:
+            cursor.execute('SELECT value FROM watermarks WHERE name = ?', (name,))
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        try:
+            conn = self.get_connection()
+            return self.get_watermark(name, conn.cursor())
+        except sqlite3.Error as e:
+            print(f"读取水位失败: {str(e)}")
+            return 0
+        finally:
+            conn.close()
+    
+    def _set_watermark(self, cursor: sqlite3.Cursor, name: str, value: int):
+        """在当前事务中更新水位"""
+        cursor.execute('''
+            INSERT INTO watermarks (name, value, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(name) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        ''', (name, value))
+    
+    def _add_watermark(self, cursor: sqlite3.Cursor, name: str, delta: int):
+        """在当前事务中把水位加上 delta（可为负，结果不小于0）"""
+        cursor.execute('''
+            INSERT INTO watermarks (name, value, updated_at) VALUES (?, MAX(0, ?), CURRENT_TIMESTAMP)
+            ON CONFLICT(name) DO UPDATE SET value = MAX(0, watermarks.value + ?), updated_at = excluded.updated_at
+        ''', (name, delta, delta))
+    
+    def _forget_integrity_rows(self, cursor: sqlite3.Cursor, ids: List[int]):
+        """在删除消息的事务中，从完整性检查的累计计数里减去这些已检查过的消息"""
+        row = cursor.execute(f'''
+            SELECT
+                SUM(CASE WHEN m.session_id IS NOT NULL AND NOT EXISTS (
+                    SELECT 1 FROM main.user_sessions s WHERE s.session_id = m.session_id
+                ) THEN 1 ELSE 0 END) AS orphans,
+                SUM(CASE WHEN {MESSAGE_LENGTH_SQL} > 4000 THEN 1 ELSE 0 END) AS long_messages
+            FROM main.messages m
+            WHERE m.id IN ({", ".join("?" * len(ids))}) AND m.id <= ?
+        ''', (*ids, self.get_watermark('integrity_message_id', cursor))).fetchone()
+        if row['orphans']:
+            self._add_watermark(cursor, 'integrity_orphan_messages', -row['orphans'])
+        if row['long_messages']:
+            self._add_watermark(cursor, 'integrity_long_messages', -row['long_messages'])
+    
+    def compact_rollups(self, batch_size: int = 50000) -> int:
+        """
+        把水位之后的新消息累加到分钟、小时、天汇总表
+        
+        只按主键范围读取新消息，耗时与新增消息数成正比，与历史总量无关；
+        清理旧消息不会影响已汇总的统计
+        
+        Args:
+            batch_size: 单次最多处理的消息数
+            
+        Returns:
+            int: 本次汇总的消息数，失败返回-1
+        """
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            
+            cursor.execute('BEGIN IMMEDIATE')
+            low = self.get_watermark('rollup_message_id', cursor)
+            cursor.execute('''
+                SELECT MAX(id), COUNT(*) FROM (
+                    SELECT id FROM messages WHERE id > ? ORDER BY id LIMIT ?
+                )
+            ''', (low, batch_size))
+            high, count = cursor.fetchone()
+            if not count:
+                conn.rollback()
+                return 0
+            
+            for granularity, seconds in ROLLUP_GRANULARITIES:
+                cursor.execute(f'''
+                    INSERT INTO message_rollup_{granularity}
+                        (bucket_start, room, message_type, is_ai, message_count)
+                    SELECT (CAST(strftime('%s', timestamp) AS INTEGER) / {seconds}) * {seconds},
+                           COALESCE(room, ''), COALESCE(message_type, 'text'),
+                           is_ai_response = 1, COUNT(*)
+                    FROM messages
+                    WHERE id > ? AND id <= ? AND timestamp IS NOT NULL
+                    GROUP BY 1, 2, 3, 4
+                    ON CONFLICT(bucket_start, room, message_type, is_ai) DO UPDATE SET
+                        message_count = message_count + excluded.message_count
+                ''', (low, high))
+            
+            self._set_watermark(cursor, 'rollup_message_id', high)
+            conn.commit()
+            return count
+            
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"汇总消息统计失败: {str(e)}")
+            return -1
+        finally:
+            conn.close()
+    
+    def get_timeseries(self, start: int, end: int, interval: int = None,
+                       room: str = None, message_type: str = None,
+                       group_by: str = None) -> Dict:
+        """
+        从汇总表查询消息数时间序列
+        
+        选择能整除统计间隔且与起止时间对齐的最粗粒度汇总表，
+        查询只涉及汇总表中落在时间范围内的行
+        
+        Args:
+            start: 开始时间（UTC秒级时间戳，包含）
+            end: 结束时间（UTC秒级时间戳，不包含）
+            interval: 统计间隔（秒），默认自动选择使点数不超过500，
+                指定时点数不能超过 MAX_TIMESERIES_POINTS
+            room: 按聊天室过滤
+            message_type: 按消息类型过滤
+            group_by: 分组维度（message_type、room、is_ai），为空时只返回总数
             
-            # 获取@消息数
-            cursor.execute(f'''
-                SELECT COUNT(*) as at_messages
-                FROM messages 
-                WHERE {where_clause} AND is_at_message = 1
-            ''', params)
-            at_messages = cursor.fetchone()['at_messages']
+        Returns:
+            Dict: 包含所用粒度、间隔和各时间点数据的字典
+        """
+        if group_by not in (None, 'message_type', 'room', 'is_ai'):
+            raise ValueError(f"不支持的分组维度: {group_by}")
+        if end <= start:
+            raise ValueError("结束时间必须晚于开始时间")
+        if not interval:
+            candidates = (60, 300, 900, 3600, 21600, 86400, 604800)
+            interval = next((step for step in candidates if (end - start) / step <= 500), None)
+            if interval is None:
+                # 超过十年的范围按整周放大间隔
+                interval = -(-(end - start) // (500 * 604800)) * 604800
+        elif interval < 0:
+            raise ValueError("统计间隔必须大于0")
+        if (end - start) / interval > MAX_TIMESERIES_POINTS:
+            raise ValueError(f"时间范围内的点数超过 {MAX_TIMESERIES_POINTS}，请缩小时间范围或增大统计间隔")
+        
+        # 选择最粗的可用粒度，起止时间不对齐时退回到分钟粒度并向下取整
+        granularity, seconds = ROLLUP_GRANULARITIES[0]
+        for name, size in ROLLUP_GRANULARITIES:
+            if interval % size == 0 and start % size == 0 and end % size == 0:
+                granularity, seconds = name, size
+        start -= start % seconds
+        
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
             
-            # 获取电影分享数
-            cursor.execute(f'''
-                SELECT COUNT(*) as movie_messages
-                FROM messages 
-                WHERE {where_clause} AND is_movie = 1
-            ''', params)
-            movie_messages = cursor.fetchone()['movie_messages']
+            where_conditions = ["bucket_start >= ?", "bucket_start < ?"]
+            params = [start, end]
+            if room:
+                where_conditions.append("room = ?")
+                params.append(room)
+            if message_type:
+                where_conditions.append("message_type = ?")
+                params.append(message_type)
+            group_column = group_by or "''"
             
-            # 获取活跃用户列表
             cursor.execute(f'''
-                SELECT nickname, COUNT(*) as message_count
-                FROM messages 
-                WHERE {where_clause}
-                GROUP BY nickname
-                ORDER BY message_count DESC
-                LIMIT 10
-            ''', params)
-            active_users = [dict(row) for row in cursor.fetchall()]
+                SELECT ((bucket_start - ?) / ?) * ? + ? as point, {group_column} as grp,
+                       SUM(message_count) as message_count
+                FROM message_rollup_{granularity}
+                WHERE {" AND ".join(where_conditions)}
+                GROUP BY point, grp
+                ORDER BY point
+            ''', (start, interval, interval, start, *params))
+            
+            points = {}
+            for row in cursor.fetchall():
+                point = points.setdefault(row['point'], {'total': 0, 'groups': {}})
+                point['total'] += row['message_count']
+                if group_by:
+                    point['groups'][str(row['grp'])] = row['message_count']
+            
+            # 补齐没有消息的时间点
+            series = []
+            for point_start in range(start, end, interval):
+                point = points.get(point_start, {'total': 0, 'groups': {}})
+                item = {
+                    'time': datetime.utcfromtimestamp(point_start).strftime('%Y-%m-%d %H:%M:%S'),
+                    'timestamp': point_start,
+                    'total': point['total']
+                }
+                if group_by:
+                    item['groups'] = point['groups']
+                series.append(item)
             
             return {
-                'total_messages': total_messages,
-                'ai_messages': ai_messages,
-                'at_messages': at_messages,
-                'movie_messages': movie_messages,
-                'active_users': active_users
+                'granularity': granularity,
+                'interval_seconds': interval,
+                'rolled_up_to_id': self.get_watermark('rollup_message_id', cursor),
+                'points': series
             }
             
         except sqlite3.Error as e:
-            print(f"获取用户统计失败: {str(e)}")
-            return {}
+            print(f"查询消息时间序列失败: {str(e)}")
+            return {'granularity': granularity, 'interval_seconds': interval, 'points': []}
         finally:
             conn.close()
     
@@ -623,158 +1949,716 @@ class DatabaseManager:
         finally:
             conn.close()
     
-    def cleanup_old_messages(self, days: int = 30) -> bool:
+    def cleanup_old_messages(self, days: int = 30, batch_size: int = 500,
+                             pause: float = 0.05, archive: str = None) -> bool:
         """
         清理过期的聊天消息
         
+        按批删除，每批一个短事务，批次之间暂停，避免长时间占用写锁阻塞新消息写入；
+        清理进度和吞吐量记录在 retention_status 中
+        
         Args:
             days: 保留天数
+            batch_size: 每批删除的消息数（不超过500）
+            pause: 批次之间暂停的秒数
+            archive: 删除前归档的位置，以.db结尾时归档到SQLite数据库，
+                     否则追加到gzip压缩的JSONL文件；为空时不归档
             
         Returns:
             bool: 成功返回True
         """
+        if not self._retention_lock.acquire(blocking=False):
+            print("保留期清理正在进行，跳过本次清理")
+            return False
+        batch_size = max(1, min(batch_size, 500))
+        status = {
+            'running': True,
+            'days': days,
+            'archive': archive,
+            'deleted': 0,
+            'batches': 0,
+            'started_at': datetime.now().isoformat(),
+            'finished_at': None,
+            'elapsed_seconds': 0.0,
+            'rows_per_second': 0.0,
+            'error': None
+        }
+        self.retention_status = status
+        started = time.monotonic()
+        archive_file = None
+        conn = None
+        
         try:
             conn = self.get_connection()
             cursor = conn.cursor()
-            
-            cursor.execute('''
-                DELETE FROM messages 
-                WHERE timestamp < datetime('now', '-{} days')
-            '''.format(days))
-            
-            deleted_count = cursor.rowcount
-            conn.commit()
-            
-            print(f"清理了 {deleted_count} 条过期消息")
+            cursor.execute("SELECT datetime('now', ?)", (f'-{int(days)} days',))
+            cutoff = cursor.fetchone()[0]
+            status['cutoff'] = cutoff
+            
+            if archive:
+                os.makedirs(os.path.dirname(os.path.abspath(archive)), exist_ok=True)
+            archive_to_db = bool(archive) and archive.endswith('.db')
+            if archive_to_db:
+                cursor.execute('ATTACH DATABASE ? AS archive', (archive,))
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS archive.messages AS
+                    SELECT {", ".join(EXPORT_COLUMNS)} FROM main.messages WHERE 0
+                ''')
+            elif archive:
+                # gzip允许多个压缩段首尾相接，追加写入后仍是合法的gzip文件
+                archive_file = gzip.open(archive, 'ab')
+            
+            while True:
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute(f'''
+                    SELECT {", ".join(EXPORT_COLUMNS)}, has_payload FROM main.messages
+                    WHERE timestamp < ?
+                    ORDER BY timestamp
+                    LIMIT ?
+                ''', (cutoff, batch_size))
+                rows = cursor.fetchall()
+                if not rows:
+                    conn.rollback()
+                    break
+                ids = [row['id'] for row in rows]
+                placeholders = ', '.join('?' * len(ids))
+                
+                if archive:
+                    # 归档完整内容
+                    messages = [dict(row) for row in rows]
+                    self._load_payloads(messages, conn)
+                if archive_to_db:
+                    cursor.executemany(f'''
+                        INSERT INTO archive.messages ({", ".join(EXPORT_COLUMNS)})
+                        VALUES ({", ".join("?" * len(EXPORT_COLUMNS))})
+                    ''', [tuple(message[column] for column in EXPORT_COLUMNS) for message in messages])
+                elif archive_file:
+                    # 先写入归档再提交删除，失败重试时最多产生重复归档，不会丢失消息
+                    archive_file.write(''.join(
+                        json.dumps({column: message[column] for column in EXPORT_COLUMNS},
+                                   ensure_ascii=False, default=str) + '\n'
+                        for message in messages).encode('utf-8'))
+                    archive_file.flush()
+                
+                self._forget_integrity_rows(cursor, ids)
+                cursor.execute(f'DELETE FROM main.messages WHERE id IN ({placeholders})', ids)
+                conn.commit()
+                
+                status['deleted'] += len(ids)
+                status['batches'] += 1
+                elapsed = time.monotonic() - started
+                status['elapsed_seconds'] = round(elapsed, 3)
+                status['rows_per_second'] = round(status['deleted'] / elapsed, 1) if elapsed else 0.0
+                
+                if len(rows) < batch_size:
+                    break
+                if pause > 0:
+                    time.sleep(pause)
+            
+            # 开启分区时，整月过期的分区直接按文件清理
+            if self.partitions:
+                status['partitions_dropped'] = self._drop_expired_partitions(cutoff, archive)
+            
+            print(f"清理了 {status['deleted']} 条过期消息")
             return True
             
-        except sqlite3.Error as e:
+        except (sqlite3.Error, OSError) as e:
+            if conn is not None and conn.in_transaction:
+                conn.rollback()
+            status['error'] = str(e)
             print(f"清理过期消息失败: {str(e)}")
             return False
+        finally:
+            if archive_file is not None:
+                archive_file.close()
+            if conn is not None:
+                conn.close()
+            elapsed = time.monotonic() - started
+            status['elapsed_seconds'] = round(elapsed, 3)
+            status['rows_per_second'] = round(status['deleted'] / elapsed, 1) if elapsed else 0.0
+            status['finished_at'] = datetime.now().isoformat()
+            status['running'] = False
+            self._retention_lock.release()
+    
+    def enable_partitioning(self, directory: str = 'partitions'):
+        """
+        开启按月分区存储：新消息仍写入主库，已结束的月份由 seal_partitions
+        移动到只读的月分区文件，查询按时间范围只打开需要的分区
+        
+        Args:
+            directory: 分区文件目录
+        """
+        self.partitions = MessagePartitions(directory, PARTITION_COLUMN_DEFAULTS)
+        print(f"消息分区存储已开启，分区目录: {directory}")
+    
+    def seal_partitions(self, keep_months: int = 1, batch_size: int = 500,
+                        pause: float = 0.05) -> Dict:
+        """
+        把主库中已结束月份的消息移动到月分区文件
+        
+        先把整月消息写入分区并校验条数，再分批从主库删除；中途失败后再次调用
+        会确认分区已包含剩余消息再继续删除，不会重复写入
+        
+        Args:
+            keep_months: 主库保留的最近月份数（包含当前月）
+            batch_size: 每批从主库删除的消息数（不超过500）
+            pause: 删除批次之间暂停的秒数
+            
+        Returns:
+            Dict: 月份 -> 移动的消息数
+        """
+        if not self.partitions:
+            print("未开启分区存储，跳过分区整理")
+            return {}
+        batch_size = max(1, min(batch_size, 500))
+        sealed = {}
+        
+        # 移动前先把这些消息计入汇总表
+        while self.compact_rollups() > 0:
+            pass
+        
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT datetime('now', 'start of month', ?)",
+                           (f'-{max(1, keep_months) - 1} months',))
+            cutoff = cursor.fetchone()[0]
+            
+            while True:
+                cursor.execute('SELECT MIN(timestamp) FROM messages')
+                oldest = cursor.fetchone()[0]
+                if not oldest or oldest >= cutoff:
+                    break
+                if not re.match(r'^\d{4}-\d{2}-', oldest):
+                    print(f"无法识别的消息时间格式: {oldest}，停止分区整理")
+                    break
+                month = oldest[:7]
+                moved = self._seal_month(conn, month, batch_size, pause)
+                if moved < 0:
+                    break
+                sealed[month] = moved
+                print(f"已将 {moved} 条 {month} 的消息移动到分区")
+            
+            return sealed
+            
+        except (sqlite3.Error, OSError) as e:
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"整理消息分区失败: {str(e)}")
+            return sealed
+        finally:
+            conn.close()
+    
+    def _seal_month(self, conn: sqlite3.Connection, month: str, batch_size: int,
+                    pause: float) -> int:
+        """
+        把一个月的消息写入分区后从主库删除
+        
+        Returns:
+            int: 移动的消息数，分区与主库不一致时返回-1
+        """
+        cursor = conn.cursor()
+        start, end = month_bounds(month)
+        cursor.execute('''
+            SELECT MIN(id), MAX(id), COUNT(*) FROM messages
+            WHERE timestamp >= ? AND timestamp < ?
+        ''', (start, end))
+        low, high, count = cursor.fetchone()
+        
+        if os.path.exists(self.partitions.path_for(month)):
+            # 上次移动未完成：确认主库剩余消息都已在分区中
+            cursor.execute('ATTACH DATABASE ? AS part', (self.partitions.path_for(month),))
+            try:
+                cursor.execute('''
+                    SELECT COUNT(*) FROM main.messages m
+                    WHERE m.timestamp >= ? AND m.timestamp < ?
+                      AND NOT EXISTS (SELECT 1 FROM part.messages p WHERE p.id = m.id)
+                ''', (start, end))
+                missing = cursor.fetchone()[0]
+            finally:
+                cursor.execute('DETACH DATABASE part')
+            if missing:
+                print(f"分区 {month} 已存在但缺少主库中的 {missing} 条消息，需要人工处理")
+                return -1
+        else:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'messages'")
+            table_sql = cursor.fetchone()[0]
+            cursor.execute('''
+                SELECT sql FROM sqlite_master
+                WHERE type = 'index' AND tbl_name = 'messages' AND sql IS NOT NULL
+            ''')
+            index_sqls = [row[0] for row in cursor.fetchall()]
+            
+            def chunks():
+                # 按ID分段读取，每段一个短查询，不长时间持有主库读锁
+                last_id = low - 1
+                while True:
+                    rows = conn.execute('''
+                        SELECT * FROM messages
+                        WHERE id > ? AND id <= ? AND timestamp >= ? AND timestamp < ?
+                        ORDER BY id LIMIT 5000
+                    ''', (last_id, high, start, end)).fetchall()
+                    if not rows:
+                        return
+                    yield rows
+                    last_id = rows[-1]['id']
+            
+            written = self.partitions.write_partition(month, table_sql, index_sqls, chunks())
+            if written != count:
+                os.chmod(self.partitions.path_for(month), 0o644)
+                os.remove(self.partitions.path_for(month))
+                print(f"分区 {month} 写入 {written} 条，与主库 {count} 条不一致，已放弃")
+                return -1
+        
+        # 分批从主库删除，事务内写入移动标记使计数器触发器不减计数
+        moved = 0
+        while True:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT id FROM messages WHERE timestamp >= ? AND timestamp < ? LIMIT ?
+            ''', (start, end, batch_size))
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                conn.rollback()
+                break
+            self._set_watermark(cursor, PARTITION_MOVE_FLAG, 1)
+            self._forget_integrity_rows(cursor, ids)
+            cursor.execute(f'DELETE FROM messages WHERE id IN ({", ".join("?" * len(ids))})', ids)
+            cursor.execute('DELETE FROM watermarks WHERE name = ?', (PARTITION_MOVE_FLAG,))
+            conn.commit()
+            moved += len(ids)
+            if pause > 0:
+                time.sleep(pause)
+        return moved
+    
+    def _drop_expired_partitions(self, cutoff: str, archive: str = None) -> int:
+        """
+        删除整月都早于截止时间的分区文件，指定归档位置时移动到归档目录
+        
+        Returns:
+            int: 处理的分区数
+        """
+        dropped = 0
+        for month in self.partitions.list_months():
+            if month_bounds(month)[1] > cutoff:
+                continue
+            path = self.partitions.path_for(month)
+            if self.stat_counters_enabled:
+                self._subtract_partition_counters(month)
+            self._delete_partition_payloads(month)
+            if archive:
+                archive_dir = os.path.dirname(os.path.abspath(archive))
+                os.makedirs(archive_dir, exist_ok=True)
+                os.replace(path, os.path.join(archive_dir, os.path.basename(path)))
+            else:
+                os.chmod(path, 0o644)
+                os.remove(path)
+            dropped += 1
+            print(f"已清理过期分区 {month}")
+        return dropped
+    
+    def _delete_partition_payloads(self, month: str):
+        """删除分区中消息在主库保存的大字段"""
+        part_conn = self.partitions.connect(month)
+        try:
+            ids = [row[0] for row in part_conn.execute('SELECT id FROM messages WHERE has_payload = 1')]
+        finally:
+            part_conn.close()
+        if not ids:
+            return
+        conn = self.get_connection()
+        try:
+            for index in range(0, len(ids), 500):
+                batch = ids[index:index + 500]
+                conn.execute(f'DELETE FROM message_payloads WHERE message_id IN ({", ".join("?" * len(batch))})',
+                             batch)
+                conn.commit()
+        finally:
+            conn.close()
+    
+    def _subtract_partition_counters(self, month: str):
+        """从计数器表中减去一个分区的消息数"""
+        part_conn = self.partitions.connect(month)
+        try:
+            rows = part_conn.execute('''
+                SELECT nickname, COUNT(*), SUM(is_ai_response = 1),
+                       SUM(is_at_message = 1), SUM(is_movie = 1)
+                FROM messages
+                GROUP BY nickname
+            ''').fetchall()
+        finally:
+            part_conn.close()
+        
+        conn = self.get_connection()
+        try:
+            totals = [0, 0, 0, 0]
+            updates = []
+            for row in rows:
+                values = [value or 0 for value in tuple(row)[1:]]
+                totals = [total + value for total, value in zip(totals, values)]
+                updates.append((*values, 'nickname', row[0]))
+            updates.append((*totals, 'global', ''))
+            conn.executemany('''
+                UPDATE message_counters SET
+                    total_messages = total_messages - ?,
+                    ai_messages = ai_messages - ?,
+                    at_messages = at_messages - ?,
+                    movie_messages = movie_messages - ?
+                WHERE scope = ? AND key = ?
+            ''', updates)
+            conn.commit()
         finally:
             conn.close()
     
-    def export_messages(self, filename: str = None, format: str = 'json') -> bool:
+    def iter_messages(self, start_time: str = None, end_time: str = None,
+                      room: str = None, chunk_size: int = 1000) -> Iterator[Dict]:
         """
-        导出聊天记录
+        按消息ID顺序逐批读取消息，内存占用与总量无关
+        
+        每批按上一批最后的ID续读并单独执行一次查询，批次之间不持有读锁，
+        长时间导出不会阻塞新消息写入；开启分区时先从旧到新读取时间范围涉及的分区
+        
+        Args:
+            start_time: 开始时间
+            end_time: 结束时间
+            room: 按聊天室过滤，为空时导出所有聊天室
+            chunk_size: 每批读取的消息数
+            
+        Yields:
+            Dict: 消息字典
+        """
+        where_conditions = ["id > ?"]
+        params = []
+        if room:
+            where_conditions.append("room = ?")
+            params.append(room)
+        if start_time:
+            where_conditions.append("timestamp >= ?")
+            params.append(start_time)
+        if end_time:
+            where_conditions.append("timestamp <= ?")
+            params.append(end_time)
+        sql = f'''
+            SELECT {", ".join(EXPORT_COLUMNS)}, has_payload
+            FROM messages
+            WHERE {" AND ".join(where_conditions)}
+            ORDER BY id
+            LIMIT ?
+        '''
+        
+        def read_chunks(conn):
+            last_id = 0
+            while True:
+                cursor = conn.execute(sql, (last_id, *params, chunk_size))
+                rows = cursor.fetchmany(chunk_size)
+                cursor.close()
+                messages = [dict(row) for row in rows]
+                self._load_payloads(messages)
+                for message in messages:
+                    del message['has_payload']
+                    yield message
+                if len(rows) < chunk_size:
+                    break
+                last_id = rows[-1]['id']
+        
+        months = self.partitions.months_for_range(start_time, end_time) if self.partitions else []
+        for month in reversed(months):
+            conn = self.partitions.connect(month)
+            try:
+                yield from read_chunks(conn)
+            finally:
+                conn.close()
+        
+        conn = self.get_connection()
+        try:
+            yield from read_chunks(conn)
+        finally:
+            conn.close()
+    
+    def iter_export(self, format: str = 'jsonl', compress: bool = False,
+                    start_time: str = None, end_time: str = None,
+                    room: str = None, chunk_size: int = 1000) -> Iterator[bytes]:
+        """
+        流式生成导出内容
+        
+        Args:
+            format: 导出格式 ('json'、'jsonl' 或 'csv')
+            compress: 是否gzip压缩
+            start_time: 开始时间
+            end_time: 结束时间
+            room: 按聊天室过滤
+            chunk_size: 每批读取的消息数，每批产生一个数据块
+            
+        Yields:
+            bytes: 导出数据块
+        """
+        format = format.lower()
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {format}")
+        
+        def encode_chunks():
+            buffer = io.StringIO()
+            writer = None
+            if format == 'csv':
+                writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+                writer.writeheader()
+            elif format == 'json':
+                buffer.write('[')
+            count = 0
+            for message in self.iter_messages(start_time, end_time, room, chunk_size):
+                if format == 'csv':
+                    writer.writerow(message)
+                elif format == 'jsonl':
+                    buffer.write(json.dumps(message, ensure_ascii=False, default=str))
+                    buffer.write('\n')
+                else:
+                    buffer.write(',\n' if count else '\n')
+                    buffer.write(json.dumps(message, ensure_ascii=False, default=str))
+                count += 1
+                if count % chunk_size == 0:
+                    yield buffer.getvalue().encode('utf-8')
+                    buffer.seek(0)
+                    buffer.truncate()
+            if format == 'json':
+                buffer.write('\n]\n')
+            yield buffer.getvalue().encode('utf-8')
+        
+        if not compress:
+            yield from encode_chunks()
+            return
+        
+        # wbits=31 生成带gzip文件头的压缩流
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in encode_chunks():
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    
+    def export_messages(self, filename: str = None, format: str = 'json',
+                        start_time: str = None, end_time: str = None,
+                        room: str = None, compress: bool = None) -> bool:
+        """
+        导出聊天记录（流式写入，不限制条数）
         
         Args:
             filename: 导出文件名
-            format: 导出格式 ('json' 或 'csv')
+            format: 导出格式 ('json'、'jsonl' 或 'csv')
+            start_time: 开始时间
+            end_time: 结束时间
+            room: 按聊天室过滤，为空时导出所有聊天室
+            compress: 是否gzip压缩，默认根据文件名是否以.gz结尾判断
             
         Returns:
             bool: 成功返回True
         """
         try:
+            if compress is None:
+                compress = bool(filename) and filename.endswith('.gz')
             if not filename:
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"chat_messages_{timestamp}.{format}"
-            
-            messages = self.get_messages(limit=10000)  # 最多导出1万条记录
+                filename = f"chat_messages_{timestamp}.{format}" + ('.gz' if compress else '')
             
-            if format.lower() == 'json':
-                with open(filename, 'w', encoding='utf-8') as f:
-                    json.dump(messages, f, ensure_ascii=False, indent=2, default=str)
-            elif format.lower() == 'csv':
-                import csv
-                with open(filename, 'w', newline='', encoding='utf-8') as f:
-                    if messages:
-                        writer = csv.DictWriter(f, fieldnames=messages[0].keys())
-                        writer.writeheader()
-                        writer.writerows(messages)
+            # 先写临时文件，完成后再替换，避免中途失败留下不完整的导出
+            temp_filename = f"{filename}.part"
+            with open(temp_filename, 'wb') as f:
+                for chunk in self.iter_export(format, compress, start_time, end_time, room):
+                    f.write(chunk)
+            os.replace(temp_filename, filename)
             
             print(f"聊天记录已导出到: {filename}")
             return True
             
         except Exception as e:
             print(f"导出记录失败: {str(e)}")
+            if 'temp_filename' in locals() and os.path.exists(temp_filename):
+                os.remove(temp_filename)
             return False
-        finally:
-            pass
     
-    def check_data_integrity(self) -> Dict:
+    def check_data_integrity(self, full: bool = False, batch_size: int = 50000) -> Dict:
         """
         检查数据完整性
-        
+
+        默认只检查上次检查之后新增的消息和会话（按主键水位），发现的问题数累加保存，
+        耗时与新增数据量成正比；清理过期消息和整理分区删除已检查过的消息时从累计数中减去；
+        full=True 时从头全量检查、重新计数并执行 PRAGMA quick_check。
+        每批是一次按主键范围的短查询，批次之间不持有读锁。结果缓存在 integrity_status 中
+
+        Args:
+            full: 是否全量检查
+            batch_size: 每批检查的主键范围
+
         Returns:
             Dict: 完整性检查结果
         """
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            issues = []
-            
-            # 检查孤儿消息（没有对应会话的消息）
-            cursor.execute('''
-                SELECT COUNT(*) as count
-                FROM messages m
-                LEFT JOIN user_sessions s ON m.session_id = s.session_id
-                WHERE s.session_id IS NULL AND m.session_id IS NOT NULL
-            ''')
-            orphan_messages = cursor.fetchone()['count']
-            if orphan_messages > 0:
-                issues.append(f"发现 {orphan_messages} 条孤儿消息")
-            
-            # 检查重复会话
-            cursor.execute('''
-                SELECT COUNT(*) as count FROM (
-                    SELECT session_id, COUNT(*) as cnt
+        with self._integrity_lock:
+            started = time.monotonic()
+            conn = None
+            try:
+                conn = self.get_connection()
+                cursor = conn.cursor()
+
+                if full:
+                    message_mark = session_mark = 0
+                else:
+                    message_mark = self.get_watermark('integrity_message_id', cursor)
+                    session_mark = self.get_watermark('integrity_session_id', cursor)
+                # 本次检查新发现的问题数，最后在一个事务中累加到保存的计数上，
+                # 检查期间清理消息减去的计数不会被覆盖
+                totals = {key: 0 for key in INTEGRITY_COUNTERS}
+                checked_messages = checked_sessions = 0
+
+                # 孤儿消息（没有对应会话的消息）和过长的消息
+                max_message_id = cursor.execute('SELECT MAX(id) FROM messages').fetchone()[0] or 0
+                while message_mark < max_message_id:
+                    upper = min(message_mark + batch_size, max_message_id)
+                    row = cursor.execute(f'''
+                        SELECT
+                            COUNT(*) AS checked,
+                            SUM(CASE WHEN m.session_id IS NOT NULL AND NOT EXISTS (
+                                SELECT 1 FROM user_sessions s WHERE s.session_id = m.session_id
+                            ) THEN 1 ELSE 0 END) AS orphans,
+                            SUM(CASE WHEN {MESSAGE_LENGTH_SQL} > 4000 THEN 1 ELSE 0 END) AS long_messages
+                        FROM messages m
+                        WHERE m.id > ? AND m.id <= ?
+                    ''', (message_mark, upper)).fetchone()
+                    checked_messages += row['checked']
+                    totals['orphan_messages'] += row['orphans'] or 0
+                    totals['long_messages'] += row['long_messages'] or 0
+                    message_mark = upper
+
+                # 重复会话：新会话的 session_id 在更早的会话中出现过
+                max_session_id = cursor.execute('SELECT MAX(id) FROM user_sessions').fetchone()[0] or 0
+                while session_mark < max_session_id:
+                    upper = min(session_mark + batch_size, max_session_id)
+                    row = cursor.execute('''
+                        SELECT
+                            COUNT(*) AS checked,
+                            SUM(CASE WHEN EXISTS (
+                                SELECT 1 FROM user_sessions o
+                                WHERE o.session_id = s.session_id AND o.id < s.id
+                            ) THEN 1 ELSE 0 END) AS duplicates
+                        FROM user_sessions s
+                        WHERE s.id > ? AND s.id <= ?
+                    ''', (session_mark, upper)).fetchone()
+                    checked_sessions += row['checked']
+                    totals['duplicate_sessions'] += row['duplicates'] or 0
+                    session_mark = upper
+
+                # 会话活跃性是当前状态，每次都重新统计（走 status 索引）
+                cursor.execute('''
+                    SELECT COUNT(*) as count
                     FROM user_sessions
-                    GROUP BY session_id
-                    HAVING cnt > 1
-                )
-            ''')
-            duplicate_sessions = cursor.fetchone()['count']
-            if duplicate_sessions > 0:
-                issues.append(f"发现 {duplicate_sessions} 个重复会话")
-            
-            # 检查消息长度
-            cursor.execute('''
-                SELECT COUNT(*) as count
-                FROM messages
-                WHERE LENGTH(message) > 4000
-            ''')
-            long_messages = cursor.fetchone()['count']
-            if long_messages > 0:
-                issues.append(f"发现 {long_messages} 条过长的消息")
-            
-            # 检查会话活跃性
-            cursor.execute('''
-                SELECT COUNT(*) as count
-                FROM user_sessions
-                WHERE status = 'active' AND last_activity < datetime('now', '-24 hours')
-            ''')
-            stale_sessions = cursor.fetchone()['count']
-            if stale_sessions > 0:
-                issues.append(f"发现 {stale_sessions} 个超过24小时未活跃的会话")
-            
-            return {
-                'status': 'healthy' if not issues else 'warning',
-                'issues': issues,
-                'check_time': datetime.now().isoformat()
-            }
-            
-        except sqlite3.Error as e:
-            print(f"数据完整性检查失败: {str(e)}")
-            return {
-                'status': 'error',
-                'issues': [f"检查失败: {str(e)}"],
-                'check_time': datetime.now().isoformat()
-            }
-        finally:
-            conn.close()
-    
-    def backup_database(self, backup_dir: str = "backups") -> bool:
+                    WHERE status = 'active' AND last_activity < datetime('now', '-24 hours')
+                ''')
+                stale_sessions = cursor.fetchone()['count']
+
+                cursor.execute('BEGIN IMMEDIATE')
+                self._set_watermark(cursor, 'integrity_message_id', message_mark)
+                self._set_watermark(cursor, 'integrity_session_id', session_mark)
+                for key, value in totals.items():
+                    if full:
+                        self._set_watermark(cursor, f'integrity_{key}', value)
+                    else:
+                        self._add_watermark(cursor, f'integrity_{key}', value)
+                        totals[key] = self.get_watermark(f'integrity_{key}', cursor)
+                conn.commit()
+
+                issues = []
+                if full:
+                    quick_check = [row[0] for row in cursor.execute('PRAGMA quick_check').fetchall()]
+                    if quick_check != ['ok']:
+                        issues.extend(f"数据库文件校验: {message}" for message in quick_check[:10])
+                if totals['orphan_messages'] > 0:
+                    issues.append(f"发现 {totals['orphan_messages']} 条孤儿消息")
+                if totals['duplicate_sessions'] > 0:
+                    issues.append(f"发现 {totals['duplicate_sessions']} 个重复会话")
+                if totals['long_messages'] > 0:
+                    issues.append(f"发现 {totals['long_messages']} 条过长的消息")
+                if stale_sessions > 0:
+                    issues.append(f"发现 {stale_sessions} 个超过24小时未活跃的会话")
+
+                result = {
+                    'status': 'healthy' if not issues else 'warning',
+                    'issues': issues,
+                    'check_time': datetime.now().isoformat(),
+                    'mode': 'full' if full else 'incremental',
+                    'checked_messages': checked_messages,
+                    'checked_sessions': checked_sessions,
+                    'message_watermark': message_mark,
+                    'session_watermark': session_mark,
+                    'counts': dict(totals, stale_sessions=stale_sessions),
+                    'elapsed_seconds': round(time.monotonic() - started, 3)
+                }
+
+            except sqlite3.Error as e:
+                if conn is not None and conn.in_transaction:
+                    conn.rollback()
+                print(f"数据完整性检查失败: {str(e)}")
+                result = {
+                    'status': 'error',
+                    'issues': [f"检查失败: {str(e)}"],
+                    'check_time': datetime.now().isoformat(),
+                    'mode': 'full' if full else 'incremental'
+                }
+            finally:
+                if conn is not None:
+                    conn.close()
+
+            self.integrity_status = result
+            return result
+
+    def get_integrity_status(self) -> Dict:
+        """
+        获取最近一次完整性检查的缓存结果，供健康检查页面频繁轮询；
+        启动后还没有检查过时返回 pending，不在请求线程中执行检查
+
+        Returns:
+            Dict: 完整性检查结果
         """
-        备份数据库
+        return self.integrity_status or {'status': 'pending'}
+
+    def backup_database(self, backup_dir: str = "backups", pages: int = 256,
+                        step_sleep: float = 0.01, compress: bool = True,
+                        keep: int = None, max_restarts: int = 5) -> bool:
+        """
+        在线备份数据库
+        
+        每次只复制 pages 页并暂停 step_sleep 秒，让写入有机会获得锁；
+        备份期间其他连接修改数据库会使SQLite从头重新复制，重启超过
+        max_restarts 次后改为一次复制完剩余部分。进度记录在 backup_status 中。
+        分区文件只读不变，直接复制即可，不在此备份
         
         Args:
             backup_dir: 备份目录
+            pages: 每步复制的页数
+            step_sleep: 每步之间暂停的秒数
+            compress: 是否gzip压缩备份文件
+            keep: 保留最近的备份数量，为空时不清理旧备份
+            max_restarts: 分页复制允许的最大重启次数
             
         Returns:
             bool: 成功返回True
         """
+        if not self._backup_lock.acquire(blocking=False):
+            print("数据库备份正在进行，跳过本次备份")
+            return False
+        status = {
+            'running': True,
+            'path': None,
+            'total_pages': 0,
+            'remaining_pages': 0,
+            'percent': 0.0,
+            'restarts': 0,
+            'started_at': datetime.now().isoformat(),
+            'finished_at': None,
+            'elapsed_seconds': 0.0,
+            'error': None
+        }
+        self.backup_status = status
+        started = time.monotonic()
+        temp_path = None
+        
         try:
             if not os.path.exists(backup_dir):
                 os.makedirs(backup_dir)
@@ -782,56 +2666,163 @@ class DatabaseManager:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_filename = f"backup_{timestamp}.db"
             backup_path = os.path.join(backup_dir, backup_filename)
+            temp_path = f"{backup_path}.part"
+            
+            def progress(_, remaining, total):
+                # 剩余页数变多说明源库被修改，备份从头重新开始
+                if status['total_pages'] and remaining > status['remaining_pages']:
+                    status['restarts'] += 1
+                    if status['restarts'] > max_restarts:
+                        raise _BackupRestartLimit()
+                status['total_pages'] = total
+                status['remaining_pages'] = remaining
+                status['percent'] = round((total - remaining) / total * 100, 1) if total else 100.0
+                if remaining and step_sleep > 0:
+                    time.sleep(step_sleep)
             
             # 使用SQLite的备份API
             source = sqlite3.connect(self.db_path)
-            backup = sqlite3.connect(backup_path)
-            
-            with backup:
-                source.backup(backup)
-            
-            source.close()
-            backup.close()
+            backup = sqlite3.connect(temp_path)
+            try:
+                try:
+                    source.backup(backup, pages=pages, progress=progress)
+                except _BackupRestartLimit:
+                    print("备份期间数据库持续被修改，改为一次复制剩余部分")
+                    source.backup(backup)
+                status['remaining_pages'] = 0
+                status['percent'] = 100.0
+                
+                if backup.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+                    raise sqlite3.DatabaseError("备份文件校验失败")
+            finally:
+                source.close()
+                backup.close()
+            
+            if compress:
+                # 压缩时不再占用数据库
+                backup_path += '.gz'
+                with open(temp_path, 'rb') as f_in, gzip.open(f"{backup_path}.part", 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+                os.remove(temp_path)
+                temp_path = f"{backup_path}.part"
+            os.replace(temp_path, backup_path)
+            temp_path = None
+            status['path'] = backup_path
+            status['size_bytes'] = os.path.getsize(backup_path)
+            
+            if keep:
+                status['removed'] = self._prune_backups(backup_dir, keep)
             
             print(f"数据库备份成功: {backup_path}")
             return True
             
         except Exception as e:
+            status['error'] = str(e)
             print(f"数据库备份失败: {str(e)}")
             return False
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            status['elapsed_seconds'] = round(time.monotonic() - started, 3)
+            status['finished_at'] = datetime.now().isoformat()
+            status['running'] = False
+            self._backup_lock.release()
+    
+    def list_backups(self, backup_dir: str = "backups") -> List[Dict]:
+        """
+        列出备份文件（从新到旧）
+        
+        Args:
+            backup_dir: 备份目录
+            
+        Returns:
+            List[Dict]: 备份文件名、路径和大小
+        """
+        if not os.path.isdir(backup_dir):
+            return []
+        backups = []
+        for filename in sorted(os.listdir(backup_dir), reverse=True):
+            if BACKUP_FILE_PATTERN.match(filename):
+                path = os.path.join(backup_dir, filename)
+                backups.append({'name': filename, 'path': path, 'size_bytes': os.path.getsize(path)})
+        return backups
     
-    def restore_database(self, backup_path: str) -> bool:
+    def _prune_backups(self, backup_dir: str, keep: int) -> List[str]:
+        """只保留最近 keep 个备份，返回删除的文件名"""
+        removed = []
+        for backup in self.list_backups(backup_dir)[keep:]:
+            os.remove(backup['path'])
+            removed.append(backup['name'])
+        if removed:
+            print(f"已删除旧备份: {', '.join(removed)}")
+        return removed
+    
+    def restore_database(self, backup_path: str, drain_timeout: float = 30.0) -> bool:
         """
         从备份恢复数据库
         
+        先把备份（支持.gz）解压到数据库所在目录并校验，然后阻止新连接、等待已打开的
+        连接全部关闭，再用原子改名替换数据库文件，当前数据库改名保留
+        
         Args:
             backup_path: 备份文件路径
+            drain_timeout: 等待已打开连接关闭的最长秒数
             
         Returns:
             bool: 成功返回True
         """
+        temp_path = f"{self.db_path}.restore_tmp"
         try:
             if not os.path.exists(backup_path):
                 print(f"备份文件不存在: {backup_path}")
                 return False
             
-            # 创建当前数据库的备份
-            if os.path.exists(self.db_path):
-                backup_current = f"{self.db_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                import shutil
-                shutil.copy2(self.db_path, backup_current)
-                print(f"当前数据库已备份到: {backup_current}")
-            
-            # 恢复备份
-            import shutil
-            shutil.copy2(backup_path, self.db_path)
-            
+            # 在数据库同目录准备恢复文件，保证改名是同一文件系统内的原子操作
+            opener = gzip.open if backup_path.endswith('.gz') else open
+            with opener(backup_path, 'rb') as f_in, open(temp_path, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+            check = sqlite3.connect(temp_path)
+            try:
+                if check.execute('PRAGMA quick_check').fetchone()[0] != 'ok':
+                    raise sqlite3.DatabaseError("备份文件校验失败")
+                check.execute('SELECT COUNT(*) FROM messages LIMIT 1')
+            finally:
+                check.close()
+            
+            with self._connection_gate:
+                self._restoring = True
+                drained = self._connection_gate.wait_for(
+                    lambda: self._active_connections <= 0, timeout=drain_timeout)
+                if not drained:
+                    self._restoring = False
+                    self._connection_gate.notify_all()
+                    print(f"仍有 {self._active_connections} 个数据库连接未关闭，放弃恢复")
+                    return False
+                try:
+                    if os.path.exists(self.db_path):
+                        backup_current = f"{self.db_path}.backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                        os.replace(self.db_path, backup_current)
+                        print(f"当前数据库已备份到: {backup_current}")
+                    # 旧数据库遗留的日志文件不能应用到恢复后的数据库
+                    for suffix in ('-journal', '-wal', '-shm'):
+                        if os.path.exists(self.db_path + suffix):
+                            os.remove(self.db_path + suffix)
+                    os.replace(temp_path, self.db_path)
+                finally:
+                    self._restoring = False
+                    self._connection_gate.notify_all()
+            
+            # 恢复的备份可能来自旧版本，补齐表结构并重新检测计数器状态
+            self.init_database()
             print(f"数据库恢复成功: {self.db_path}")
             return True
             
         except Exception as e:
             print(f"数据库恢复失败: {str(e)}")
             return False
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
     
     def migrate_data(self, target_version: str = "1.1") -> bool:
         """
@@ -931,7 +2922,8 @@ class DatabaseManager:
             # 重建索引
             cursor.execute("REINDEX")
             
-            # 清理数据库
+            # 清理数据库，同时切换为增量回收模式，之后由维护任务分批回收空闲页
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
             cursor.execute("VACUUM")
             
             # 分析表统计信息
@@ -947,6 +2939,106 @@ class DatabaseManager:
         finally:
             conn.close()
     
+    def get_load(self) -> Dict:
+        """
+        获取数据库当前负载，供后台维护任务判断是否需要让路
+        
+        Returns:
+            Dict: 打开中的连接数和写锁是否被占用
+        """
+        with self._connection_gate:
+            active = self._active_connections
+            restoring = self._restoring
+        if restoring:
+            return {'active_connections': active, 'write_locked': True}
+        write_locked = False
+        try:
+            # 不等待地尝试获取写锁：拿不到说明有写事务正在进行
+            conn = sqlite3.connect(self.db_path, timeout=0, isolation_level=None)
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.execute('ROLLBACK')
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            write_locked = True
+        return {
+            'active_connections': active,
+            'write_locked': write_locked
+        }
+    
+    def optimize_statistics(self) -> bool:
+        """
+        执行 PRAGMA optimize，只对统计信息过时的表重新 ANALYZE
+        
+        Returns:
+            bool: 成功返回True
+        """
+        try:
+            conn = self.get_connection()
+            conn.execute('PRAGMA optimize')
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"更新统计信息失败: {str(e)}")
+            return False
+        finally:
+            conn.close()
+    
+    def incremental_vacuum(self, max_pages: int = 1000) -> Dict:
+        """
+        回收最多 max_pages 个空闲页，只持有很短时间的写锁
+        
+        Args:
+            max_pages: 本次最多回收的页数
+            
+        Returns:
+            Dict: 回收前后的空闲页数；数据库未开启增量回收时 skipped 为True，出错时包含 error
+        """
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            # 0=NONE 1=FULL 2=INCREMENTAL
+            mode = cursor.execute('PRAGMA auto_vacuum').fetchone()[0]
+            before = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+            if mode != 2:
+                return {'skipped': True, 'reason': 'auto_vacuum 未设为 INCREMENTAL', 'freelist_pages': before}
+            cursor.execute(f'PRAGMA incremental_vacuum({int(max_pages)})').fetchall()
+            conn.commit()
+            after = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+            return {'skipped': False, 'freelist_pages': after, 'freed_pages': before - after}
+        except sqlite3.Error as e:
+            print(f"增量回收空闲页失败: {str(e)}")
+            return {'skipped': True, 'error': str(e)}
+        finally:
+            conn.close()
+    
+    def checkpoint_wal(self, mode: str = 'PASSIVE') -> Dict:
+        """
+        执行WAL检查点，把WAL中的页写回数据库文件
+        
+        Args:
+            mode: PASSIVE（不等待读者和写者）、FULL、RESTART 或 TRUNCATE
+            
+        Returns:
+            Dict: 检查点结果；数据库不是WAL模式时 skipped 为True，出错时包含 error
+        """
+        if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+            raise ValueError(f"未知的检查点模式: {mode}")
+        try:
+            conn = self.get_connection()
+            journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+            if journal_mode != 'wal':
+                return {'skipped': True, 'journal_mode': journal_mode}
+            busy, log_frames, checkpointed = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+            return {'skipped': False, 'busy': bool(busy), 'log_frames': log_frames,
+                    'checkpointed_frames': checkpointed}
+        except sqlite3.Error as e:
+            print(f"WAL检查点失败: {str(e)}")
+            return {'skipped': True, 'error': str(e)}
+        finally:
+            conn.close()
+    
     def get_database_stats(self) -> Dict:
         """
         获取数据库统计信息
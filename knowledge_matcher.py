@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+川小农知识库关键词匹配模块
+启动时把所有条目的关键词和同义词编译成一个 Aho–Corasick 自动机，
+对问题只扫描一遍即可找出全部命中的关键词，再按权重给条目打分。
+匹配耗时只与问题长度有关，知识库条目增多时基本不变
+"""
+
+import json
+import threading
+import unicodedata
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 同义词和标题的默认权重
+SYNONYM_WEIGHT = 1.0
+TITLE_WEIGHT = 2.0
+# 条目得分低于该值时不算命中。知识库中单个关键词的权重最高为3，该值比它大，
+# 至少要命中两个关键词才给出答案，避免问题只提到“雅安”“都江堰”之类的地名就答非所问
+MIN_SCORE = 3.5
+# 助手知识库的关键词是助手自己整词匹配的主题词（没有权重），命中一个就应回答，
+# 权重高于 MIN_SCORE 和本地知识库文件中单个关键词的权重，不会被文件中的条目遮盖
+ASSISTANT_KEYWORD_WEIGHT = 4.0
+
+
+def normalize(text: str) -> str:
+    """全角转半角、转小写"""
+    return unicodedata.normalize('NFKC', str(text or '')).lower()
+
+
+class AhoCorasick:
+    """多模式字符串匹配自动机"""
+
+    def __init__(self, patterns: Iterable[str]):
+        """
+        构建自动机
+
+        Args:
+            patterns: 模式串列表，匹配结果中用下标表示模式串
+        """
+        self.patterns = list(patterns)
+        # 每个状态的转移表、失败指针和输出（以该状态结尾的模式串下标）
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[Tuple[int, ...]] = [()]
+        own: List[List[int]] = [[]]
+        for index, pattern in enumerate(self.patterns):
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                    own.append([])
+                state = next_state
+            own[state].append(index)
+
+        # 按层次遍历计算失败指针，并把失败链上的输出合并进来，匹配时无需再沿失败链收集
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._output[state] = tuple(own[state])
+        while queue:
+            state = queue.popleft()
+            for char, child in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = tuple(own[child]) + self._output[self._fail[child]]
+                queue.append(child)
+
+    @property
+    def states(self) -> int:
+        return len(self._goto)
+
+    def find_all(self, text: str) -> List[Tuple[int, int]]:
+        """
+        扫描一遍文本，返回所有命中
+
+        Returns:
+            List[Tuple[int, int]]: (结束位置, 模式串下标)
+        """
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        hits = []
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                hits.extend((position, index) for index in output[state])
+        return hits
+
+
+class KnowledgeMatcher:
+    """基于 Aho–Corasick 自动机的知识库条目匹配器"""
+
+    def __init__(self, entries: List[Dict], min_score: float = MIN_SCORE):
+        """
+        初始化匹配器
+
+        Args:
+            entries: 知识库条目（含 id、title、keywords、synonyms、answer），
+                     keywords 可以是 {关键词: 权重} 或关键词列表
+            min_score: 最低命中得分
+        """
+        self.entries = [entry for entry in entries if entry.get('answer')]
+        self.min_score = min_score
+        self._lock = threading.Lock()
+        self.stats = {'queries': 0, 'hits': 0}
+
+        # 规范化后的关键词 -> [(条目下标, 权重)]，同一个词可以属于多个条目
+        targets: Dict[str, List[Tuple[int, float]]] = {}
+
+        def add(term, entry_index, weight):
+            term = normalize(term).strip()
+            if not term:
+                return
+            postings = targets.setdefault(term, [])
+            for position, (index, current) in enumerate(postings):
+                if index == entry_index:
+                    postings[position] = (index, max(current, weight))
+                    return
+            postings.append((entry_index, weight))
+
+        for entry_index, entry in enumerate(self.entries):
+            keywords = entry.get('keywords') or {}
+            if not isinstance(keywords, dict):
+                keywords = {keyword: 1.0 for keyword in keywords}
+            for keyword, weight in keywords.items():
+                add(keyword, entry_index, float(weight))
+            for synonym in entry.get('synonyms') or []:
+                add(synonym, entry_index, SYNONYM_WEIGHT)
+            if entry.get('title'):
+                add(entry['title'], entry_index, TITLE_WEIGHT)
+
+        terms = list(targets)
+        self._targets = [targets[term] for term in terms]
+        self.automaton = AhoCorasick(terms)
+
+    def match(self, question: str, limit: int = 3) -> List[Dict]:
+        """
+        匹配问题
+
+        Args:
+            question: 用户问题
+            limit: 最多返回的条目数
+
+        Returns:
+            List[Dict]: 按得分从高到低的 {id、title、answer、score、matched}
+        """
+        scores: Dict[int, float] = {}
+        matched: Dict[int, List[str]] = {}
+        # 同一个关键词在问题中出现多次只计一次
+        for index in {index for _, index in self.automaton.find_all(normalize(question))}:
+            term = self.automaton.patterns[index]
+            for entry_index, weight in self._targets[index]:
+                scores[entry_index] = scores.get(entry_index, 0.0) + weight
+                matched.setdefault(entry_index, []).append(term)
+
+        ranked = sorted(
+            (item for item in scores.items() if item[1] >= self.min_score),
+            key=lambda item: (-item[1], -len(matched[item[0]]), item[0]))
+        results = []
+        for entry_index, score in ranked[:limit]:
+            entry = self.entries[entry_index]
+            results.append({
+                'id': entry.get('id'),
+                'title': entry.get('title'),
+                'answer': entry['answer'],
+                'score': score,
+                'matched': sorted(matched[entry_index]),
+            })
+        with self._lock:
+            self.stats['queries'] += 1
+            if results:
+                self.stats['hits'] += 1
+        return results
+
+    def answer(self, question: str) -> Optional[str]:
+        """返回得分最高条目的答案，没有命中返回None"""
+        results = self.match(question, 1)
+        return results[0]['answer'] if results else None
+
+    def get_stats(self) -> Dict:
+        """获取匹配统计信息"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats['entries'] = len(self.entries)
+        stats['keywords'] = len(self.automaton.patterns)
+        stats['states'] = self.automaton.states
+        return stats
+
+
+def load_entries(path: str) -> List[Dict]:
+    """读取知识库JSON文件，文件不存在或格式错误时返回空列表"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError) as e:
+        print(f"读取知识库失败: {str(e)}")
+        return []
+    return entries if isinstance(entries, list) else []
+
+
+def entries_from_assistant(assistant) -> List[Dict]:
+    """
+    把助手对象上的 knowledge_base 转换成条目列表
+
+    支持 {关键词: 答案}、{名称: {keywords, answer/response}} 和条目列表三种形式，
+    没有权重的关键词按 ASSISTANT_KEYWORD_WEIGHT 计分。没有 knowledge_base 属性时返回空列表
+    """
+    def weighted(keywords):
+        if isinstance(keywords, dict):
+            return keywords
+        return {keyword: ASSISTANT_KEYWORD_WEIGHT for keyword in keywords or []}
+
+    knowledge_base = getattr(assistant, 'knowledge_base', None)
+    if isinstance(knowledge_base, list):
+        return [dict(entry, keywords=weighted(entry.get('keywords')))
+                for entry in knowledge_base if isinstance(entry, dict)]
+    if not isinstance(knowledge_base, dict):
+        return []
+    entries = []
+    for name, value in knowledge_base.items():
+        if isinstance(value, str):
+            entries.append({'id': name, 'title': name, 'keywords': weighted([name]), 'answer': value})
+        elif isinstance(value, dict):
+            entries.append({
+                'id': name,
+                'title': value.get('title', name),
+                'keywords': weighted(value.get('keywords') or [name]),
+                'synonyms': value.get('synonyms') or [],
+                'answer': value.get('answer') or value.get('response') or value.get('content'),
+            })
+    return entries
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+川小农知识库本地检索模块
+对知识库条目（标题、关键词、同义词、答案）建立 BM25 索引，按汉字单字、二元组和英文数字词切分。
+最相关条目的置信度超过阈值、并且问题命中了它的标题、关键词或同义词时直接用它回答，否则把排名靠前的条目作为参考资料交给大模型。
+安装了 NumPy 时用 bincount 一次累加所有查询词的倒排表，否则退回纯Python实现
+"""
+
+import math
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from knowledge_matcher import normalize
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 置信度（最高得分占查询理想得分的比例）达到该值时直接回答
+DEFAULT_THRESHOLD = 0.3
+# 置信度低于该值的条目不作为参考资料，避免寒暄和无关问题带上不相干的资料
+GROUNDING_THRESHOLD = 0.13
+# 同时要求领先第二名的倍数，两个条目难分高下时交给大模型
+DEFAULT_MARGIN = 1.3
+_TOKEN_PATTERN = re.compile(r'[0-9a-z]+|[一-鿿]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """切分为英文数字词、汉字单字和汉字二元组"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(normalize(text)):
+        if not '一' <= run[0] <= '鿿':
+            tokens.append(run)
+            continue
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def entry_terms(entry: Dict) -> List[str]:
+    """条目的标题、关键词和同义词"""
+    keywords = entry.get('keywords') or []
+    terms = [entry.get('title') or '']
+    terms.extend(keywords.keys() if isinstance(keywords, dict) else keywords)
+    terms.extend(entry.get('synonyms') or [])
+    return [normalize(term).strip() for term in terms if str(term or '').strip()]
+
+
+def entry_text(entry: Dict) -> str:
+    """条目参与检索的文本"""
+    return ' '.join(entry_terms(entry) + [str(entry.get('answer') or '')])
+
+
+class BM25Index:
+    """知识库条目的 BM25 倒排索引"""
+
+    def __init__(self, entries: List[Dict], k1: float = BM25_K1, b: float = BM25_B):
+        """
+        构建索引
+
+        Args:
+            entries: 知识库条目（含 id、title、answer 等字段）
+            k1: 词频饱和参数
+            b: 文档长度归一化参数
+        """
+        self.entries = [entry for entry in entries if entry.get('answer')]
+        self.k1 = k1
+        self._terms = [entry_terms(entry) for entry in self.entries]
+        documents = [tokenize(entry_text(entry)) for entry in self.entries]
+        count = len(documents)
+        average_length = sum(len(tokens) for tokens in documents) / count if count else 0.0
+
+        frequencies: Dict[str, Dict[int, int]] = {}
+        for doc_index, tokens in enumerate(documents):
+            for token in tokens:
+                posting = frequencies.setdefault(token, {})
+                posting[doc_index] = posting.get(doc_index, 0) + 1
+
+        self._max_idf = math.log(1 + (count + 0.5) / 0.5)
+        # 词 -> (idf, [(条目下标, BM25词权重)])，词权重在建索引时算好，查询时只做累加
+        self.idf: Dict[str, float] = {}
+        self._postings: Dict[str, List] = {}
+        for token, posting in frequencies.items():
+            idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            self.idf[token] = idf
+            weights = []
+            for doc_index, tf in posting.items():
+                norm = 1 - b + b * len(documents[doc_index]) / average_length
+                weights.append((doc_index, idf * tf * (k1 + 1) / (tf + k1 * norm)))
+            if numpy is not None:
+                self._postings[token] = (numpy.array([item[0] for item in weights], dtype=numpy.int64),
+                                         numpy.array([item[1] for item in weights], dtype=numpy.float64))
+            else:
+                self._postings[token] = weights
+
+    def ideal_score(self, tokens: List[str]) -> float:
+        """
+        查询词全部高频出现在同一条目时能达到的得分上限，用于把得分换算成置信度。
+        知识库中没有的词按最高idf计入，问题里陌生的内容越多置信度越低
+        """
+        return sum(self.idf.get(token, self._max_idf) * (self.k1 + 1) for token in tokens)
+
+    def search(self, query: str, limit: int = 3) -> List[Dict]:
+        """
+        检索知识库
+
+        Returns:
+            List[Dict]: 按得分从高到低的 {id、title、answer、score、confidence、keyword_match}，
+                keyword_match 表示问题是否包含条目的标题、关键词或同义词（而不只是和答案正文有相同的字）
+        """
+        all_tokens = tokenize(query)
+        tokens = [token for token in all_tokens if token in self._postings]
+        if not tokens or not self.entries:
+            return []
+        if numpy is not None:
+            ids = numpy.concatenate([self._postings[token][0] for token in tokens])
+            weights = numpy.concatenate([self._postings[token][1] for token in tokens])
+            scores = numpy.bincount(ids, weights=weights, minlength=len(self.entries))
+            top = numpy.argsort(-scores, kind='stable')[:limit]
+            ranked = [(int(index), float(scores[index])) for index in top if scores[index] > 0]
+        else:
+            totals: Dict[int, float] = {}
+            for token in tokens:
+                for doc_index, weight in self._postings[token]:
+                    totals[doc_index] = totals.get(doc_index, 0.0) + weight
+            ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+        ideal = self.ideal_score(all_tokens) or 1.0
+        text = normalize(query)
+        results = []
+        for doc_index, score in ranked:
+            entry = self.entries[doc_index]
+            results.append({
+                'id': entry.get('id'),
+                'title': entry.get('title'),
+                'answer': entry['answer'],
+                'score': round(score, 4),
+                'confidence': round(score / ideal, 4),
+                'keyword_match': any(term in text for term in self._terms[doc_index]),
+            })
+        return results
+
+
+class KnowledgeRetriever:
+    """本地检索层：高置信度时直接回答，否则提供参考资料"""
+
+    def __init__(self, entries: List[Dict], threshold: float = DEFAULT_THRESHOLD,
+                 margin: float = DEFAULT_MARGIN, passages: int = 3,
+                 grounding_threshold: float = GROUNDING_THRESHOLD):
+        """
+        初始化检索层
+
+        Args:
+            entries: 知识库条目
+            threshold: 直接回答所需的最低置信度（同时要求问题命中条目的标题、关键词或同义词）
+            margin: 直接回答时第一名得分至少是第二名的倍数
+            passages: 交给大模型的参考条目数
+            grounding_threshold: 作为参考资料的最低置信度
+        """
+        self.index = BM25Index(entries)
+        self.threshold = threshold
+        self.margin = margin
+        self.passages = passages
+        self.grounding_threshold = grounding_threshold
+        self._lock = threading.Lock()
+        self.stats = {'queries': 0, 'local': 0, 'grounded': 0, 'unmatched': 0, 'local_seconds': 0.0}
+
+    def retrieve(self, question: str) -> Dict:
+        """
+        检索问题
+
+        Returns:
+            Dict: answer（可直接回答时为条目答案，否则为None）、passages（参考条目）、confidence
+        """
+        started = time.perf_counter()
+        results = self.index.search(question, max(2, self.passages))
+        passages = [result for result in results[:self.passages]
+                    if result['confidence'] >= self.grounding_threshold]
+        answer = None
+        confidence = results[0]['confidence'] if results else 0.0
+        if results and confidence >= self.threshold and results[0]['keyword_match']:
+            runner_up = results[1]['score'] if len(results) > 1 else 0.0
+            if results[0]['score'] >= runner_up * self.margin:
+                answer = results[0]['answer']
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self.stats['queries'] += 1
+            if answer:
+                self.stats['local'] += 1
+                self.stats['local_seconds'] += elapsed
+            elif passages:
+                self.stats['grounded'] += 1
+            else:
+                self.stats['unmatched'] += 1
+        return {
+            'answer': answer,
+            'passages': [] if answer else passages,
+            'confidence': confidence,
+            'seconds': elapsed,
+        }
+
+    def grounding_prompt(self, passages: List[Dict]) -> Optional[str]:
+        """把参考条目整理成附加在系统提示词后面的参考资料，没有条目返回None"""
+        if not passages:
+            return None
+        lines = [f"{index}. {passage['title'] or passage['id']}：{passage['answer']}"
+                 for index, passage in enumerate(passages, 1)]
+        return "以下是川小农知识库中与问题相关的资料，请优先依据这些资料简要回答：\n" + '\n'.join(lines)
+
+    def get_stats(self) -> Dict:
+        """获取本地回答占比和耗时统计"""
+        with self._lock:
+            stats = dict(self.stats)
+        local_seconds = stats.pop('local_seconds')
+        stats['local_ratio'] = round(stats['local'] / stats['queries'], 4) if stats['queries'] else 0.0
+        stats['local_avg_ms'] = round(local_seconds / stats['local'] * 1000, 3) if stats['local'] else 0.0
+        stats['entries'] = len(self.index.entries)
+        stats['terms'] = len(self.index.idf)
+        stats['threshold'] = self.threshold
+        stats['numpy'] = numpy is not None
+        return stats
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台数据库维护调度模块
+在一个后台线程中依次执行各项维护任务（统计信息、增量回收、WAL检查点、完整性检查、
+保留期清理、备份等），重任务只在低峰时段执行，数据库繁忙时推迟，并保留每次执行的记录
+"""
+
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def parse_window(text: str) -> Optional[Tuple[int, int]]:
+    """
+    解析低峰时段，例如 2-6 表示本地时间2点到6点，23-5 表示跨零点
+
+    Returns:
+        Optional[Tuple[int, int]]: (开始小时, 结束小时)，为空表示不限时段
+    """
+    text = (text or '').strip()
+    if not text:
+        return None
+    start, _, end = text.partition('-')
+    start, end = int(start), int(end)
+    if not (0 <= start <= 23 and 0 <= end <= 24) or start == end:
+        raise ValueError(f"无效的维护时段: {text}")
+    return start, end
+
+
+def result_error(result) -> Optional[str]:
+    """
+    任务返回值表示失败时返回错误信息：返回 False、字典中有 error，或 status 为 error
+
+    Returns:
+        Optional[str]: 错误信息，任务成功时为None
+    """
+    if result is False:
+        return '任务返回失败'
+    if isinstance(result, dict):
+        if result.get('error'):
+            return str(result['error'])
+        if result.get('status') == 'error':
+            return '; '.join(result.get('issues') or []) or '任务返回失败'
+    return None
+
+
+class MaintenanceJob:
+    """一个定期执行的维护任务"""
+
+    def __init__(self, name: str, func: Callable, interval: float,
+                 low_traffic_only: bool = False, yield_to_load: bool = True,
+                 description: str = ''):
+        """
+        初始化维护任务
+
+        Args:
+            name: 任务名称
+            func: 任务函数，返回值记录到执行历史；抛出异常或返回值满足 result_error 时记为失败
+            interval: 执行间隔（秒），第一次在启动后一个间隔执行
+            low_traffic_only: 是否只在低峰时段执行
+            yield_to_load: 数据库繁忙时是否推迟
+            description: 任务说明
+        """
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.low_traffic_only = low_traffic_only
+        self.yield_to_load = yield_to_load
+        self.description = description
+        self.next_run = time.time() + interval
+        self.forced = False
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skips = 0
+        self.last_status = None
+        self.last_run = None
+        self.last_duration_ms = None
+
+    def to_dict(self) -> Dict:
+        return {
+            'name': self.name,
+            'description': self.description,
+            'interval_seconds': self.interval,
+            'low_traffic_only': self.low_traffic_only,
+            'yield_to_load': self.yield_to_load,
+            'running': self.running,
+            'next_run': datetime.fromtimestamp(self.next_run).isoformat(),
+            'runs': self.runs,
+            'failures': self.failures,
+            'skips': self.skips,
+            'last_status': self.last_status,
+            'last_run': self.last_run,
+            'last_duration_ms': self.last_duration_ms,
+        }
+
+
+class MaintenanceScheduler:
+    """数据库维护任务调度器"""
+
+    def __init__(self, db, window: Optional[Tuple[int, int]] = (2, 6),
+                 max_active_connections: int = 4, busy_retry: float = 30.0,
+                 history_size: int = 50):
+        """
+        初始化调度器
+
+        Args:
+            db: DatabaseManager 实例
+            window: 低峰时段 (开始小时, 结束小时)，为空表示任何时间都算低峰
+            max_active_connections: 打开中的连接超过该数量时视为繁忙
+            busy_retry: 因繁忙推迟的任务多久后重试（秒，不超过任务本身的间隔）
+            history_size: 每个任务保留的执行记录数
+        """
+        self.db = db
+        self.window = window
+        self.max_active_connections = max_active_connections
+        self.busy_retry = busy_retry
+        self.history_size = history_size
+        self._jobs: Dict[str, MaintenanceJob] = {}
+        self._history: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_job(self, name: str, func: Callable, interval: float, low_traffic_only: bool = False,
+                yield_to_load: bool = True, description: str = '') -> MaintenanceJob:
+        """注册维护任务，参数见 MaintenanceJob"""
+        job = MaintenanceJob(name, func, interval, low_traffic_only, yield_to_load, description)
+        with self._lock:
+            self._jobs[name] = job
+            self._history[name] = deque(maxlen=self.history_size)
+        self._wakeup.set()
+        return job
+
+    def in_low_traffic_window(self, now: datetime = None) -> bool:
+        """当前是否处于低峰时段"""
+        if not self.window:
+            return True
+        hour = (now or datetime.now()).hour
+        start, end = self.window
+        if start < end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def busy_reason(self) -> Optional[str]:
+        """数据库繁忙时返回原因，否则返回None"""
+        load = self.db.get_load()
+        if load['write_locked']:
+            return '写锁被占用'
+        if load['active_connections'] > self.max_active_connections:
+            return f"打开中的连接数 {load['active_connections']} 超过 {self.max_active_connections}"
+        return None
+
+    def _record(self, job: MaintenanceJob, status: str, trigger: str, started: float,
+                result=None, error: str = None):
+        entry = {
+            'job': job.name,
+            'status': status,
+            'trigger': trigger,
+            'started_at': datetime.fromtimestamp(started).isoformat(),
+            'duration_ms': round((time.time() - started) * 1000, 1),
+            'result': result,
+            'error': error,
+        }
+        with self._lock:
+            self._history[job.name].append(entry)
+        return entry
+
+    def _run_job(self, job: MaintenanceJob):
+        """执行一个到期的任务，或者在繁忙时推迟它"""
+        now = time.time()
+        trigger = 'manual' if job.forced else 'schedule'
+        if not job.forced:
+            if job.low_traffic_only and not self.in_low_traffic_window():
+                # 不在低峰时段：保持到期状态，进入低峰时段后再执行，不记录历史
+                return
+            reason = self.busy_reason() if job.yield_to_load else None
+            if reason:
+                job.skips += 1
+                job.last_status = 'skipped'
+                job.next_run = now + min(self.busy_retry, job.interval)
+                self._record(job, 'skipped', trigger, now, error=reason)
+                return
+
+        job.forced = False
+        job.running = True
+        try:
+            result = job.func()
+            error = result_error(result)
+            if error:
+                # 数据库维护方法出错时大多返回失败结果而不是抛出异常
+                job.failures += 1
+                job.last_status = 'error'
+                entry = self._record(job, 'error', trigger, now, result=result, error=error)
+                print(f"维护任务 {job.name} 出错: {error}")
+            else:
+                job.last_status = 'ok'
+                entry = self._record(job, 'ok', trigger, now, result=result)
+        except Exception as e:
+            job.failures += 1
+            job.last_status = 'error'
+            entry = self._record(job, 'error', trigger, now, error=str(e))
+            print(f"维护任务 {job.name} 出错: {str(e)}")
+        finally:
+            job.running = False
+        job.runs += 1
+        job.last_run = entry['started_at']
+        job.last_duration_ms = entry['duration_ms']
+        job.next_run = time.time() + job.interval
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.time()
+            with self._lock:
+                due = sorted((job for job in self._jobs.values() if job.next_run <= now),
+                             key=lambda job: job.next_run)
+            for job in due:
+                if self._stop.is_set():
+                    return
+                self._run_job(job)
+            with self._lock:
+                upcoming = [job.next_run for job in self._jobs.values() if job.next_run > time.time()]
+            # 等到下一个任务到期；有等待低峰时段的任务时每分钟检查一次
+            timeout = min(upcoming, default=time.time() + 60) - time.time()
+            self._wakeup.wait(max(0.1, min(timeout, 60)))
+            self._wakeup.clear()
+
+    def run_now(self, name: str) -> bool:
+        """
+        让任务尽快执行一次（忽略低峰时段和负载检查）
+
+        Returns:
+            bool: 任务存在返回True
+        """
+        with self._lock:
+            job = self._jobs.get(name)
+            if job is None:
+                return False
+            job.forced = True
+            job.next_run = 0
+        self._wakeup.set()
+        return True
+
+    def get_jobs(self) -> List[Dict]:
+        """获取所有任务的状态"""
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def get_history(self, job: str = None, limit: int = 50) -> List[Dict]:
+        """
+        获取执行历史（从新到旧）
+
+        Args:
+            job: 任务名称，为空表示全部任务
+            limit: 最多返回的记录数
+        """
+        with self._lock:
+            if job:
+                entries = list(self._history.get(job, ()))
+            else:
+                entries = [entry for history in self._history.values() for entry in history]
+        entries.sort(key=lambda entry: entry['started_at'], reverse=True)
+        return entries[:limit]
+
+    def start(self):
+        """启动调度线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='db-maintenance', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止调度线程（正在执行的任务会执行完）"""
+        self._stop.set()
+        self._wakeup.set()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息按月分区存储模块
+已结束月份的消息从主库移动到每月一个的SQLite文件中，分区文件写完后设为只读，
+查询时只按需打开请求的时间范围涉及的分区
+"""
+
+import os
+import re
+import sqlite3
+import stat
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import quote
+
+# 分区文件名：messages_YYYY_MM.db
+PARTITION_FILE_PATTERN = re.compile(r'^messages_(\d{4})_(\d{2})\.db$')
+
+
+def month_bounds(month: str):
+    """
+    获取月份的时间范围
+
+    Args:
+        month: 月份，格式 YYYY-MM
+
+    Returns:
+        tuple: (本月开始时间, 下月开始时间)，格式与消息的 timestamp 一致
+    """
+    year, mon = int(month[:4]), int(month[5:7])
+    next_year, next_mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+    return f'{year:04d}-{mon:02d}-01 00:00:00', f'{next_year:04d}-{next_mon:02d}-01 00:00:00'
+
+
+class MessagePartitions:
+    """按月分区的只读消息文件"""
+
+    def __init__(self, directory: str, column_defaults: Dict[str, str] = None):
+        """
+        初始化分区目录
+
+        Args:
+            directory: 分区文件所在目录
+            column_defaults: 主库后来新增的列及其默认值（SQL表达式），
+                             旧分区缺少这些列时通过临时视图补齐
+        """
+        self.directory = directory
+        self.column_defaults = column_defaults or {}
+        os.makedirs(directory, exist_ok=True)
+
+    def path_for(self, month: str) -> str:
+        """获取月份对应的分区文件路径"""
+        return os.path.join(self.directory, f"messages_{month.replace('-', '_')}.db")
+
+    def list_months(self) -> List[str]:
+        """列出已有分区的月份（从新到旧）"""
+        months = []
+        for filename in os.listdir(self.directory):
+            match = PARTITION_FILE_PATTERN.match(filename)
+            if match:
+                months.append(f'{match.group(1)}-{match.group(2)}')
+        return sorted(months, reverse=True)
+
+    def months_for_range(self, start_time: str = None, end_time: str = None) -> List[str]:
+        """
+        获取与时间范围有交集的分区月份（从新到旧）
+
+        Args:
+            start_time: 开始时间，为空表示不限
+            end_time: 结束时间，为空表示不限
+        """
+        return [month for month in self.list_months()
+                if (not start_time or month >= start_time[:7])
+                and (not end_time or month <= end_time[:7])]
+
+    def connect(self, month: str) -> sqlite3.Connection:
+        """以只读、不可变方式打开分区（不加锁、不检查日志文件）"""
+        uri = f'file:{quote(os.path.abspath(self.path_for(month)))}?mode=ro&immutable=1'
+        conn = sqlite3.connect(uri, uri=True)
+        conn.row_factory = sqlite3.Row
+        if self.column_defaults:
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(messages)')}
+            missing = [f'{default} AS {column}' for column, default in self.column_defaults.items()
+                       if column not in existing]
+            if missing:
+                # 临时视图优先于同名表，查询语句无需区分新旧分区
+                conn.execute(f'CREATE TEMP VIEW messages AS SELECT *, {", ".join(missing)} FROM main.messages')
+        return conn
+
+    def write_partition(self, month: str, table_sql: str, index_sqls: Iterable[str],
+                        chunks: Iterable[List[sqlite3.Row]]) -> int:
+        """
+        写入一个新分区：先写临时文件并建索引，完成后设为只读再改名
+
+        Args:
+            month: 月份
+            table_sql: messages 表的建表语句
+            index_sqls: 需要在分区上建立的索引语句
+            chunks: 逐批产生的消息行
+
+        Returns:
+            int: 写入的消息数
+        """
+        path = self.path_for(month)
+        temp_path = f'{path}.tmp'
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        count = 0
+        conn = sqlite3.connect(temp_path)
+        try:
+            conn.execute('PRAGMA journal_mode=OFF')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute(table_sql)
+            insert_sql = None
+            for rows in chunks:
+                if not rows:
+                    continue
+                if insert_sql is None:
+                    columns = rows[0].keys()
+                    insert_sql = (f'INSERT INTO messages ({", ".join(columns)}) '
+                                  f'VALUES ({", ".join("?" * len(columns))})')
+                conn.executemany(insert_sql, [tuple(row) for row in rows])
+                count += len(rows)
+            for index_sql in index_sqls:
+                conn.execute(index_sql)
+            conn.execute('ANALYZE')
+            conn.commit()
+            conn.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            conn.close()
+
+        # 分区写完后不再修改
+        os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.replace(temp_path, path)
+        return count
+
+    def count(self, month: str) -> Optional[int]:
+        """获取分区中的消息数，分区不存在返回None"""
+        if not os.path.exists(self.path_for(month)):
+            return None
+        conn = self.connect(month)
+        try:
+            return conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+        finally:
+            conn.close()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地音乐倒排索引模块
+对本地曲库（static/audio/catalog.json）的歌名、歌手、专辑和别名建立字符二元组倒排索引，
+支持拼音（全拼、首字母）和模糊匹配，@音乐 搜索先查本地索引，命中时不再请求上游接口。
+曲库文件变化时只重建变化的条目。安装了 pypinyin 时自动为中文歌名和歌手生成拼音
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Set
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:
+    lazy_pinyin = None
+
+# 各字段的权重
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'aliases': 2.0,
+    'singer': 1.5,
+    'album': 0.5,
+}
+# 查询的二元组至少有这个比例命中才算匹配
+MIN_COVERAGE = 0.5
+# 查询与歌名或别名完全相同、前缀相同时的加分
+EXACT_BONUS = 10.0
+PREFIX_BONUS = 2.0
+_STRIP_PATTERN = re.compile(r'[^0-9a-z一-鿿]+')
+
+
+def normalize(text: str) -> str:
+    """全角转半角、转小写，只保留字母数字和汉字"""
+    return _STRIP_PATTERN.sub('', unicodedata.normalize('NFKC', str(text or '')).lower())
+
+
+def grams(text: str) -> Set[str]:
+    """规范化文本的字符二元组，另加每个汉字本身（支持单字查询）"""
+    if not text:
+        return set()
+    result = {text[i:i + 2] for i in range(len(text) - 1)} if len(text) > 1 else {text}
+    result.update(char for char in text if '一' <= char <= '鿿')
+    return result
+
+
+def _pinyin_forms(text: str) -> List[str]:
+    """中文文本的全拼和首字母（需要 pypinyin）"""
+    if lazy_pinyin is None or not re.search(r'[一-鿿]', text or ''):
+        return []
+    return [''.join(lazy_pinyin(text)), ''.join(lazy_pinyin(text, style=Style.FIRST_LETTER))]
+
+
+class MusicIndex:
+    """本地曲库的倒排索引"""
+
+    def __init__(self, catalog_path: str, check_interval: float = 5.0):
+        """
+        初始化索引
+
+        Args:
+            catalog_path: 曲库JSON文件路径（条目含 id、name、singer、album、url、aliases）
+            check_interval: 搜索时检查曲库文件是否变化的最短间隔（秒）
+        """
+        self.catalog_path = catalog_path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        self._fingerprints: Dict[str, str] = {}
+        # 每个条目的 规范化字段值列表（用于完全/前缀匹配）和 二元组 -> 权重
+        self._terms: Dict[str, List[str]] = {}
+        self._doc_grams: Dict[str, Dict[str, float]] = {}
+        # 倒排表：二元组 -> {条目ID: 权重}
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._catalog_mtime = None
+        self._last_check = 0.0
+        self.stats = {'searches': 0, 'hits': 0, 'rebuilds': 0}
+        self.refresh(force=True)
+
+    def _index_entry(self, entry_id: str, entry: Dict):
+        weights: Dict[str, float] = {}
+        terms = []
+        for field, weight in FIELD_WEIGHTS.items():
+            values = entry.get(field) or []
+            values = list(values) if isinstance(values, list) else [values]
+            if field in ('name', 'singer'):
+                values += _pinyin_forms(entry.get(field))
+            for value in values:
+                text = normalize(value)
+                if not text:
+                    continue
+                if field in ('name', 'aliases'):
+                    terms.append(text)
+                for gram in grams(text):
+                    weights[gram] = max(weights.get(gram, 0.0), weight)
+        for gram, weight in weights.items():
+            self._postings.setdefault(gram, {})[entry_id] = weight
+        self._doc_grams[entry_id] = weights
+        self._terms[entry_id] = terms
+        self._entries[entry_id] = entry
+
+    def _remove_entry(self, entry_id: str):
+        for gram in self._doc_grams.pop(entry_id, {}):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.pop(entry_id, None)
+                if not posting:
+                    del self._postings[gram]
+        self._terms.pop(entry_id, None)
+        self._entries.pop(entry_id, None)
+
+    def refresh(self, force: bool = False) -> Dict:
+        """
+        曲库文件变化时增量更新索引：只删除和重建新增、修改、删除的条目
+
+        Returns:
+            Dict: added、updated、removed 条目数
+        """
+        changes = {'added': 0, 'updated': 0, 'removed': 0}
+        try:
+            mtime = os.stat(self.catalog_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        self._last_check = time.monotonic()
+        if not force and mtime == self._catalog_mtime:
+            return changes
+
+        catalog = []
+        if mtime is not None:
+            try:
+                with open(self.catalog_path, 'r', encoding='utf-8') as f:
+                    catalog = json.load(f)
+            except (OSError, ValueError) as e:
+                # 曲库文件写到一半或格式错误时保留旧索引
+                print(f"读取曲库失败: {str(e)}")
+                return changes
+
+        fingerprints = {}
+        entries = {}
+        for entry in catalog:
+            entry_id = str(entry.get('id') or entry.get('url') or entry.get('name'))
+            entries[entry_id] = entry
+            fingerprints[entry_id] = json.dumps(entry, sort_keys=True, ensure_ascii=False)
+
+        with self._lock:
+            for entry_id in list(self._fingerprints):
+                if entry_id not in fingerprints:
+                    self._remove_entry(entry_id)
+                    changes['removed'] += 1
+            for entry_id, fingerprint in fingerprints.items():
+                previous = self._fingerprints.get(entry_id)
+                if previous == fingerprint:
+                    continue
+                if previous is not None:
+                    self._remove_entry(entry_id)
+                    changes['updated'] += 1
+                else:
+                    changes['added'] += 1
+                self._index_entry(entry_id, entries[entry_id])
+            self._fingerprints = fingerprints
+            self._catalog_mtime = mtime
+            if any(changes.values()):
+                self.stats['rebuilds'] += 1
+        return changes
+
+    def search(self, query: str, limit: int = 5) -> List[Dict]:
+        """
+        搜索曲库
+
+        Args:
+            query: 歌名、歌手、别名或拼音，允许错字和缺字
+            limit: 最多返回的条目数
+
+        Returns:
+            List[Dict]: 按得分从高到低的条目（附带 score）
+        """
+        if time.monotonic() - self._last_check >= self.check_interval:
+            self.refresh()
+        text = normalize(query)
+        query_grams = grams(text)
+        if not query_grams:
+            return []
+
+        with self._lock:
+            self.stats['searches'] += 1
+            total = max(1, len(self._entries))
+            scores: Dict[str, float] = {}
+            matched: Dict[str, int] = {}
+            for gram in query_grams:
+                posting = self._postings.get(gram)
+                if not posting:
+                    continue
+                idf = math.log(1 + total / len(posting))
+                for entry_id, weight in posting.items():
+                    scores[entry_id] = scores.get(entry_id, 0.0) + idf * weight
+                    matched[entry_id] = matched.get(entry_id, 0) + 1
+
+            results = []
+            for entry_id, score in scores.items():
+                coverage = matched[entry_id] / len(query_grams)
+                if coverage < MIN_COVERAGE:
+                    continue
+                score *= coverage
+                terms = self._terms.get(entry_id, [])
+                if text in terms:
+                    score += EXACT_BONUS
+                elif any(term.startswith(text) for term in terms):
+                    score += PREFIX_BONUS
+                results.append((score, entry_id))
+            results.sort(key=lambda item: (-item[0], item[1]))
+            top = [dict(self._entries[entry_id], score=round(score, 3)) for score, entry_id in results[:limit]]
+            if top:
+                self.stats['hits'] += 1
+        return top
+
+    def best_match(self, query: str) -> Optional[Dict]:
+        """返回得分最高的条目，没有匹配返回None"""
+        results = self.search(query, 1)
+        return results[0] if results else None
+
+    def get_stats(self) -> Dict:
+        """获取索引统计信息"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['grams'] = len(self._postings)
+        stats['pinyin'] = lazy_pinyin is not None
+        return stats
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息大字段压缩模块
+优先使用zstd（需安装 zstandard），否则使用标准库zlib；
+压缩后没有变小的内容按原样保存
+"""
+
+import threading
+import zlib
+from typing import Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# zlib压缩级别
+ZLIB_LEVEL = 6
+# zstd压缩级别
+ZSTD_LEVEL = 3
+
+# zstd压缩/解压对象不能在线程间共享，每个线程各建一份
+_zstd_local = threading.local()
+
+
+def _zstd_compressor():
+    compressor = getattr(_zstd_local, 'compressor', None)
+    if compressor is None:
+        compressor = _zstd_local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return compressor
+
+
+def _zstd_decompressor():
+    decompressor = getattr(_zstd_local, 'decompressor', None)
+    if decompressor is None:
+        decompressor = _zstd_local.decompressor = zstandard.ZstdDecompressor()
+    return decompressor
+
+
+def default_codec() -> str:
+    """当前环境可用的最佳压缩算法"""
+    return 'zstd' if zstandard else 'zlib'
+
+
+def compress_text(text: str, codec: str = None) -> Tuple[str, bytes]:
+    """
+    压缩文本
+
+    Args:
+        text: 原始文本
+        codec: 压缩算法（zstd、zlib），默认使用 default_codec()
+
+    Returns:
+        Tuple[str, bytes]: (实际使用的算法, 压缩后的数据)，没有变小时算法为raw
+    """
+    raw = text.encode('utf-8')
+    codec = codec or default_codec()
+    if codec == 'zstd' and zstandard is not None:
+        data = _zstd_compressor().compress(raw)
+    else:
+        codec = 'zlib'
+        data = zlib.compress(raw, ZLIB_LEVEL)
+    if len(data) >= len(raw):
+        return 'raw', raw
+    return codec, data
+
+
+def decompress_text(codec: str, data: bytes) -> str:
+    """
+    解压文本
+
+    Args:
+        codec: 压缩算法（raw、zlib、zstd）
+        data: 压缩后的数据
+
+    Returns:
+        str: 原始文本
+    """
+    if codec == 'raw':
+        raw = data
+    elif codec == 'zlib':
+        raw = zlib.decompress(data)
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("数据使用zstd压缩，但未安装 zstandard")
+        raw = _zstd_decompressor().decompress(data)
+    else:
+        raise ValueError(f"未知的压缩算法: {codec}")
+    return bytes(raw).decode('utf-8')
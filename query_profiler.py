@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQL查询性能分析模块
+为SQLite连接计时每条语句，记录超过阈值的慢查询（参数脱敏），
+并在每种查询形状首次执行时抓取 EXPLAIN QUERY PLAN，标记全表扫描
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# 查询形状归一化规则
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_WHITESPACE = re.compile(r'\s+')
+# 按批次长度拼出的 IN (?, ?, …) 列表合并为一种形状，避免每种长度各占一个形状并各抓一次执行计划
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+# 只对这些语句抓取执行计划
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+
+def redact_params(params) -> List[str]:
+    """参数脱敏：只保留类型和长度"""
+    if params is None:
+        return []
+    values = params.values() if isinstance(params, dict) else params
+    redacted = []
+    for value in values:
+        if value is None:
+            redacted.append('NULL')
+        elif isinstance(value, (str, bytes)):
+            redacted.append(f'<{type(value).__name__}:{len(value)}>')
+        else:
+            redacted.append(f'<{type(value).__name__}>')
+    return redacted
+
+
+class QueryProfiler:
+    """SQL语句计时和执行计划采集器"""
+
+    def __init__(self, slow_threshold_ms: float = 100.0, capture_plans: bool = True,
+                 max_shapes: int = 500):
+        """
+        初始化查询分析器
+
+        Args:
+            slow_threshold_ms: 慢查询阈值（毫秒）
+            capture_plans: 是否在查询形状首次出现时抓取执行计划
+            max_shapes: 最多跟踪的查询形状数量
+        """
+        self.slow_threshold_ms = slow_threshold_ms
+        self.capture_plans = capture_plans
+        self.max_shapes = max_shapes
+        self._lock = threading.Lock()
+        self._shapes: Dict[str, Dict] = {}
+        self._shape_cache: Dict[str, str] = {}
+        self.untracked = 0
+
+    def normalize(self, sql: str) -> str:
+        """把SQL归一化为查询形状（去掉字面量、合并 IN 列表、压缩空白）"""
+        shape = self._shape_cache.get(sql)
+        if shape is None:
+            shape = _STRING_LITERAL.sub('?', sql)
+            shape = _NUMBER_LITERAL.sub('?', shape)
+            shape = _IN_LIST.sub('IN (?…)', shape)
+            shape = _WHITESPACE.sub(' ', shape).strip()
+            if len(self._shape_cache) < self.max_shapes * 4:
+                self._shape_cache[sql] = shape
+        return shape
+
+    def before_execute(self, connection: sqlite3.Connection, sql: str, params) -> Optional[str]:
+        """
+        语句执行前调用，新出现的查询形状会先抓取执行计划
+
+        Returns:
+            Optional[str]: 查询形状，不跟踪时返回None
+        """
+        shape = self.normalize(sql)
+        if shape in self._shapes:
+            return shape
+        with self._lock:
+            if shape in self._shapes:
+                return shape
+            if len(self._shapes) >= self.max_shapes:
+                self.untracked += 1
+                return None
+            entry = {
+                'shape': shape,
+                'count': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'slow_count': 0,
+                'plan': [],
+                'full_scan': False,
+                'scanned_tables': [],
+                'first_seen': datetime.now().isoformat(),
+            }
+            self._shapes[shape] = entry
+        if self.capture_plans and shape.upper().startswith(_EXPLAINABLE):
+            self._capture_plan(connection, sql, params, entry)
+        return shape
+
+    def _capture_plan(self, connection: sqlite3.Connection, sql: str, params, entry: Dict):
+        """抓取执行计划并检测全表扫描"""
+        try:
+            # 使用原始游标，避免执行计划语句本身被计时
+            cursor = sqlite3.Cursor(connection)
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params if params is not None else ())
+            details = [row[3] for row in cursor.fetchall()]
+            cursor.close()
+        except sqlite3.Error as e:
+            entry['plan'] = [f'执行计划获取失败: {str(e)}']
+            return
+        scanned = []
+        for detail in details:
+            # "SCAN messages" 为全表扫描，"SCAN messages USING INDEX ..." 为索引扫描
+            if detail.startswith('SCAN ') and ' USING ' not in detail:
+                scanned.append(detail.split()[1])
+        entry['plan'] = details
+        entry['full_scan'] = bool(scanned)
+        entry['scanned_tables'] = scanned
+        if scanned:
+            print(f"全表扫描警告: {entry['shape']} 扫描表: {', '.join(scanned)}")
+
+    def after_execute(self, shape: Optional[str], params, elapsed_ms: float):
+        """语句执行后调用，累计统计并记录慢查询"""
+        if shape is None:
+            return
+        entry = self._shapes.get(shape)
+        if entry is None:
+            return
+        slow = elapsed_ms >= self.slow_threshold_ms
+        with self._lock:
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            if elapsed_ms > entry['max_ms']:
+                entry['max_ms'] = elapsed_ms
+            if slow:
+                entry['slow_count'] += 1
+        if slow:
+            print(f"慢查询 {elapsed_ms:.1f}ms: {shape} 参数: {redact_params(params)}")
+
+    def get_top_queries(self, top_n: int = 10, order_by: str = 'total_ms') -> List[Dict]:
+        """
+        获取最慢的查询形状
+
+        Args:
+            top_n: 返回数量
+            order_by: 排序字段（total_ms、max_ms、avg_ms、count）
+
+        Returns:
+            List[Dict]: 查询形状统计列表
+        """
+        with self._lock:
+            entries = [dict(entry) for entry in self._shapes.values() if entry['count']]
+        for entry in entries:
+            entry['avg_ms'] = round(entry['total_ms'] / entry['count'], 3)
+            entry['total_ms'] = round(entry['total_ms'], 3)
+            entry['max_ms'] = round(entry['max_ms'], 3)
+        if order_by not in ('total_ms', 'max_ms', 'avg_ms', 'count'):
+            order_by = 'total_ms'
+        entries.sort(key=lambda entry: entry[order_by], reverse=True)
+        return entries[:top_n]
+
+    def get_full_scans(self) -> List[Dict]:
+        """获取存在全表扫描的查询形状"""
+        with self._lock:
+            return [dict(entry) for entry in self._shapes.values() if entry['full_scan']]
+
+    def reset(self):
+        """清空统计数据"""
+        with self._lock:
+            self._shapes.clear()
+            self.untracked = 0
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """对每条语句计时的游标"""
+
+    def execute(self, sql, parameters=()):
+        profiler = self.connection.profiler
+        shape = profiler.before_execute(self.connection, sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            profiler.after_execute(shape, parameters, (time.perf_counter() - start) * 1000)
+
+    def executemany(self, sql, seq_of_parameters):
+        profiler = self.connection.profiler
+        seq_of_parameters = list(seq_of_parameters)
+        shape = profiler.before_execute(self.connection, sql,
+                                        seq_of_parameters[0] if seq_of_parameters else ())
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            profiler.after_execute(shape, None, (time.perf_counter() - start) * 1000)
+
+    def executescript(self, sql_script):
+        profiler = self.connection.profiler
+        shape = profiler.before_execute(self.connection, sql_script, None)
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            profiler.after_execute(shape, None, (time.perf_counter() - start) * 1000)
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """默认创建 ProfiledCursor 的连接，conn.execute() 等快捷方法也经过计时游标"""
+
+    profiler: QueryProfiler = None
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection 的快捷方法在C层直接创建普通游标，需要改为经过 ProfiledCursor
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI回答语义缓存模块
+把问题编码为带符号的哈希字符n元组向量（本地计算，无需GPU和网络），与已缓存问题做余弦相似度比较，
+超过阈值时直接返回缓存的回答，“川农有几个校区”和“四川农业大学校区有哪些”可以共用一个回答。
+编码前统一学校名称的不同叫法，整体去掉句首的客套话、句末的疑问词和语气词以及询问数量的疑问词组，只比较问题的主题部分。
+答案随时间变化的问题（含“今天”“明天”等时间词）不缓存，以免把过时的回答发给其他用户。
+安装了 NumPy 时向量存放在一个矩阵中用一次矩阵乘法比较，否则退回稀疏字典实现。
+按最近最少使用淘汰，同时受条目数、内存上限和过期时间限制
+"""
+
+import math
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from knowledge_matcher import normalize
+
+DEFAULT_DIM = 512
+DEFAULT_THRESHOLD = 0.8
+# 没有 NumPy 时逐条计算相似度，默认条目数上限相应调低
+DEFAULT_MAX_ENTRIES = 10000 if numpy is not None else 2000
+# 各长度n元组的权重，单字区分度低
+NGRAM_WEIGHTS = ((1, 0.5), (2, 1.0), (3, 1.0))
+# 学校名称的不同叫法，编码前统一
+ENTITY_ALIASES = (('四川农业大学', '川农'), ('川农大', '川农'), ('咱们学校', '川农'), ('学校', '川农'))
+# 句首的客套话和句末的疑问词、语气词，只在分句开头或结尾整体去掉，不拆开句中的地名和专有名词
+LEADING_PHRASES = re.compile(r'^(?:请问一下|请问|问一下|想问一下|我想知道|你好|您好)+')
+TRAILING_PHRASES = re.compile(r'(?:(?:是|有|在|的)?(?:什么|多少钱|多少|哪里|哪儿|哪些|哪个|几个|怎么样|怎么|如何|哪)|吗|呢|吧|啊|呀|了)+$')
+# 句中询问数量、种类的疑问词组，整个词组去掉（“有几个校区”和“校区有哪些”都只剩“校区”）
+QUESTION_PHRASES = re.compile(r'(?:是|有)?(?:几个|哪些|什么|一共|总共)')
+# 表示时间的词，含这些词的问题答案会随时间变化
+TIME_WORDS = re.compile(r'今天|明天|后天|昨天|今晚|明晚|今早|今日|明日|现在|目前|最近|刚才|本周|这周|下周|上周|'
+                        r'这个月|本月|下个月|上个月|今年|明年|去年|星期几|周几|几号|几月几日')
+# 正反问句（是不是、有没有、难不难）改写为陈述形式
+_A_NOT_A_PATTERN = re.compile(r'(.)[不没]\1')
+_CLAUSE_PATTERN = re.compile(r'[^0-9a-z一-鿿]+')
+# numpy 矩阵初始行数，不够时按倍数扩容
+_INITIAL_ROWS = 64
+
+
+def canonical(text: str) -> str:
+    """问题的主题部分：统一学校名称、改写正反问句，去掉疑问词、语气词和标点"""
+    text = normalize(text)
+    for alias, name in ENTITY_ALIASES:
+        text = text.replace(alias, name)
+    text = _A_NOT_A_PATTERN.sub(r'\1', text)
+    clauses = (TRAILING_PHRASES.sub('', LEADING_PHRASES.sub('', clause)) for clause in _CLAUSE_PATTERN.split(text))
+    return QUESTION_PHRASES.sub('', ''.join(clauses))
+
+
+def is_time_sensitive(text: str) -> bool:
+    """问题是否含时间词（答案会随时间变化，不应缓存）"""
+    return bool(TIME_WORDS.search(normalize(text)))
+
+
+def embed(text: str, dim: int = DEFAULT_DIM) -> Dict[int, float]:
+    """
+    把文本编码为单位长度的稀疏向量
+
+    Returns:
+        Dict[int, float]: 维度下标 -> 分量
+    """
+    text = canonical(text)
+    vector: Dict[int, float] = {}
+    for size, weight in NGRAM_WEIGHTS:
+        for start in range(len(text) - size + 1):
+            digest = zlib.crc32(text[start:start + size].encode('utf-8'))
+            index = digest % dim
+            # 用哈希值的另一部分决定符号，哈希冲突时互相抵消而不是累加
+            sign = 1.0 if (digest >> 16) & 1 else -1.0
+            vector[index] = vector.get(index, 0.0) + sign * weight
+    norm = math.sqrt(sum(value * value for value in vector.values()))
+    if not norm:
+        return {}
+    return {index: value / norm for index, value in vector.items() if value}
+
+
+class _Entry:
+    """缓存条目"""
+
+    __slots__ = ('question', 'answer', 'vector', 'created_at', 'hits', 'size')
+
+    def __init__(self, question: str, answer: str, vector: Dict[int, float], size: int):
+        self.question = question
+        self.answer = answer
+        self.vector = vector
+        self.created_at = time.time()
+        self.hits = 0
+        self.size = size
+
+
+class SemanticCache:
+    """按问题语义相似度命中的回答缓存"""
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, max_bytes: int = 16 * 1024 * 1024,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = 86400.0, dim: int = DEFAULT_DIM):
+        """
+        初始化缓存
+
+        Args:
+            threshold: 命中所需的最低余弦相似度（0~1，越高越严格）
+            max_bytes: 内存上限（向量和问答文本的字节数）
+            max_entries: 最多缓存的条目数
+            ttl: 回答的有效期（秒），0 表示不过期
+            dim: 向量维度
+        """
+        self.threshold = threshold
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.dim = dim
+        self._lock = threading.Lock()
+        # 槽位 -> 条目，按最近使用排序，最久未用的在前面
+        self._entries: 'OrderedDict[int, _Entry]' = OrderedDict()
+        self._free_slots = []
+        self._next_slot = 0
+        self._bytes = 0
+        self._matrix = numpy.zeros((_INITIAL_ROWS, dim), dtype=numpy.float32) if numpy is not None else None
+        self.stats = {'lookups': 0, 'hits': 0, 'stores': 0, 'evictions': 0, 'expired': 0, 'time_sensitive': 0}
+
+    def _entry_size(self, question: str, answer: str, vector: Dict[int, float]) -> int:
+        vector_bytes = self.dim * 4 if self._matrix is not None else len(vector) * 16
+        return vector_bytes + len(question.encode('utf-8')) + len(answer.encode('utf-8'))
+
+    def _best_slot(self, vector: Dict[int, float]):
+        """返回 (相似度最高的槽位, 相似度)，缓存为空时槽位为None"""
+        if not self._entries:
+            return None, 0.0
+        if self._matrix is not None:
+            query = numpy.zeros(self.dim, dtype=numpy.float32)
+            query[list(vector)] = list(vector.values())
+            # 空闲槽位的行是全零，相似度为0不会命中
+            similarities = self._matrix[:self._next_slot] @ query
+            slot = int(similarities.argmax())
+            if slot not in self._entries:
+                return None, 0.0
+            return slot, float(similarities[slot])
+        best_slot, best = None, -1.0
+        for slot, entry in self._entries.items():
+            small, large = (vector, entry.vector) if len(vector) <= len(entry.vector) else (entry.vector, vector)
+            similarity = sum(value * large.get(index, 0.0) for index, value in small.items())
+            if similarity > best:
+                best_slot, best = slot, similarity
+        return best_slot, best
+
+    def _remove(self, slot: int):
+        entry = self._entries.pop(slot)
+        self._bytes -= entry.size
+        self._free_slots.append(slot)
+        if self._matrix is not None:
+            self._matrix[slot] = 0.0
+
+    def _allocate(self) -> int:
+        if self._free_slots:
+            return self._free_slots.pop()
+        slot = self._next_slot
+        self._next_slot += 1
+        if self._matrix is not None and slot >= len(self._matrix):
+            # 插入后才淘汰，槽位最多用到 max_entries + 1 个
+            rows = max(slot + 1, min(len(self._matrix) * 2, self.max_entries + 1))
+            grown = numpy.zeros((rows, self.dim), dtype=numpy.float32)
+            grown[:len(self._matrix)] = self._matrix
+            self._matrix = grown
+        return slot
+
+    def get(self, question: str) -> Optional[str]:
+        """
+        查找语义相近问题的缓存回答
+
+        Returns:
+            Optional[str]: 缓存的回答，未命中或问题含时间词时返回None
+        """
+        if is_time_sensitive(question):
+            with self._lock:
+                self.stats['time_sensitive'] += 1
+            return None
+        vector = embed(question, self.dim)
+        with self._lock:
+            self.stats['lookups'] += 1
+            if not vector:
+                return None
+            slot, similarity = self._best_slot(vector)
+            if slot is None or similarity < self.threshold:
+                return None
+            entry = self._entries[slot]
+            if self.ttl and time.time() - entry.created_at > self.ttl:
+                self._remove(slot)
+                self.stats['expired'] += 1
+                return None
+            entry.hits += 1
+            self._entries.move_to_end(slot)
+            self.stats['hits'] += 1
+            return entry.answer
+
+    def put(self, question: str, answer: str):
+        """缓存回答，已有语义相近的问题时替换它的回答，含时间词的问题不缓存"""
+        if is_time_sensitive(question):
+            return
+        vector = embed(question, self.dim)
+        if not vector or not answer:
+            return
+        size = self._entry_size(question, answer, vector)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            slot, similarity = self._best_slot(vector)
+            if slot is not None and similarity >= self.threshold:
+                self._remove(slot)
+            slot = self._allocate()
+            self._entries[slot] = _Entry(question, answer, vector, size)
+            self._bytes += size
+            if self._matrix is not None:
+                row = self._matrix[slot]
+                row[list(vector)] = list(vector.values())
+            self.stats['stores'] += 1
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def configure(self, threshold: float = None, max_bytes: int = None, ttl: float = None):
+        """运行中调整阈值、内存上限和有效期，内存上限调低时立即淘汰多出的条目"""
+        with self._lock:
+            if threshold is not None:
+                self.threshold = threshold
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            if ttl is not None:
+                self.ttl = ttl
+            while self._entries and self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._free_slots = []
+            self._next_slot = 0
+            self._bytes = 0
+            if self._matrix is not None:
+                self._matrix = numpy.zeros((_INITIAL_ROWS, self.dim), dtype=numpy.float32)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.stats['lookups']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def get_stats(self) -> Dict:
+        """获取命中率、条目数和内存占用"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            top = sorted(self._entries.values(), key=lambda entry: -entry.hits)[:10]
+            stats['top_questions'] = [{'question': entry.question, 'hits': entry.hits} for entry in top if entry.hits]
+        stats['hit_rate'] = round(stats['hits'] / stats['lookups'], 4) if stats['lookups'] else 0.0
+        stats['max_bytes'] = self.max_bytes
+        stats['max_entries'] = self.max_entries
+        stats['threshold'] = self.threshold
+        stats['numpy'] = numpy is not None
+        return stats
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+会话活动合并写入模块
+每条消息只在内存中记录会话的最后活动时间，后台线程每隔几秒把积累的变化
+用一次批量UPDATE写入 user_sessions，进程正常退出时再写入最后一批
+"""
+
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Tuple
+
+
+def _utc_now() -> str:
+    """与SQLite CURRENT_TIMESTAMP 相同格式的UTC时间"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class SessionActivityTracker:
+    """合并会话活动时间更新的跟踪器"""
+
+    def __init__(self, db, flush_interval: float = 5.0):
+        """
+        初始化跟踪器
+
+        Args:
+            db: DatabaseManager 实例
+            flush_interval: 批量写入间隔（秒）
+        """
+        self.db = db
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # 同时保证任意时刻只有一次写入，避免旧批次覆盖新批次
+        self._flush_lock = threading.Lock()
+        self._pending: Dict[str, Tuple[str, bool]] = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {'touches': 0, 'flushes': 0, 'rows_written': 0, 'failures': 0}
+
+    def touch(self, session_id: str):
+        """记录会话有新活动（只写内存）"""
+        if not session_id:
+            return
+        with self._lock:
+            self.stats['touches'] += 1
+            # 已关闭的会话不再因迟到的消息变回活动状态
+            closed = self._pending.get(session_id, (None, False))[1]
+            self._pending[session_id] = (_utc_now(), closed)
+
+    def close(self, session_id: str):
+        """记录会话已关闭，与活动时间一起在下一批写入"""
+        if not session_id:
+            return
+        with self._lock:
+            self._pending[session_id] = (_utc_now(), True)
+
+    def flush(self) -> int:
+        """
+        把积累的变化写入数据库
+
+        Returns:
+            int: 写入的会话数，失败返回0（变化保留到下一次重试）
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return 0
+            if self.db.flush_session_activity(batch):
+                with self._lock:
+                    self.stats['flushes'] += 1
+                    self.stats['rows_written'] += len(batch)
+                return len(batch)
+
+            with self._lock:
+                self.stats['failures'] += 1
+                # 写入失败时放回；期间已有更新的会话保留较新的时间，但不丢失关闭状态
+                for session_id, (last_activity, closed) in batch.items():
+                    newer = self._pending.get(session_id)
+                    if newer is None:
+                        self._pending[session_id] = (last_activity, closed)
+                    elif closed and not newer[1]:
+                        self._pending[session_id] = (newer[0], True)
+            return 0
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"会话活动写入出错: {str(e)}")
+
+    def start(self):
+        """启动后台写入线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='session-activity', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止后台线程并写入剩余的变化"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.flush_interval + 1)
+            self._thread = None
+        self.flush()
+
+    def get_stats(self) -> Dict:
+        """获取跟踪器统计信息"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self._pending)
+        stats['flush_interval'] = self.flush_interval
+        return stats